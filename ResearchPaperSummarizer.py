@@ -1,28 +1,209 @@
+import time
+_RUN_STARTED = time.perf_counter()
+
 import logging
 import streamlit as st
 import pandas as pd
-import tempfile
 import os
-import re
-from src import AVAILABLE_MODELS, INPUT_DIR, OUTPUT_DIR, LOG_DIR, DB_PATH
+import sqlite3
+import uuid
+from src import AVAILABLE_MODELS, LOG_DIR, DB_PATH
+from src.config import APP_COLD_BUDGET_MS, APP_HISTORY_LIMIT, APP_RERUN_BUDGET_MS, JOB_POLL_SECONDS
+# the app never loads the extraction and LLM stacks (PyMuPDF, Tesseract,
+# LangChain): it queues jobs and `python -m src.worker` runs them
 from src import (
     init_db, 
+    connect_db,
     insert_upload, 
-    insert_metadata, 
-    insert_output,
+    savepoint,
     fetch_all_uploads, 
     fetch_metadata, 
     fetch_upload_blob,
-    fetch_output_blob
-)
-import tempfile, os, re, uuid
-from src.utils import setup_logger, DEBUG, INFO
-from src.utils import (
-    TextExtractionError, DOIParsingError, TitleAuthorParsingError,
-    SummarizationError, DatabaseError, FileSaveError
+    fetch_output_blob,
+    fetch_upload_by_digest,
+    fetch_metrics,
+    fetch_jobs,
+    enqueue,
+    batch_progress,
+    is_finished,
+    job_fields
 )
-from src import extract_text, find_doi_issn, extract_title_authors, Summarizer
+from src.utils import setup_logger, log_to_file, INFO
+from src.utils import DatabaseError, FileSaveError
+from src import metrics
+
+
+# batches a session keeps showing
+MAX_TRACKED_BATCHES = 10
+
+
+# --- process-wide resources ----------------------------------------------------
+#
+# Streamlit re-executes this script on every widget interaction; these are
+# set up once per server process and reused by every rerun and session.
+
+@st.cache_resource
+def _configure_logging() -> dict:
+    # console logging once; each batch adds its own log file (log_to_file)
+    setup_logger(name=None, level=INFO)
+    return {"runs": 0}        # script runs in this process, for the timing report
+
+
+def _session_conn():
+    """
+    One DB connection per browser session, kept across its reruns. Not
+    shared between sessions: queueing a batch commits the connection,
+    and two sessions' batches must not commit each other's rows.
+    """
+    if "conn" not in st.session_state:
+        st.session_state.conn = init_db(DB_PATH, check_same_thread=False)
+    return st.session_state.conn
+
+
+def _on_download(fetch):
+    """
+    download_button data that reads a stored file only when it is
+    downloaded, not on every rerun. Streamlit calls it outside the script
+    run, so it opens its own connection; fetch(conn) returns the stream.
+    """
+    def read() -> bytes:
+        conn = connect_db(DB_PATH)
+        try:
+            stream = fetch(conn)
+            if stream is None:
+                raise FileSaveError("The file is no longer stored")
+            with stream:
+                return stream.read()
+        finally:
+            conn.close()
+    return read
+
+
+def show_performance(conn, batch_id=None, uid=None, names=None):
+    """Per-stage timings of a batch or an upload, and per-file totals for a batch."""
+    try:
+        spans = fetch_metrics(conn, batch_id=batch_id, uid=uid)
+    except DatabaseError as e:
+        st.caption(f"Could not load timings: {e.message}")
+        return
+    if not spans:
+        st.caption("No timings recorded.")
+        return
+    summary = pd.DataFrame(metrics.stage_summary(spans)).set_index("stage")
+    st.dataframe(summary)
+    st.bar_chart(summary["total_ms"])
+    per_file = metrics.upload_breakdown(spans)
+    if batch_id is not None and per_file:
+        df = pd.DataFrame.from_dict(per_file, orient="index").fillna(0.0)
+        df.index = [(names or {}).get(u, u) for u in df.index]
+        st.markdown("**Per file (ms)**")
+        st.dataframe(df)
+
+
+
+def _tracked_batches() -> list:
+    """This session's queued batches; a reloaded tab gets them back from the URL."""
+    if "batches" not in st.session_state:
+        st.session_state.batches = [b for b in st.query_params.get("batches", "").split(",") if b]
+    return st.session_state.batches
+
+
+def _track_batch(batch_id: str) -> None:
+    batches = _tracked_batches()
+    batches.append(batch_id)
+    del batches[:-MAX_TRACKED_BATCHES]
+    st.query_params["batches"] = ",".join(batches)
+
+
+def _job_note(conn, job) -> str:
+    if job["state"] == "done" and job["reused_from"]:
+        # "offer": the reused summary is shown as such; Force recompute re-runs the LLM
+        try:
+            match = fetch_upload_by_digest(conn, job["reused_from"])
+        except DatabaseError:
+            match = None
+        name = match[1] if match else job["reused_from"][:12]
+        return f"summary reused from near-duplicate {name} (tick Force recompute to redo)"
+    if job["state"] == "queued" and job["error"]:
+        return f"retrying after: {job['error']}"
+    if job["state"] == "failed":
+        return job["error"] or ""
+    return ""
+
+
+def _show_batch(conn, batch_id, jobs):
+    counts = batch_progress(jobs)
+    finished = counts["done"] + counts["failed"]
+    st.markdown(f"**Batch** `{batch_id}` — {finished}/{counts['total']} finished")
+    if not is_finished(jobs):
+        st.progress(finished / counts["total"])
+        if counts["queued"] == counts["total"]:
+            st.caption("Queued for the workers (`python -m src.worker`); you can close this tab and come back.")
+    st.dataframe(
+        pd.DataFrame(
+            [(j["file_name"], j["state"], j["attempts"], _job_note(conn, j)) for j in jobs],
+            columns=["File", "State", "Attempts", "Note"]
+        ),
+        hide_index=True
+    )
+    # fields as the workers stream them (src.worker stores them on the job)
+    for j in jobs:
+        fields = job_fields(j)
+        if j["state"] == "summarizing" or (fields and j["state"] == "done"):
+            status = "generating…" if j["state"] == "summarizing" else "done"
+            st.markdown(
+                f"**{j['file_name']}** — {status}  \n"
+                f"- **Title:** {fields.get('title', '…')}  \n"
+                f"- **Authors:** {fields.get('authors', '…')}  \n"
+                f"- **Summary:** {fields.get('summary', '…')}"
+            )
+    if not is_finished(jobs):
+        return
+    excel = fetch_output_blob(conn, batch_id)
+    if excel is not None:
+        excel.close()
+        st.success(f" Completed batch {batch_id}")
+        st.download_button(
+            " Download Metadata as Excel",
+            data=_on_download(lambda c: fetch_output_blob(c, batch_id)),
+            file_name=f"papers_{batch_id}.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            key=f"excel_{batch_id}"
+        )
+    elif counts["done"] == 0:
+        st.error(" No metadata extracted; please check logs.")
+    with st.expander("Performance"):
+        show_performance(conn, batch_id=batch_id,
+                         names={j["uid"]: j["file_name"] for j in jobs})
+
+
+def show_batches(conn, batch_ids):
+    """Progress of the session's batches, newest first; polls the queue while any is unfinished."""
+    def load():
+        return {b: fetch_jobs(conn, batch_id=b) for b in reversed(batch_ids)}
+
+    try:
+        active = {b for b, jobs in load().items() if not is_finished(jobs)}
+    except DatabaseError as e:
+        st.error(f"Error retrieving batches: {e.message}")
+        return
 
+    @st.fragment(run_every=JOB_POLL_SECONDS if active else None)
+    def panel():
+        try:
+            batches = load()
+        except DatabaseError as e:
+            st.error(f"Error retrieving batches: {e.message}")
+            return
+        if any(is_finished(batches[b]) for b in active):
+            # full rerun: the history picks up the results, and polling
+            # stops once nothing is left running
+            st.rerun()
+        for batch_id, jobs in batches.items():
+            if jobs:
+                _show_batch(conn, batch_id, jobs)
+
+    panel()
 
 
 def main():
@@ -33,21 +214,21 @@ def main():
         initial_sidebar_state="expanded"
     )
 
-    batch_id = uuid.uuid4().hex
-    log_path = os.path.join(LOG_DIR, f"{batch_id}.log")
-
-    setup_logger(name=None, level=INFO, log_file=log_path)
+    timer = metrics.PhaseTimer(_RUN_STARTED)
+    timer.mark("imports")
+    state = _configure_logging()
+    state["runs"] += 1
+    cold = state["runs"] == 1
     logger = logging.getLogger(__name__)
-    logger.info(f"Logger configured, writing to {log_path}")
-
+    timer.mark("setup")
 
     try:
-        conn = init_db(DB_PATH)
+        conn = _session_conn()
     except DatabaseError as e:
         logger.error("DB init failed", exc_info=e)
         st.error("Internal error initializing database.")
         return
-    
+    timer.mark("db")
 
     with st.sidebar:
         st.markdown("## How to use")
@@ -94,121 +275,67 @@ def main():
             )
         else:
             pages_limit = None
+        force_recompute = st.checkbox(" Force recompute", value=False,
+                           help="Ignore cached results for PDFs that were already processed with this model")
         st.markdown("---")
         process_btn = st.button("Summarize")
+    timer.mark("page")
 
     
     if uploaded and process_btn:
-
-        logger.info(f"Starting batch {batch_id} ({len(uploaded)} files)")
-
-        records = []
-        with mid:
-            progress = st.progress(0)
-        total = len(uploaded)
-
-        for idx, pdf in enumerate(uploaded, start=1):
-            uid = uuid.uuid4().hex
-            
-            safe_name = pdf.name.replace(" ", "_")
-            input_path = os.path.join(INPUT_DIR, f"{uid}_{safe_name}")
-
-            try:
-
+        batch_id = uuid.uuid4().hex
+        max_pages = None if read_all else pages_limit
+
+        # the app only stores the PDFs and queues them; `python -m src.worker`
+        # processes run the jobs, whether or not this session stays open
+        with metrics.recording(batch_id) as recorder, log_to_file(os.path.join(LOG_DIR, f"{batch_id}.log")):
+            logger.info(f"Queueing batch {batch_id} ({len(uploaded)} files)")
+            queued = 0
+            for pdf in uploaded:
+                uid = uuid.uuid4().hex
                 content = pdf.read()
-                with open(input_path, "wb") as f:
-                    f.write(content)
-                logger.info(f"Saved input: {input_path}")
-            except Exception as e:
-                logger.error(f"FileSaveError for {pdf.name}: {e}")
-                st.warning(f"Could not save {pdf.name}, skipping.")
-                continue
 
+                # the PDF is kept once, in the content-addressed blob store;
+                # a file that fails leaves neither its upload nor its job
+                try:
+                    with metrics.span("save", uid=uid), savepoint(conn, "upload"):
+                        insert_upload(conn, uid, pdf.name, content, llm_model, commit=False)
+                        enqueue(conn, uid, batch_id, llm_model, max_pages=max_pages,
+                                force=force_recompute, commit=False)
+                    queued += 1
+                    logger.debug(f"Queued upload UID={uid}")
+                except FileSaveError as e:
+                    logger.error(f"FileSaveError for {pdf.name}: {e.message}")
+                    with mid:
+                        st.warning(f"Could not save {pdf.name}, skipping.")
+                except DatabaseError as e:
+                    logger.error(f"DB Error on upload insert UID={uid}: {e.message}")
+                    with mid:
+                        st.warning(f"Database error for {pdf.name}, skipping.")
 
+            # the uploads and their jobs reach the workers in one commit
             try:
-                insert_upload(conn, uid, pdf.name, content, llm_model)
-                logger.debug(f"Inserted upload record: UID={uid}")
-            except DatabaseError as e:
-                logger.error(f"DB Error on upload insert UID={uid}: {e.message}")
-                st.warning(f"Database error for {pdf.name}, skipping.")
-                continue
-
-
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-            tmp.write(content)
-            tmp.close()
-
-            try:
-                max_pages = None if read_all else pages_limit
-                text = extract_text(tmp.name, ocr_max_pages=max_pages)                 
-                meta = Summarizer(llm_model).extract_metadata(text)     # your LLM call
-
-                rec = {
-                "DOI/ISSN": meta.doi_issn,
-                "Title":    meta.title,
-                "Authors":  meta.authors,
-                "Summary":  meta.summary
-                }
-                records.append(rec)
-                insert_metadata(
-                    conn,
-                    uid,
-                    batch_id,               # now passing batch_id
-                    rec["DOI/ISSN"],
-                    rec["Title"],
-                    rec["Authors"],
-                    rec["Summary"],
-                    llm_model
-                )
-                logger.info(f"Processed UID={uid}: {rec['Title']}")
-            except TextExtractionError as e:
-                logger.warning(f"TextExtractionError UID={uid}: {e.message}")
-            except DOIParsingError as e:
-                logger.warning(f"DOIParsingError UID={uid}: {e.message}")
-            except TitleAuthorParsingError as e:
-                logger.warning(f"TitleAuthorParsingError UID={uid}: {e.message}")
-            except SummarizationError as e:
-                logger.error(f"SummarizationError UID={uid}: {e.message}")
-            except DatabaseError as e:
-                logger.error(f"DatabaseError on metadata insert UID={uid}: {e.message}")
-            except Exception as e:
-                logger.exception(f"Unexpected error UID={uid}: {e}")
-            finally:
-                os.unlink(tmp.name)
-
-            progress.progress(idx / total)
-
-        if records:
-            try:
-                
-                df = pd.DataFrame(records)
-                output_path = os.path.join(OUTPUT_DIR, f"{batch_id}.xlsx")
-                df.to_excel(output_path, index=False, sheet_name="Metadata")
-                logger.info(f"Wrote output Excel: {output_path}")
-
-                
-                with open(output_path, "rb") as f:
-                    excel_bytes = f.read()
-                insert_output(conn, batch_id, excel_bytes)
-                logger.debug(f"Inserted output record for batch {batch_id}")
-
-            except DatabaseError as e:
-                logger.error(f"DatabaseError on output insert: {e.message}")
-            except Exception as e:
-                logger.error(f"Unexpected error inserting output: {e}")
-
-
-            with mid:
-                st.success(f" Completed batch {batch_id}")
-                st.download_button(
-                    " Download Metadata as Excel",
-                    data=excel_bytes,
-                    file_name=f"papers_{batch_id}.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-        else:
-            with mid:
-                st.error(" No metadata extracted; please check logs.")
+                with metrics.span("db_insert"):
+                    conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"DB Error committing batch {batch_id}: {e}")
+                with mid:
+                    st.error("Could not queue the batch; please check logs.")
+                queued = 0
+
+            if recorder is not None:
+                try:
+                    recorder.flush(conn)
+                except DatabaseError as e:
+                    logger.warning(f"Could not record metrics for batch {batch_id}: {e.message}")
+        if queued:
+            _track_batch(batch_id)
+
+    batches = _tracked_batches()
+    if batches:
+        with mid:
+            show_batches(conn, batches)
+    timer.mark("batches")
 
 
     with mid:
@@ -216,7 +343,7 @@ def main():
         st.header(" Previously Processed File")
 
     try:
-        uploads = fetch_all_uploads(conn)  
+        uploads = fetch_all_uploads(conn, limit=APP_HISTORY_LIMIT)
         if uploads:
             
             display_map = {
@@ -244,13 +371,29 @@ def main():
                     st.markdown(f"- **Summary:**  \n> {md['summary']}")
                     st.markdown(f"- **Model:** {md['model_name']}")
 
+                    # re-runs only the LLM stage, on a worker; text comes from the extraction cache
+                    if st.button(f"Re-summarize with {llm_model}"):
+                        try:
+                            rerun_id = uuid.uuid4().hex
+                            enqueue(conn, selected_uid, rerun_id, llm_model, kind="resummarize")
+                            _track_batch(rerun_id)
+                            st.rerun()
+                        except DatabaseError as e:
+                            logger.error(f"Could not queue re-summarize UID={selected_uid}: {e.message}")
+                            st.error(f"Could not queue re-summarize: {e.message}")
+
+                    with st.expander("Performance"):
+                        show_performance(conn, uid=selected_uid)
+
                 # Download original PDF
+                # the streams only tell whether the files exist; they are read on download
                 blob, fname = fetch_upload_blob(conn, selected_uid)
                 if blob:
+                    blob.close()
                     with mid:
                         st.download_button(
                             " Download Input PDF",
-                            data=blob,
+                            data=_on_download(lambda c: fetch_upload_blob(c, selected_uid)[0]),
                             file_name=f"{selected_uid}_{fname}",
                             mime="application/pdf"
                         )
@@ -258,10 +401,11 @@ def main():
                 # Download the Excel for this batch
                 excel_blob = fetch_output_blob(conn, md["batch_id"])
                 if excel_blob:
+                    excel_blob.close()
                     with mid:
                         st.download_button(
                             " Download Summary Excel",
-                            data=excel_blob,
+                            data=_on_download(lambda c: fetch_output_blob(c, md["batch_id"])),
                             file_name=f"batch_{md['batch_id']}.xlsx",
                             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                         )
@@ -274,9 +418,39 @@ def main():
         else:
             with mid:
                 st.info("No previous uploads found.")
-    except DatabaseError as e:
+    except (DatabaseError, FileSaveError) as e:
         with mid:
             st.error(f"Error retrieving records: {e.message}")
 
+    timer.mark("history")
+
+    with mid:
+        with st.expander("Metrics export"):
+            # built on demand: aggregating the metrics table on every rerun is wasted work
+            if st.button("Prepare metrics export"):
+                try:
+                    prom = metrics.prometheus_text(conn)
+                    st.download_button(" Download metrics (Prometheus text)", data=prom,
+                                       file_name="metrics.prom", mime="text/plain")
+                except DatabaseError as e:
+                    st.caption(f"Could not export metrics: {e.message}")
+            st.caption("Or serve them for scraping: `python -m src.metrics serve --port 9464`")
+
+    _report_timing(timer, cold)
+
+
+def _report_timing(timer: metrics.PhaseTimer, cold: bool) -> None:
+    """Log this run's phase timings and flag runs over the cold-start/rerun budget."""
+    budget = APP_COLD_BUDGET_MS if cold else APP_RERUN_BUDGET_MS
+    kind = "cold run" if cold else "rerun"
+    total = timer.total_ms
+    logger = logging.getLogger(__name__)
+    if total > budget:
+        logger.warning(f"[startup] {kind} took {total:.0f} ms, over the {budget} ms budget: {timer.report()}")
+    else:
+        logger.info(f"[startup] {kind}: {timer.report()}")
+    with st.sidebar:
+        st.caption(f"{kind.capitalize()}: {total:.0f} ms (budget {budget} ms)")
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1 @@
+"""Offline benchmark suite: synthetic corpus, fake LLM and stage runner (python -m benchmarks.run)."""
@@ -0,0 +1,67 @@
+"""
+Compare two benchmark reports.
+
+    python -m benchmarks.compare base.json new.json [--threshold 10]
+
+Prints throughput, p50/p99 latency and peak RSS per stage with the
+relative change, and exits 1 if any of them got worse by more than
+--threshold percent.
+"""
+import argparse
+import json
+import sys
+
+
+# metric -> (path into the stage result, True if higher is better)
+METRICS = {
+    "throughput/s": (("throughput_per_s",), True),
+    "p50 ms": (("latency_ms", "p50"), False),
+    "p99 ms": (("latency_ms", "p99"), False),
+    "peak MiB": (("peak_rss_mb",), False),
+}
+
+
+def _get(stage: dict, path):
+    for key in path:
+        if not isinstance(stage, dict) or key not in stage:
+            return None
+        stage = stage[key]
+    return stage
+
+
+def compare(base: dict, new: dict, threshold: float):
+    """Rows of (stage, metric, base, new, change %, regressed)."""
+    rows = []
+    for name in sorted(set(base["stages"]) | set(new["stages"])):
+        a, b = base["stages"].get(name, {}), new["stages"].get(name, {})
+        for metric, (path, higher_better) in METRICS.items():
+            va, vb = _get(a, path), _get(b, path)
+            if va is None or vb is None:
+                continue
+            change = (vb - va) / va * 100 if va else 0.0
+            worse = -change if higher_better else change
+            rows.append((name, metric, va, vb, change, worse > threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.compare", description="Diff two benchmark reports.")
+    ap.add_argument("base")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=10.0, help="percent change counted as a regression")
+    args = ap.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"base {base['meta'].get('git_commit')}  ->  new {new['meta'].get('git_commit')}")
+    rows = compare(base, new, args.threshold)
+    for name, metric, va, vb, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:16s} {metric:13s} {va:12.3f} {vb:12.3f} {change:+8.1f}%{flag}")
+    return 1 if any(r[-1] for r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Reproducible synthetic paper corpus.
+
+Every PDF is built from a seeded RNG: a first page with title, authors,
+DOI and abstract, then numbered sections and references. Three kinds:
+
+- native:  text layer on every page
+- scanned: every page is a noisy, slightly rotated JPEG with no text layer
+- mixed:   odd pages native, even pages scanned
+
+The same seed and sizes give the same text, layout and metadata, so runs
+on different versions of the code see the same input.
+"""
+import io
+import os
+import random
+from dataclasses import asdict, dataclass
+from typing import List
+
+import fitz
+import numpy as np
+from PIL import Image
+
+
+KINDS = ("native", "scanned", "mixed")
+
+_WORDS = (
+    "model data learning network training method results performance analysis approach "
+    "system algorithm proposed feature loss detection evaluation dataset accuracy baseline "
+    "experiment distribution parameter optimization gradient sample inference estimate "
+    "robust efficient significant observed compared improve structure signal bandit reward "
+    "policy regret drift adaptive stationary convolution object dense anchor focal class"
+).split()
+_FIRST = "Ada Alan Grace Edsger Barbara Donald Frances Tim Leslie Radia Shafi Yoshua".split()
+_LAST = "Lovelace Turing Hopper Dijkstra Liskov Knuth Allen Berners-Lee Lamport Perlman Goldwasser Bengio".split()
+_SECTIONS = ["Introduction", "Related Work", "Method", "Experiments", "Results", "Discussion", "Conclusion"]
+
+_PAGE = fitz.Rect(0, 0, 595, 842)          # A4 in points
+_BODY = fitz.Rect(60, 60, 535, 790)
+_SCAN_DPI = 150
+
+
+@dataclass
+class CorpusPdf:
+    path: str
+    kind: str
+    pages: int
+    doi: str
+    title: str
+    authors: str
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(4, 8)))
+
+
+def _paper_text(rng: random.Random, n_pages: int):
+    """Title, authors, DOI and the body text of each page."""
+    title = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(5, 9))).title()
+    authors = ", ".join(f"{rng.choice(_FIRST)} {rng.choice(_LAST)}" for _ in range(rng.randint(2, 5)))
+    doi = f"10.5555/bench.{rng.getrandbits(32):08x}"
+
+    pages = ["Abstract\n" + _paragraph(rng) + "\n\n" + _paragraph(rng)]
+    sections = iter(enumerate(_SECTIONS, start=1))
+    for _ in range(1, n_pages - 1 if n_pages > 2 else n_pages):
+        body = []
+        for _ in range(2):
+            n, name = next(sections, (None, None))
+            if n is not None:
+                body.append(f"{n} {name}")
+            body.extend(_paragraph(rng) for _ in range(2))
+        pages.append("\n\n".join(body))
+    if n_pages > 2:
+        refs = "\n".join(f"[{i}] {rng.choice(_LAST)}, {_sentence(rng)} 10.5555/ref.{i}" for i in range(1, 16))
+        pages.append("References\n" + refs)
+    return title, authors, doi, pages[:n_pages]
+
+
+def _draw_page(page: fitz.Page, text: str, first: bool, title: str, authors: str, doi: str) -> None:
+    body = fitz.Rect(_BODY)
+    if first:
+        page.insert_textbox(fitz.Rect(60, 60, 535, 130), title, fontsize=18, fontname="hebo", align=1)
+        page.insert_textbox(fitz.Rect(60, 135, 535, 160), authors, fontsize=11, fontname="helv", align=1)
+        page.insert_textbox(fitz.Rect(60, 162, 535, 178), f"https://doi.org/{doi}", fontsize=8, fontname="helv", align=1)
+        body.y0 = 190
+    # insert_textbox draws nothing if the text overflows; shrink until it fits
+    for size in (10, 9, 8, 7, 6):
+        if page.insert_textbox(body, text, fontsize=size, fontname="helv") >= 0:
+            return
+    raise ValueError("synthetic page text does not fit")
+
+
+def _scan(page: fitz.Page, rng: np.random.Generator) -> bytes:
+    """The page as a grey, noisy, slightly skewed JPEG, like a photocopy."""
+    pix = page.get_pixmap(dpi=_SCAN_DPI, colorspace=fitz.csGRAY)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width).astype(np.int16)
+    gray = np.clip(gray * 0.85 + 25 + rng.normal(0, 12, gray.shape), 0, 255).astype(np.uint8)
+    img = Image.fromarray(gray, "L").rotate(float(rng.uniform(-1.5, 1.5)), fillcolor=235, resample=Image.BILINEAR)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=70)
+    return buf.getvalue()
+
+
+def make_pdf(path: str, kind: str, n_pages: int, seed: int) -> CorpusPdf:
+    """Write one synthetic paper of the given kind to path."""
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    title, authors, doi, pages = _paper_text(rng, n_pages)
+
+    out = fitz.open()
+    for i, text in enumerate(pages):
+        scanned = kind == "scanned" or (kind == "mixed" and i % 2 == 1)
+        if not scanned:
+            _draw_page(out.new_page(width=_PAGE.width, height=_PAGE.height), text, i == 0, title, authors, doi)
+            continue
+        src = fitz.open()
+        _draw_page(src.new_page(width=_PAGE.width, height=_PAGE.height), text, i == 0, title, authors, doi)
+        out.new_page(width=_PAGE.width, height=_PAGE.height).insert_image(_PAGE, stream=_scan(src[0], np_rng))
+        src.close()
+
+    # fixed dates keep the bytes identical between runs
+    out.set_metadata({"title": title, "author": authors, "creationDate": "D:20240101000000",
+                      "modDate": "D:20240101000000", "producer": "benchmarks.corpus"})
+    out.save(path, garbage=3, deflate=True, no_new_id=True)
+    out.close()
+    return CorpusPdf(path, kind, n_pages, doi, title, authors)
+
+
+def make_corpus(out_dir: str, counts: dict, pages: int = 8, seed: int = 0) -> List[CorpusPdf]:
+    """counts maps kind -> number of PDFs, e.g. {"native": 20, "scanned": 4, "mixed": 4}."""
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = []
+    for kind in KINDS:
+        for i in range(counts.get(kind, 0)):
+            path = os.path.join(out_dir, f"{kind}-{i:04d}.pdf")
+            corpus.append(make_pdf(path, kind, pages, seed * 100_003 + KINDS.index(kind) * 10_007 + i))
+    return corpus
+
+
+def corpus_manifest(corpus: List[CorpusPdf]) -> List[dict]:
+    return [asdict(p) for p in corpus]
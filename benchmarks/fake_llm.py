@@ -0,0 +1,100 @@
+"""
+Deterministic stand-in for the Groq chat model.
+
+FakeChatModel answers the metadata prompts (single-paper and packed)
+with JSON built from a hash of the prompt, after a configurable latency:
+a fixed time to first token plus a per-output-token time, with optional
+seeded jitter. install_fake_llm() swaps it in for every LLMModel and
+gives the model rate limits high enough not to throttle the benchmark
+(or the ones passed in).
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from contextlib import contextmanager
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+
+_PAPER_RE = re.compile(r"^### Paper (\d+)$", re.M)
+_FIELD_RE = re.compile(r"^- (doi_issn|title|authors|summary):", re.M)
+
+
+class FakeChatModel:
+    def __init__(self, latency: float = 0.5, token_latency: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.latency = latency                # seconds to first token
+        self.token_latency = token_latency    # seconds per output token
+        self.jitter = jitter                  # +- fraction of the total delay
+        self.seed = seed
+        self.calls = 0
+
+    def _reply(self, messages):
+        system, user = str(messages[0].content), str(messages[-1].content)
+        digest = hashlib.sha256(f"{self.seed}|{user}".encode()).hexdigest()
+        fields = _FIELD_RE.findall(system) or ["doi_issn", "title", "authors", "summary"]
+
+        def one(tag: str) -> dict:
+            values = {
+                "doi_issn": "",
+                "title": f"Synthetic title {tag}",
+                "authors": "Ada Lovelace, Alan Turing",
+                "summary": " ".join(f"Sentence {i} about paper {tag}." for i in range(1, 5)),
+            }
+            return {f: values[f] for f in fields}
+
+        papers = _PAPER_RE.findall(user)
+        if papers:
+            body = json.dumps([{"paper": int(n), **one(f"{digest[:8]}-{n}")} for n in papers])
+        else:
+            body = json.dumps(one(digest[:8]))
+        rng = random.Random(digest)
+        n_out = (len(body) + 3) // 4
+        delay = self.latency + n_out * self.token_latency
+        delay *= 1 + rng.uniform(-self.jitter, self.jitter)
+        usage = {"input_tokens": (len(system) + len(user)) // 4, "output_tokens": n_out}
+        usage["total_tokens"] = usage["input_tokens"] + n_out
+        self.calls += 1
+        return body, max(delay, 0.0), usage
+
+    def invoke(self, messages, **kwargs) -> AIMessage:
+        body, delay, usage = self._reply(messages)
+        time.sleep(delay)
+        return AIMessage(content=body, usage_metadata=usage)
+
+    async def ainvoke(self, messages, **kwargs) -> AIMessage:
+        body, delay, usage = self._reply(messages)
+        await asyncio.sleep(delay)
+        return AIMessage(content=body, usage_metadata=usage)
+
+    async def astream(self, messages, **kwargs):
+        body, delay, usage = self._reply(messages)
+        chunks = [body[i:i + 16] for i in range(0, len(body), 16)]
+        first = delay - self.token_latency * ((len(body) + 3) // 4)
+        await asyncio.sleep(max(first, 0.0))
+        for i, text in enumerate(chunks):
+            await asyncio.sleep(self.token_latency * 4)
+            last = i == len(chunks) - 1
+            yield AIMessageChunk(content=text, usage_metadata=usage if last else None)
+
+
+@contextmanager
+def install_fake_llm(model_name: str, fake: FakeChatModel, rpm: int = 10**6, tpm: int = 10**9):
+    """Route every LLM client lookup to fake, with rpm/tpm limits for model_name."""
+    import src.ratelimit as ratelimit
+    import src.summarizer as summarizer
+
+    original = summarizer.get_llm_client
+    old_limiter = ratelimit._limiters.get(model_name)
+    summarizer.get_llm_client = lambda name: fake
+    ratelimit._limiters[model_name] = ratelimit.RateLimiter(ratelimit.ModelLimits(rpm=rpm, tpm=tpm))
+    try:
+        yield fake
+    finally:
+        summarizer.get_llm_client = original
+        if old_limiter is None:
+            ratelimit._limiters.pop(model_name, None)
+        else:
+            ratelimit._limiters[model_name] = old_limiter
@@ -0,0 +1,125 @@
+"""
+OpenAI-compatible stand-in server for load tests.
+
+Serves POST /v1/chat/completions (plain and streamed) with FakeChatModel's
+deterministic answers and latency, so the whole pipeline, including the
+"openai" backend's HTTP path and connection pool, can be driven without
+a real model:
+
+    python -m benchmarks.fake_server --port 8099 --latency 0.5
+    LLM_BACKENDS='{"bench-model": "http://localhost:8099/v1"}' \\
+        python -m src.cli papers/ --model bench-model -o out.jsonl
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from benchmarks.fake_llm import FakeChatModel
+
+
+_MESSAGES = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+
+
+def _usage(usage: dict) -> dict:
+    return {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"],
+            "total_tokens": usage["total_tokens"]}
+
+
+def make_handler(fake: FakeChatModel):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"       # keep-alive, like a real server
+
+        def _json(self, status: int, obj: dict) -> None:
+            body = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._json(404, {"error": {"message": "not found"}})
+                return
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            messages = [_MESSAGES.get(m["role"], HumanMessage)(content=m["content"]) for m in req["messages"]]
+            with lock:
+                body, delay, usage = fake._reply(messages)
+            model = req.get("model", "fake")
+
+            if not req.get("stream"):
+                time.sleep(delay)
+                self._json(200, {
+                    "id": "chatcmpl-fake", "object": "chat.completion", "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": body},
+                                 "finish_reason": "stop"}],
+                    "usage": _usage(usage),
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            n_out = (len(body) + 3) // 4
+            time.sleep(max(delay - fake.token_latency * n_out, 0.0))
+            for i in range(0, len(body), 16):
+                time.sleep(fake.token_latency * 4)
+                event = {"object": "chat.completion.chunk", "model": model,
+                         "choices": [{"index": 0, "delta": {"content": body[i:i + 16]}}]}
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            if (req.get("stream_options") or {}).get("include_usage"):
+                event = {"object": "chat.completion.chunk", "model": model, "choices": [],
+                         "usage": _usage(usage)}
+                self._chunk(f"data: {json.dumps(event)}\n\n".encode())
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int, fake: FakeChatModel) -> ThreadingHTTPServer:
+    """Start the server on a background thread; returns it (call .shutdown() to stop)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.fake_server",
+                                 description="OpenAI-compatible stand-in LLM server.")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency", type=float, default=0.5, help="seconds to first token")
+    ap.add_argument("--token-latency", type=float, default=0.0, help="seconds per output token")
+    ap.add_argument("--jitter", type=float, default=0.1, help="+- latency fraction")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    fake = FakeChatModel(args.latency, args.token_latency, args.jitter, args.seed)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"serving http://127.0.0.1:{args.port}/v1/chat/completions", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""
+Offline benchmark suite.
+
+Generates a reproducible synthetic corpus (benchmarks.corpus), then runs
+each stage in a fresh process, so peak RSS is per stage, against a
+throw-away data directory. The LLM is benchmarks.fake_llm, so no network
+or API key is needed. Writes a JSON report with per-stage throughput,
+latency percentiles and peak memory; diff two reports with
+benchmarks.compare.
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --native 100 --scanned 10 --mixed 10 --llm-latency 1.5 --stages pipeline
+    python -m benchmarks.compare old.json bench.json
+
+OCR stages are reported as skipped when no Tesseract backend is installed.
+Peak RSS is the stage process's own; OCR worker processes are not included.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from typing import Callable, Dict, List
+
+from benchmarks.corpus import corpus_manifest, make_corpus
+
+
+SCHEMA_VERSION = 1
+
+
+# --- measurement helpers ---------------------------------------------------------
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p90/p99, max and mean of samples (seconds), in ms."""
+    if not samples:
+        return {}
+    s = sorted(samples)
+
+    def rank(p: float) -> float:
+        return s[min(len(s) - 1, max(0, int(round(p / 100 * len(s))) - 1))]
+
+    return {
+        "p50": round(rank(50) * 1000, 3),
+        "p90": round(rank(90) * 1000, 3),
+        "p99": round(rank(99) * 1000, 3),
+        "max": round(s[-1] * 1000, 3),
+        "mean": round(sum(s) / len(s) * 1000, 3),
+    }
+
+
+def _timed(fn: Callable, items) -> List[float]:
+    lat = []
+    for item in items:
+        t = time.perf_counter()
+        fn(item)
+        lat.append(time.perf_counter() - t)
+    return lat
+
+
+def _rss_mb() -> float | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _ocr_available() -> str | None:
+    """None if a Tesseract backend can run, else why not."""
+    from src.ocr import resolve_engine
+    engine = resolve_engine()
+    if engine == "tesserocr":
+        return None
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return None
+    except Exception as e:
+        return f"no OCR backend ({type(e).__name__})"
+
+
+class Skip(Exception):
+    pass
+
+
+# --- stages ---------------------------------------------------------------------
+#
+# Each stage gets the run context and returns {"latencies": [...], "items": n,
+# "unit": ..., "extra": {...}}; total_s is the sum of latencies unless given.
+
+def stage_extract_native(ctx):
+    from src.extractor import extract_pages
+    from src.summarizer import MAX_INPUT_CHARS
+    docs = [p for p in ctx["corpus"] if p["kind"] == "native"]
+    if not docs:
+        raise Skip("no native PDFs")
+    pages = []
+    lat = _timed(lambda p: pages.append(len(extract_pages(p["path"], max_chars=MAX_INPUT_CHARS))), docs)
+    return {"latencies": lat, "items": len(docs), "unit": "pdf",
+            "extra": {"pages_per_s": round(sum(pages) / sum(lat), 1)}}
+
+
+def stage_ocr_render(ctx):
+    import fitz
+    from src.ocr import render_page
+    pages = [(p["path"], i) for p in ctx["corpus"] if p["kind"] == "scanned" for i in range(p["pages"])]
+    if not pages:
+        raise Skip("no scanned PDFs")
+    dpis = []
+
+    def render(item):
+        path, i = item
+        with fitz.open(path) as doc, render_page(doc[i]) as (_, stats):
+            dpis.append(stats["dpi"])
+
+    lat = _timed(render, pages)
+    return {"latencies": lat, "items": len(pages), "unit": "page",
+            "extra": {"mean_dpi": round(sum(dpis) / len(dpis))}}
+
+
+def stage_ocr_sequential(ctx):
+    from src.extractor import _load_ocr_sequential
+    reason = _ocr_available()
+    if reason:
+        raise Skip(reason)
+    docs = [p for p in ctx["corpus"] if p["kind"] == "scanned"]
+    if not docs:
+        raise Skip("no scanned PDFs")
+    lat = _timed(lambda p: _load_ocr_sequential(p["path"]), docs)
+    n_pages = sum(p["pages"] for p in docs)
+    return {"latencies": lat, "items": len(docs), "unit": "pdf",
+            "extra": {"pages_per_s": round(n_pages / sum(lat), 2)}}
+
+
+def stage_extract_mixed(ctx):
+    from src.extractor import extract_pages, shutdown_ocr_pool
+    from src.summarizer import MAX_INPUT_CHARS
+    reason = _ocr_available()
+    if reason:
+        raise Skip(reason)
+    docs = [p for p in ctx["corpus"] if p["kind"] in ("mixed", "scanned")]
+    if not docs:
+        raise Skip("no mixed or scanned PDFs")
+    try:
+        # the first call also spawns the OCR pool; report it separately
+        t = time.perf_counter()
+        extract_pages(docs[0]["path"], max_chars=MAX_INPUT_CHARS)
+        warmup = time.perf_counter() - t
+        lat = _timed(lambda p: extract_pages(p["path"], max_chars=MAX_INPUT_CHARS), docs)
+    finally:
+        shutdown_ocr_pool()
+    return {"latencies": lat, "items": len(docs), "unit": "pdf",
+            "extra": {"first_call_s": round(warmup, 3)}}
+
+
+def stage_find_doi_issn(ctx):
+    import fitz
+    from src.get_metadata import find_doi_issn
+    texts = []
+    for p in ctx["corpus"]:
+        if p["kind"] != "scanned":
+            with fitz.open(p["path"]) as doc:
+                texts.append(doc[0].get_text())
+    if not texts:
+        raise Skip("no PDFs with a text layer")
+    items = texts * ctx["args"]["repeat"]
+    return {"latencies": _timed(find_doi_issn, items), "items": len(items), "unit": "call"}
+
+
+def stage_local_metadata(ctx):
+    from src.get_metadata import extract_local_metadata
+    docs = [p for p in ctx["corpus"] if p["kind"] != "scanned"]
+    if not docs:
+        raise Skip("no PDFs with a text layer")
+    found = []
+    lat = _timed(lambda p: found.append(extract_local_metadata(p["path"]).known().get("doi_issn") == p["doi"]), docs)
+    return {"latencies": lat, "items": len(docs), "unit": "pdf",
+            "extra": {"doi_recall": round(sum(found) / len(found), 3)}}
+
+
+def stage_select_input(ctx):
+    from src.extractor import extract_text
+    from src.selection import input_token_budget, select_input
+    docs = [p for p in ctx["corpus"] if p["kind"] == "native"]
+    if not docs:
+        raise Skip("no native PDFs")
+    texts = [extract_text(p["path"]) for p in docs] * ctx["args"]["repeat"]
+    budget = input_token_budget(ctx["args"]["model"])
+    return {"latencies": _timed(lambda t: select_input(t, budget), texts), "items": len(texts), "unit": "call"}
+
+
+def stage_db_inserts(ctx):
+    import uuid
+    from src.config import DB_PATH
+    from src.db import batch_transaction, init_db, insert_metadata_many, insert_upload
+    conn = init_db(DB_PATH)
+    uids = []
+
+    def upload(p):
+        uid = uuid.uuid4().hex
+        with open(p["path"], "rb") as f:
+            insert_upload(conn, uid, os.path.basename(p["path"]), f.read(), ctx["args"]["model"])
+        uids.append((uid, p))
+
+    lat = _timed(upload, ctx["corpus"])
+    rows = [(uid, "bench", p["doi"], p["title"], p["authors"], "summary " * 40, ctx["args"]["model"])
+            for uid, p in uids] * ctx["args"]["repeat"]
+    t = time.perf_counter()
+    with batch_transaction(conn):
+        insert_metadata_many(conn, rows, commit=False)
+    batch_s = time.perf_counter() - t
+    conn.close()
+    return {"latencies": lat, "items": len(lat), "unit": "upload",
+            "extra": {"metadata_rows": len(rows), "metadata_rows_per_s": round(len(rows) / batch_s)}}
+
+
+def _pipeline(ctx, passes: int):
+    from benchmarks.fake_llm import FakeChatModel, install_fake_llm
+    from src.config import DB_PATH
+    from src.db import init_db
+    from src.extractor import shutdown_ocr_pool
+    from src.pipeline import PaperJob, process_batch
+
+    args = ctx["args"]
+    docs = ctx["corpus"] if _ocr_available() is None else [p for p in ctx["corpus"] if p["kind"] == "native"]
+    if not docs:
+        raise Skip("no PDFs the pipeline can extract")
+    conn = init_db(DB_PATH)
+    fake = FakeChatModel(args["llm_latency"], args["llm_token_latency"], args["llm_jitter"], args["seed"])
+    # with --llm-url the model is served over HTTP (LLM_BACKENDS is set in _child_env)
+    llm = nullcontext() if args["llm_url"] else install_fake_llm(args["model"], fake, rpm=args["rpm"], tpm=args["tpm"])
+    try:
+        with llm:
+            for _ in range(passes):
+                calls_before = fake.calls
+                jobs = []
+                for i, p in enumerate(docs):
+                    with open(p["path"], "rb") as f:
+                        content = f.read()
+                    jobs.append(PaperJob(f"{i}", os.path.basename(p["path"]), content=content,
+                                         content_hash=f"bench-{i}"))
+                done, errors = [], []
+                t0 = time.perf_counter()
+                process_batch(
+                    jobs, args["model"], conn=conn,
+                    on_result=lambda r: (errors if r.error else done).append(time.perf_counter() - t0),
+                    dedup=False
+                )
+                wall = time.perf_counter() - t0
+    finally:
+        shutdown_ocr_pool()
+        conn.close()
+    # latencies here are completion times from the start of the batch
+    return {"latencies": done + errors, "items": len(jobs), "unit": "pdf", "total_s": wall,
+            "extra": {"errors": len(errors), "llm_calls": None if args["llm_url"] else fake.calls - calls_before,
+                      "ocr": _ocr_available() is None}}
+
+
+def stage_pipeline(ctx):
+    return _pipeline(ctx, passes=1)
+
+
+def stage_pipeline_warm(ctx):
+    """Second pass over the same PDFs: extraction comes from the text cache."""
+    return _pipeline(ctx, passes=2)
+
+
+STAGES: Dict[str, Callable] = {
+    "extract_native": stage_extract_native,
+    "ocr_render": stage_ocr_render,
+    "ocr_sequential": stage_ocr_sequential,
+    "extract_mixed": stage_extract_mixed,
+    "find_doi_issn": stage_find_doi_issn,
+    "local_metadata": stage_local_metadata,
+    "select_input": stage_select_input,
+    "db_inserts": stage_db_inserts,
+    "pipeline": stage_pipeline,
+    "pipeline_warm": stage_pipeline_warm,
+}
+
+
+# --- runner ---------------------------------------------------------------------
+
+def _child_env(env: Dict[str, str]) -> None:
+    # before src is imported: src.config reads these at import time
+    os.environ.update(env)
+
+
+def _run_stage(name: str, ctx: dict) -> dict:
+    """Runs in a fresh process."""
+    from src.ocr import peak_rss_mb
+
+    rss_start = _rss_mb()
+    t = time.perf_counter()
+    try:
+        out = STAGES[name](ctx)
+    except Skip as e:
+        return {"skipped": str(e)}
+    wall = time.perf_counter() - t
+    total = out.get("total_s", sum(out["latencies"]))
+    result = {
+        "items": out["items"],
+        "unit": out["unit"],
+        "total_s": round(total, 4),
+        "wall_s": round(wall, 4),
+        "throughput_per_s": round(out["items"] / total, 3) if total else None,
+        "latency_ms": percentiles(out["latencies"]),
+        "rss_start_mb": rss_start,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    result.update(out.get("extra", {}))
+    return result
+
+
+def _git_commit() -> str | None:
+    try:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        rev = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> dict:
+    names = args.stages.split(",") if args.stages else list(STAGES)
+    unknown = set(names) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="rps-bench-") as work:
+        corpus_dir = args.corpus_dir or os.path.join(work, "corpus")
+        t = time.perf_counter()
+        corpus = make_corpus(corpus_dir, {"native": args.native, "scanned": args.scanned, "mixed": args.mixed},
+                             pages=args.pages, seed=args.seed)
+        corpus_s = time.perf_counter() - t
+
+        env = {
+            "ResearchPaperSummarizer_DIR": os.path.join(work, "data"),
+            "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "benchmark"),
+            "MODEL_NAME": args.model,
+        }
+        if args.llm_url:
+            env["LLM_BACKENDS"] = repr({args.model: args.llm_url})
+            env["MODEL_RATE_LIMITS"] = repr({args.model: {"rpm": args.rpm, "tpm": args.tpm}})
+        ctx = {"corpus": corpus_manifest(corpus), "args": vars(args)}
+        stages = {}
+        for name in names:
+            print(f"[bench] {name} ...", file=sys.stderr, flush=True)
+            # a fresh process per stage: clean peak RSS, cold caches and pools
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"),
+                                     initializer=_child_env, initargs=(env,)) as pool:
+                stages[name] = pool.submit(_run_stage, name, ctx).result()
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus_s": round(corpus_s, 2),
+            "args": {k: v for k, v in vars(args).items() if k != "output"},
+        },
+        "stages": stages,
+    }
+
+
+def _print_summary(report: dict) -> None:
+    for name, r in report["stages"].items():
+        if "skipped" in r:
+            print(f"{name:16s} skipped: {r['skipped']}")
+            continue
+        lat = r["latency_ms"]
+        print(f"{name:16s} {r['items']:6d} {r['unit']:6s} {r['throughput_per_s'] or 0:10.2f}/s  "
+              f"p50 {lat.get('p50', 0):9.2f} ms  p99 {lat.get('p99', 0):9.2f} ms  peak {r['peak_rss_mb']} MiB")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Run the offline benchmark suite.")
+    ap.add_argument("--output", "-o", default="bench_report.json")
+    ap.add_argument("--stages", help=f"comma-separated subset of: {', '.join(STAGES)}")
+    ap.add_argument("--native", type=int, default=20, help="native-text PDFs")
+    ap.add_argument("--scanned", type=int, default=4, help="image-only PDFs")
+    ap.add_argument("--mixed", type=int, default=4, help="PDFs alternating native and scanned pages")
+    ap.add_argument("--pages", type=int, default=8, help="pages per PDF")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--corpus-dir", help="keep the generated PDFs here instead of a temp dir")
+    ap.add_argument("--repeat", type=int, default=50, help="repetitions for the per-call micro stages")
+    ap.add_argument("--model", default="llama-3.1-8b-instant", help="model name (sets the input token budget)")
+    ap.add_argument("--llm-latency", type=float, default=0.5, help="fake LLM seconds to first token")
+    ap.add_argument("--llm-token-latency", type=float, default=0.0, help="fake LLM seconds per output token")
+    ap.add_argument("--llm-jitter", type=float, default=0.1, help="fake LLM +- latency fraction")
+    ap.add_argument("--rpm", type=int, default=10**6, help="rate limit applied to the fake LLM")
+    ap.add_argument("--tpm", type=int, default=10**9)
+    ap.add_argument("--llm-url", help="run the pipeline stages against this OpenAI-compatible server "
+                                      "(e.g. python -m benchmarks.fake_server) instead of the in-process fake")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    _print_summary(report)
+    print(f"report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,5 @@
+from importlib import import_module
+
 from .config import (
     AVAILABLE_MODELS,
     BASE_DIR,
@@ -5,14 +7,80 @@ from .config import (
     OUTPUT_DIR,
     LOG_DIR,
     DB_DIR,
-    DB_PATH
-
+    DB_PATH,
+    BLOB_DIR,
+    OLLAMA_URL
 )
-from .db import init_db, insert_upload, insert_metadata, insert_output, fetch_all_uploads, fetch_metadata, fetch_upload_blob, fetch_output_blob
-from.extractor import extract_text
 
-from .summarizer import Summarizer
-from .get_metadata import find_doi_issn, extract_title_authors, extract_all
+# Everything but the config values is loaded from its submodule on first
+# access (PEP 562), so importing the package, or the DB helpers from it,
+# does not pull in PyMuPDF, Tesseract or LangChain.
+_LAZY = {
+    "db": (
+        "init_db", "connect_db", "insert_upload", "insert_metadata", "insert_output", "fetch_all_uploads",
+        "fetch_metadata", "fetch_upload_blob", "fetch_output_blob", "fetch_cached_result",
+        "insert_cached_result", "insert_metadata_many", "batch_transaction", "savepoint", "migrate",
+        "delete_upload", "fetch_extracted_pages", "insert_extracted_pages", "fetch_upload_digest",
+        "fetch_upload_by_digest", "fetch_latest_cached_result", "insert_text_signature",
+        "fetch_lsh_candidates", "insert_metrics_many", "fetch_metrics", "fetch_metric_totals",
+        "fetch_jobs", "requeue_failed_jobs",
+    ),
+    "blobstore": (
+        "BlobStore", "get_blob_store", "migrate_inline_blobs",
+    ),
+    "extractor": (
+        "extract_text", "extract_pages", "join_pages",
+    ),
+    "llm_backends": (
+        "OpenAICompatChat", "backend_for",
+    ),
+    "summarizer": (
+        "Summarizer", "MAX_INPUT_CHARS", "MetadataStream",
+    ),
+    "selection": (
+        "InputSelection", "select_input", "input_token_budget",
+    ),
+    "get_metadata": (
+        "find_doi_issn", "extract_title_authors", "extract_all", "extract_local_metadata",
+        "LocalMetadata",
+    ),
+    "cache": (
+        "content_sha256", "make_cache_key", "get_cached_meta", "store_meta", "get_cached_pages",
+        "store_pages",
+    ),
+    "dedup": (
+        "Signature", "Duplicate", "minhash", "index_signature", "find_duplicates", "find_reusable",
+    ),
+    "doi_index": (
+        "DoiRecord", "lookup_doi", "import_dump",
+    ),
+    "metrics": (
+        "MetricsRecorder", "recording", "for_upload", "span", "record", "stage_summary",
+        "upload_breakdown", "prometheus_text", "PhaseTimer",
+    ),
+    "pipeline": (
+        "PaperJob", "PaperResult", "process_batch", "aprocess_batch", "resummarize",
+        "extraction_params", "result_params", "result_cache_key",
+    ),
+    "jobs": (
+        "Job", "enqueue", "batch_progress", "is_finished", "finish_batch", "job_fields",
+    ),
+}
+_MODULE_OF = {name: module for module, names in _LAZY.items() for name in names}
+
+
+def __getattr__(name: str):
+    module = _MODULE_OF.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_MODULE_OF))
+
 
 __all__ = [
     "AVAILABLE_MODELS",
@@ -24,15 +92,88 @@ __all__ = [
     "DB_DIR",
     "DB_PATH",
     "init_db",
+    "connect_db",
     "insert_upload",
     "insert_metadata",
     "insert_output",
     "extract_text",
+    "extract_pages",
+    "join_pages",
     "find_doi_issn",
     "extract_title_authors",
+    "extract_local_metadata",
+    "LocalMetadata",
     "fetch_all_uploads", 
     "fetch_metadata", 
     "fetch_upload_blob",
     "fetch_output_blob",
+    "fetch_cached_result",
+    "insert_cached_result",
+    "insert_metadata_many",
+    "batch_transaction",
+    "savepoint",
+    "migrate",
+    "delete_upload",
+    "fetch_extracted_pages",
+    "insert_extracted_pages",
+    "fetch_upload_digest",
+    "fetch_upload_by_digest",
+    "fetch_latest_cached_result",
+    "insert_text_signature",
+    "fetch_lsh_candidates",
+    "insert_metrics_many",
+    "fetch_metrics",
+    "fetch_metric_totals",
+    "MetricsRecorder",
+    "recording",
+    "for_upload",
+    "span",
+    "record",
+    "stage_summary",
+    "upload_breakdown",
+    "prometheus_text",
+    "PhaseTimer",
+    "Signature",
+    "Duplicate",
+    "minhash",
+    "index_signature",
+    "find_duplicates",
+    "find_reusable",
+    "DoiRecord",
+    "lookup_doi",
+    "import_dump",
+    "get_cached_pages",
+    "store_pages",
+    "resummarize",
+    "extraction_params",
+    "result_params",
+    "result_cache_key",
+    "BLOB_DIR",
+    "BlobStore",
+    "get_blob_store",
+    "migrate_inline_blobs",
+    "OpenAICompatChat",
+    "backend_for",
     "Summarizer",
+    "MAX_INPUT_CHARS",
+    "MetadataStream",
+    "InputSelection",
+    "select_input",
+    "input_token_budget",
+    "content_sha256",
+    "make_cache_key",
+    "get_cached_meta",
+    "store_meta",
+    "PaperJob",
+    "PaperResult",
+    "process_batch",
+    "aprocess_batch",
+    "fetch_jobs",
+    "requeue_failed_jobs",
+    "Job",
+    "enqueue",
+    "batch_progress",
+    "is_finished",
+    "finish_batch",
+    "job_fields",
 ]
@@ -0,0 +1,290 @@
+"""
+Content-addressed blob store for PDFs and Excel outputs.
+
+Blobs live on disk under BLOB_DIR as <ab>/<cd>/<sha256>, optionally
+compressed, and are deduplicated by their SHA-256. The `blobs` table
+(created by the migrations in src/db.py) keeps one row per digest with
+a reference count; rows in uploads/outputs point at a digest instead of
+holding the bytes inline.
+
+    python -m src.blobstore migrate [--vacuum]   # move inline BLOBs out of the DB
+    python -m src.blobstore gc                   # delete unreferenced blobs
+    python -m src.blobstore stats
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import BinaryIO, Tuple
+
+from src.config import BLOB_CODEC, BLOB_DIR, DB_PATH
+from src.utils import DatabaseError, FileSaveError, setup_logger
+
+try:
+    import zstandard
+except ImportError:          # optional; gzip is used instead
+    zstandard = None
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+# Files on disk without a committed `blobs` row are only swept after this
+# long, so a blob written by an in-flight transaction is never collected.
+ORPHAN_GRACE_SECONDS = 3600
+
+
+def _resolve_codec(codec: str) -> str:
+    if codec == "zstd" and zstandard is None:
+        return "gzip"
+    if codec not in ("zstd", "gzip", "none"):
+        raise ValueError(f"Unknown blob codec {codec!r}")
+    return codec
+
+
+class BlobStore:
+    """Hash-named, optionally compressed files with refcounts in SQLite."""
+
+    def __init__(self, root: str = BLOB_DIR, codec: str = BLOB_CODEC):
+        self.root  = root
+        self.codec = _resolve_codec(codec)
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    # --- encoding -----------------------------------------------------------
+
+    def _encode(self, data: bytes) -> bytes:
+        if self.codec == "zstd":
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        if self.codec == "gzip":
+            return gzip.compress(data, compresslevel=6)
+        return data
+
+    def _write_file(self, digest: str, data: bytes) -> int:
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = self._encode(data)
+        # write-then-rename so readers never see a half-written blob
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+        except OSError as e:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise FileSaveError(f"Could not write blob {digest}: {e}")
+        return len(payload)
+
+    # --- public API ---------------------------------------------------------
+
+    def put(self, conn, data: bytes, commit: bool = True) -> str:
+        """
+        Store data (if not already present) and take one reference on it.
+        Returns the blob's SHA-256 digest.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        try:
+            # bump first: the UPDATE takes the write lock, so gc() cannot
+            # remove the blob between our check and our reference
+            cur = conn.execute(
+                "UPDATE blobs SET refcount = refcount + 1 WHERE digest = ?", (digest,)
+            )
+            if cur.rowcount == 0:
+                stored = self._write_file(digest, data)
+                conn.execute(
+                    """
+                    INSERT INTO blobs (digest, size, stored_size, codec, refcount, created_at)
+                    VALUES (?, ?, ?, ?, 1, ?)
+                    """,
+                    (digest, len(data), stored, self.codec, datetime.now())
+                )
+            elif not os.path.exists(self.path_for(digest)):
+                # row survived but the file was lost; write it back
+                stored = self._write_file(digest, data)
+                conn.execute(
+                    "UPDATE blobs SET stored_size = ?, codec = ? WHERE digest = ?",
+                    (stored, self.codec, digest)
+                )
+            if commit:
+                conn.commit()
+            return digest
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Failed to record blob {digest}: {e}")
+
+    def open(self, conn, digest: str) -> BinaryIO:
+        """Return a readable, decompressing stream over the blob."""
+        try:
+            row = conn.execute(
+                "SELECT codec FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Could not look up blob {digest}: {e}")
+        if row is None:
+            raise FileSaveError(f"Unknown blob {digest}")
+
+        codec = row[0]
+        try:
+            if codec == "gzip":
+                # opened by path, so closing the GzipFile closes the file (fileobj= would leak it)
+                return gzip.GzipFile(self.path_for(digest), "rb")
+            raw = open(self.path_for(digest), "rb")
+        except OSError as e:
+            raise FileSaveError(f"Blob {digest} missing from {self.root}: {e}")
+        if codec == "zstd":
+            if zstandard is None:
+                raw.close()
+                raise FileSaveError(f"Blob {digest} is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return raw
+
+    def read(self, conn, digest: str) -> bytes:
+        with self.open(conn, digest) as f:
+            return f.read()
+
+    def release(self, conn, digest: str, commit: bool = True) -> None:
+        """Drop one reference; the file goes away on the next gc()."""
+        try:
+            conn.execute(
+                "UPDATE blobs SET refcount = MAX(refcount - 1, 0) WHERE digest = ?", (digest,)
+            )
+            if commit:
+                conn.commit()
+        except sqlite3.Error as e:
+            raise DatabaseError(f"Failed to release blob {digest}: {e}")
+
+    def gc(self, conn) -> Tuple[int, int]:
+        """
+        Delete blobs with no references, plus stray files that have no
+        `blobs` row. Returns (files removed, bytes freed).
+        """
+        removed, freed = 0, 0
+        try:
+            conn.commit()
+            # hold the write lock while deleting, so no put() can revive a
+            # blob whose file we are about to remove
+            conn.execute("BEGIN IMMEDIATE")
+            dead = [d for (d,) in conn.execute("SELECT digest FROM blobs WHERE refcount <= 0")]
+            for digest in dead:
+                path = self.path_for(digest)
+                if os.path.exists(path):
+                    freed += os.path.getsize(path)
+                    os.unlink(path)
+                    removed += 1
+            conn.executemany("DELETE FROM blobs WHERE digest = ?", ((d,) for d in dead))
+            conn.commit()
+            known = {d for (d,) in conn.execute("SELECT digest FROM blobs")}
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise DatabaseError(f"Blob garbage collection failed: {e}")
+
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(root, name)
+                if name in known or os.path.getmtime(path) > cutoff:
+                    continue
+                freed += os.path.getsize(path)
+                os.unlink(path)
+                removed += 1
+
+        logger.info(f"[blobstore] gc removed {removed} files, freed {freed} bytes")
+        return removed, freed
+
+
+_default_store: BlobStore | None = None
+
+
+def get_blob_store() -> BlobStore:
+    """The process-wide store rooted at BLOB_DIR."""
+    global _default_store
+    if _default_store is None:
+        _default_store = BlobStore()
+    return _default_store
+
+
+def migrate_inline_blobs(conn, store: BlobStore | None = None, batch_size: int = 50) -> Tuple[int, int]:
+    """
+    Move uploads.file_blob / outputs.excel_blob contents into the store,
+    a batch of rows per transaction. Safe to interrupt and re-run.
+    Returns (uploads moved, outputs moved).
+    """
+    store = store or get_blob_store()
+    moved = []
+    for table, key, blob_col, digest_col in (
+        ("uploads", "id",       "file_blob",  "file_digest"),
+        ("outputs", "batch_id", "excel_blob", "excel_digest"),
+    ):
+        n = 0
+        while True:
+            try:
+                rows = conn.execute(
+                    f"SELECT {key}, {blob_col} FROM {table} "
+                    f"WHERE {blob_col} IS NOT NULL AND {digest_col} IS NULL LIMIT ?",
+                    (batch_size,)
+                ).fetchall()
+                if not rows:
+                    break
+                for row_key, blob in rows:
+                    digest = store.put(conn, bytes(blob), commit=False)
+                    conn.execute(
+                        f"UPDATE {table} SET {digest_col} = ?, {blob_col} = NULL WHERE {key} = ?",
+                        (digest, row_key)
+                    )
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                raise DatabaseError(f"Blob migration failed on {table}: {e}")
+            n += len(rows)
+            logger.info(f"[blobstore] moved {n} {table} blobs")
+        moved.append(n)
+    return moved[0], moved[1]
+
+
+def _stats(conn) -> dict:
+    count, size, stored, refs = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size),0), COALESCE(SUM(stored_size),0), COALESCE(SUM(refcount),0) FROM blobs"
+    ).fetchone()
+    inline = conn.execute(
+        "SELECT (SELECT COUNT(*) FROM uploads WHERE file_blob IS NOT NULL)"
+        "     + (SELECT COUNT(*) FROM outputs WHERE excel_blob IS NOT NULL)"
+    ).fetchone()[0]
+    return {"blobs": count, "bytes": size, "stored_bytes": stored,
+            "references": refs, "inline_rows_left": inline}
+
+
+def main(argv=None) -> int:
+    from src.db import init_db
+
+    ap = argparse.ArgumentParser(prog="python -m src.blobstore", description="Manage the PDF/Excel blob store.")
+    ap.add_argument("command", choices=["migrate", "gc", "stats"])
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM the DB after migrating")
+    args = ap.parse_args(argv)
+
+    conn = init_db(args.db)
+    store = get_blob_store()
+    if args.command == "migrate":
+        uploads, outputs = migrate_inline_blobs(conn, store)
+        print(f"moved {uploads} upload and {outputs} output blobs to {store.root}")
+        if args.vacuum:
+            conn.execute("VACUUM")
+            print("vacuumed")
+    elif args.command == "gc":
+        removed, freed = store.gc(conn)
+        print(f"removed {removed} blobs, freed {freed} bytes")
+    else:
+        for k, v in _stats(conn).items():
+            print(f"{k}: {v}")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+
+from typing import List
+
+from langchain_core.documents import Document
+
+from src.db import (
+    fetch_cached_result,
+    fetch_extracted_pages,
+    insert_cached_result,
+    insert_extracted_pages,
+)
+from src.summarizer import PaperMeta
+from src.utils import setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+def content_sha256(content: bytes) -> str:
+    """Hex SHA-256 of the raw PDF bytes."""
+    return hashlib.sha256(content).hexdigest()
+
+
+def _options_json(options: dict) -> str:
+    # canonical form, so {"a":1,"b":2} and {"b":2,"a":1} hash the same
+    return json.dumps(options, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def make_cache_key(content_hash: str, model_name: str, **options) -> str:
+    """
+    Build the result-cache key for a PDF.
+
+    The key covers everything that changes the output: the PDF bytes,
+    the LLM model and the options, which callers take from
+    src.pipeline.result_params() (see result_cache_key there).
+    """
+    raw = f"{content_hash}|{model_name}|{_options_json(options)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_meta(conn, cache_key: str) -> PaperMeta | None:
+    """Return the stored PaperMeta for cache_key, or None on a miss."""
+    row = fetch_cached_result(conn, cache_key)
+    if row is None:
+        logger.debug(f"[cache] miss {cache_key[:12]}")
+        return None
+    logger.info(f"[cache] hit {cache_key[:12]} (stored {row['created_at']})")
+    return PaperMeta(
+        doi_issn=row["doi_issn"] or "",
+        title=row["title"] or "",
+        authors=row["authors"] or "",
+        summary=row["summary"] or "",
+    )
+
+
+def store_meta(conn, cache_key: str, content_hash: str,
+               model_name: str, meta: PaperMeta, commit: bool = True,
+               **options) -> None:
+    """Persist a freshly computed PaperMeta under cache_key."""
+    insert_cached_result(
+        conn,
+        cache_key,
+        content_hash,
+        model_name,
+        _options_json(options),
+        meta.doi_issn,
+        meta.title,
+        meta.authors,
+        meta.summary,
+        commit=commit
+    )
+    logger.debug(f"[cache] stored {cache_key[:12]}")
+
+
+# --- extracted-text cache ----------------------------------------------------
+#
+# Keyed by content hash + extraction parameters (min_page_chars, page limits,
+# budgets, OCR dpi/lang), so re-summarizing a paper with another model or
+# prompt reads its text back instead of re-running PyMuPDF/OCR.
+
+def get_cached_pages(conn, content_hash: str, **params) -> List[Document] | None:
+    """
+    Cached per-page Documents for the PDF, or None on a miss. Without
+    params the most recent extraction of the PDF is returned.
+    """
+    rows = fetch_extracted_pages(conn, content_hash, _options_json(params) if params else None)
+    if rows is None:
+        logger.debug(f"[cache] text miss {content_hash[:12]}")
+        return None
+    logger.info(f"[cache] text hit {content_hash[:12]} ({len(rows)} pages)")
+    return [
+        Document(
+            page_content=r["text"],
+            metadata={k: r[k] for k in ("page", "method", "dpi", "lang") if r[k] is not None}
+        )
+        for r in rows
+    ]
+
+
+def store_pages(conn, content_hash: str, docs: List[Document],
+                commit: bool = True, **params) -> None:
+    """Persist the per-page Documents of a fresh extraction."""
+    insert_extracted_pages(
+        conn,
+        content_hash,
+        _options_json(params),
+        (
+            {
+                "page":   d.metadata.get("page"),
+                "method": d.metadata.get("method", "native"),
+                "dpi":    d.metadata.get("dpi"),
+                "lang":   d.metadata.get("lang"),
+                "text":   d.page_content,
+            }
+            for d in docs
+        ),
+        commit=commit
+    )
+    logger.debug(f"[cache] stored {len(docs)} pages for {content_hash[:12]}")
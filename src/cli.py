@@ -0,0 +1,231 @@
+"""
+Headless batch summarizer.
+
+    python -m src.cli papers/ more.pdf --model llama-3.1-8b-instant \
+        --output results.jsonl --resume
+
+Every PDF under the given directories/files goes through the same
+extract -> LLM -> DB path as the Streamlit app. One result row is
+appended to the output file (JSONL or CSV) as each paper finishes, so
+an interrupted run can be continued with --resume.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+import uuid
+from typing import Iterable, List
+
+from src import metrics
+from src.cache import content_sha256, get_cached_meta, store_meta
+from src.config import AVAILABLE_MODELS, DB_PATH, LOG_DIR
+from src.db import init_db, insert_metadata, insert_upload
+from src.pipeline import PaperJob, PaperResult, process_batch, result_cache_key, result_params
+from src.utils import DatabaseError, FileSaveError, setup_logger, INFO
+
+
+FIELDS = ["source", "uid", "batch_id", "status", "error",
+          "doi_issn", "title", "authors", "summary", "model_name"]
+
+
+def _collect_pdfs(paths: Iterable[str], file_list: str | None) -> List[str]:
+    pdfs = []
+    if file_list:
+        with open(file_list, encoding="utf-8") as f:
+            paths = list(paths) + [ln.strip() for ln in f if ln.strip()]
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                pdfs.extend(os.path.join(root, n) for n in names if n.lower().endswith(".pdf"))
+        else:
+            pdfs.append(p)
+    # absolute + de-duplicated, in a stable order so resumed runs line up
+    return sorted({os.path.abspath(p) for p in pdfs})
+
+
+def _completed_sources(output: str, fmt: str) -> set:
+    """Sources already written with status "ok" by an earlier run."""
+    if not os.path.exists(output):
+        return set()
+    done = set()
+    with open(output, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(ln) for ln in f if ln.strip())
+        for row in rows:
+            if row.get("status") == "ok":
+                done.add(row["source"])
+    return done
+
+
+class _ResultWriter:
+    """Appends one row per finished paper and flushes it straight away."""
+    def __init__(self, path: str, fmt: str, append: bool):
+        new_file = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.fmt = fmt
+        self.f = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.f, fieldnames=FIELDS)
+            if new_file:
+                self.csv.writeheader()
+
+    def write(self, row: dict) -> None:
+        if self.fmt == "csv":
+            self.csv.writerow(row)
+        else:
+            self.f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def _parse_args(argv):
+    ap = argparse.ArgumentParser(prog="python -m src.cli", description="Summarize directories of PDFs without the UI.")
+    ap.add_argument("paths", nargs="*", help="PDF files and/or directories (searched recursively)")
+    ap.add_argument("--file-list", help="text file with one PDF path per line")
+    ap.add_argument("--model", default=AVAILABLE_MODELS[0], choices=AVAILABLE_MODELS)
+    ap.add_argument("--output", "-o", required=True, help="results file (.jsonl or .csv)")
+    ap.add_argument("--format", choices=["jsonl", "csv"], help="defaults to the output file extension")
+    ap.add_argument("--max-pages", type=int, default=None, help="max pages to OCR per paper")
+    ap.add_argument("--llm-concurrency", type=int, default=None)
+    ap.add_argument("--extract-workers", type=int, default=None)
+    ap.add_argument("--pack-papers", type=int, default=None,
+                    help="papers per LLM request (default LLM_PACK_PAPERS)")
+    ap.add_argument("--chunk-size", type=int, default=200, help="papers submitted to the engine at a time")
+    ap.add_argument("--resume", action="store_true", help="skip papers already written with status ok")
+    ap.add_argument("--force", action="store_true", help="ignore the result cache")
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args(argv)
+    if not args.paths and not args.file_list:
+        ap.error("give at least one path or --file-list")
+    if args.format is None:
+        args.format = "csv" if args.output.lower().endswith(".csv") else "jsonl"
+    return args
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+
+    batch_id = uuid.uuid4().hex
+    log_path = os.path.join(LOG_DIR, f"{batch_id}.log")
+    setup_logger(name=None, level=INFO, log_file=log_path)
+    logger = logging.getLogger(__name__)
+
+    try:
+        conn = init_db(args.db)
+    except DatabaseError as e:
+        logger.error(f"DB init failed: {e.message}")
+        return 2
+
+    pdfs = _collect_pdfs(args.paths, args.file_list)
+    if args.resume:
+        done = _completed_sources(args.output, args.format)
+        pdfs = [p for p in pdfs if p not in done]
+        logger.info(f"Resuming: {len(done)} papers already done")
+    logger.info(f"Batch {batch_id}: {len(pdfs)} papers with {args.model}; log at {log_path}")
+
+    writer = _ResultWriter(args.output, args.format, append=args.resume)
+    counts = {"ok": 0, "error": 0}
+
+    def emit(source, uid, meta=None, error=None):
+        row = dict.fromkeys(FIELDS, "")
+        row.update(source=source, uid=uid, batch_id=batch_id, model_name=args.model)
+        if meta is not None:
+            row.update(status="ok", doi_issn=meta.doi_issn, title=meta.title,
+                       authors=meta.authors, summary=meta.summary)
+        else:
+            row.update(status="error", error=str(error))
+        writer.write(row)
+        counts[row["status"]] += 1
+
+    def save(uid, meta):
+        with metrics.span("db_insert", uid=uid):
+            insert_metadata(conn, uid, batch_id, meta.doi_issn, meta.title,
+                            meta.authors, meta.summary, args.model)
+
+    try:
+        with metrics.recording(batch_id) as recorder:
+            for start in range(0, len(pdfs), args.chunk_size):
+                jobs = []
+                cache_info = {}
+                for path in pdfs[start:start + args.chunk_size]:
+                    uid = uuid.uuid4().hex
+                    try:
+                        with open(path, "rb") as f:
+                            content = f.read()
+                        with metrics.span("save", uid=uid):
+                            insert_upload(conn, uid, os.path.basename(path), content, args.model, commit=False)
+                    except (OSError, DatabaseError, FileSaveError) as e:
+                        logger.error(f"Skipping {path}: {e}")
+                        emit(path, uid, error=e)
+                        continue
+
+                    content_hash = content_sha256(content)
+                    cache_key = result_cache_key(content_hash, args.model, args.max_pages)
+                    meta = None
+                    if not args.force:
+                        try:
+                            meta = get_cached_meta(conn, cache_key)
+                        except (DatabaseError, sqlite3.Error) as e:
+                            # e.g. locked by the app or a worker: summarize it again
+                            logger.warning(f"Result cache lookup failed for {path}; treating as a miss: {e}")
+                    if meta is not None:
+                        try:
+                            save(uid, meta)
+                        except DatabaseError as e:
+                            logger.error(f"DatabaseError UID={uid}: {e.message}")
+                        emit(path, uid, meta=meta)
+                        continue
+                    cache_info[uid] = (content_hash, cache_key)
+                    jobs.append(PaperJob(uid, os.path.basename(path), path, args.max_pages,
+                                         content_hash=content_hash))
+
+                # one commit for the chunk's upload rows
+                conn.commit()
+
+                def on_result(res: PaperResult):
+                    uid = res.job.uid
+                    if res.error is not None:
+                        logger.error(f"{type(res.error).__name__} UID={uid} ({res.job.pdf_path}): {res.error}")
+                        emit(res.job.pdf_path, uid, error=res.error)
+                        return
+                    try:
+                        save(uid, res.meta)
+                        content_hash, cache_key = cache_info[uid]
+                        store_meta(conn, cache_key, content_hash, args.model, res.meta,
+                                   **result_params(args.model, args.max_pages))
+                    except DatabaseError as e:
+                        logger.error(f"DatabaseError UID={uid}: {e.message}")
+                    emit(res.job.pdf_path, uid, meta=res.meta)
+                    logger.info(f"[{counts['ok'] + counts['error']}/{len(pdfs)}] {res.job.pdf_path}: {res.meta.title} ({res.input_tokens} input tokens)")
+
+                if jobs:
+                    process_batch(
+                        jobs,
+                        args.model,
+                        llm_concurrency=args.llm_concurrency,
+                        extract_workers=args.extract_workers,
+                        on_result=on_result,
+                        conn=conn,
+                        pack_papers=args.pack_papers
+                    )
+                if recorder is not None:
+                    try:
+                        recorder.flush(conn)
+                    except DatabaseError as e:
+                        logger.warning(f"Could not record metrics: {e.message}")
+    finally:
+        writer.close()
+        conn.close()
+
+    logger.info(f"Batch {batch_id} finished: {counts['ok']} ok, {counts['error']} failed")
+    return 0 if counts["error"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
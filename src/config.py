@@ -16,6 +16,7 @@ INPUT_DIR  = os.getenv("INPUT_DIR",  os.path.join(BASE_DIR, "input"))
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", os.path.join(BASE_DIR, "output"))
 LOG_DIR    = os.getenv("LOG_DIR",    os.path.join(BASE_DIR, "logs"))
 DB_DIR     = os.getenv("DB_DIR",     os.path.join(BASE_DIR, "db"))
+BLOB_DIR   = os.getenv("BLOB_DIR",   os.path.join(BASE_DIR, "blobs"))
 
 
 # Database file path
@@ -25,6 +26,10 @@ DB_PATH = os.getenv(
     os.path.join(DB_DIR, "ResearchPaperSummarizer.db")
 )
 
+# Offline DOI -> title/authors index imported from a Crossref/OpenAlex dump
+# (python -m src.doi_index import ...); unused until that file exists
+DOI_INDEX_PATH = os.getenv("DOI_INDEX_PATH", os.path.join(DB_DIR, "doi_index.db"))
+
 
 _raw_models = os.getenv(
     "AVAILABLE_MODELS",
@@ -40,9 +45,150 @@ except Exception:
     AVAILABLE_MODELS = ["gemma2-9b-it","llama-3.3-70b-versatile","llama-3.1-8b-instant", "llama3-70b-8192","llama3-8b-8192","deepseek-r1-distill-llama-70b"]
 
 
+# LLM backend per model (src.llm_backends): "groq", "openai" (an
+# OpenAI-compatible server at OLLAMA_URL: llama.cpp, Ollama, vLLM, ...) or
+# that server's URL, e.g. '{"qwen2.5:7b-instruct": "openai",
+# "llama3.1:8b": "http://cpu-box:8080/v1"}'. Models listed here are added
+# to AVAILABLE_MODELS; the rest use DEFAULT_LLM_BACKEND.
+OLLAMA_URL          = os.getenv("OLLAMA_URL", "http://localhost:11434/v1")
+DEFAULT_LLM_BACKEND = os.getenv("DEFAULT_LLM_BACKEND", "groq")
+try:
+    LLM_BACKENDS = ast.literal_eval(os.getenv("LLM_BACKENDS", "{}"))
+    if not isinstance(LLM_BACKENDS, dict):
+        raise ValueError("LLM_BACKENDS is not a dict")
+except Exception:
+    LLM_BACKENDS = {}
+AVAILABLE_MODELS += [m for m in LLM_BACKENDS if m not in AVAILABLE_MODELS]
+
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# OCR worker processes; 1 keeps the sequential OCR path
+OCR_WORKERS = _int_env("OCR_WORKERS", os.cpu_count() or 1)
+
+def _bool_env(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+# OCR rendering: DPI is picked per page from the text line height (within
+# OCR_MIN_DPI..OCR_MAX_DPI, never above the scan's own resolution) and
+# capped at OCR_MAX_PIXELS per page; OCR_PREPROCESS binarizes and deskews
+OCR_ADAPTIVE_DPI = _bool_env("OCR_ADAPTIVE_DPI", True)
+OCR_PREPROCESS   = _bool_env("OCR_PREPROCESS", True)
+OCR_MIN_DPI      = _int_env("OCR_MIN_DPI", 150)
+OCR_MAX_DPI      = _int_env("OCR_MAX_DPI", 300)
+OCR_MAX_PIXELS   = _int_env("OCR_MAX_PIXELS", 9_000_000)
+
+# OCR backend: "tesserocr" (in-process, model kept loaded), "pytesseract"
+# (tesseract subprocess per page) or "auto" (tesserocr if installed)
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+
+# Batch engine: files extracted at once, and LLM requests kept in flight
+EXTRACT_WORKERS = _int_env("EXTRACT_WORKERS", min(4, os.cpu_count() or 1))
+LLM_CONCURRENCY = _int_env("LLM_CONCURRENCY", 4)
+
+# Papers packed into one LLM request (1 = one request per paper), the paper
+# text tokens allowed per packed request, and how long (seconds) the batch
+# engine waits for more papers before sending a partial pack
+LLM_PACK_PAPERS = _int_env("LLM_PACK_PAPERS", 1)
+LLM_PACK_TOKENS = _int_env("LLM_PACK_TOKENS", 4000)
+LLM_PACK_LINGER = _float_env("LLM_PACK_LINGER", 0.5)
+
+# Streamed metadata responses longer than this (chars) are aborted; a
+# 3-5 sentence summary in JSON is well under 2000
+LLM_STREAM_MAX_CHARS = _int_env("LLM_STREAM_MAX_CHARS", 6000)
+
+# Keep-alive HTTP connections shared by all LLM clients
+LLM_POOL_SIZE = _int_env("LLM_POOL_SIZE", 20)
+
+
+# Per-request timeout (seconds) and retries for transient LLM failures
+LLM_TIMEOUT     = _float_env("LLM_TIMEOUT", 60.0)
+LLM_MAX_RETRIES = _int_env("LLM_MAX_RETRIES", 4)
+
+# Provider rate limits per model, e.g. '{"llama-3.3-70b-versatile": {"rpm": 30, "tpm": 6000}}';
+# models not listed fall back to DEFAULT_RPM / DEFAULT_TPM
+DEFAULT_RPM = _int_env("DEFAULT_RPM", 30)
+DEFAULT_TPM = _int_env("DEFAULT_TPM", 6000)
+try:
+    MODEL_RATE_LIMITS = ast.literal_eval(os.getenv("MODEL_RATE_LIMITS", "{}"))
+    if not isinstance(MODEL_RATE_LIMITS, dict):
+        raise ValueError("MODEL_RATE_LIMITS is not a dict")
+except Exception:
+    MODEL_RATE_LIMITS = {}
+
+
+# Paper text sent to the LLM, in tokens (~4 chars each), after section-aware
+# selection; per-model overrides e.g. '{"llama-3.3-70b-versatile": 3000}'.
+# MAX_EXTRACT_CHARS bounds how much text is extracted to select from.
+DEFAULT_INPUT_TOKENS = _int_env("DEFAULT_INPUT_TOKENS", 1250)
+try:
+    MODEL_INPUT_TOKENS = ast.literal_eval(os.getenv("MODEL_INPUT_TOKENS", "{}"))
+    if not isinstance(MODEL_INPUT_TOKENS, dict):
+        raise ValueError("MODEL_INPUT_TOKENS is not a dict")
+except Exception:
+    MODEL_INPUT_TOKENS = {}
+MAX_EXTRACT_CHARS = _int_env("MAX_EXTRACT_CHARS", 60000)
+
+
+# Title/authors/DOI found locally (PDF metadata, regex, font sizes) with at
+# least this confidence are not requested from the LLM
+LOCAL_META_MIN_CONFIDENCE = _float_env("LOCAL_META_MIN_CONFIDENCE", 0.8)
+
+# Near-duplicate detection (src.dedup): estimated text similarity at which
+# two PDFs count as the same paper, and whether the pipeline then reuses
+# the existing summary instead of calling the LLM
+DEDUP_THRESHOLD = _float_env("DEDUP_THRESHOLD", 0.8)
+DEDUP_REUSE     = _bool_env("DEDUP_REUSE", True)
+
+
+# Per-stage timings recorded into the metrics table (src.metrics), and the
+# window (hours) the exported latency quantiles are computed over
+METRICS_ENABLED      = _bool_env("METRICS_ENABLED", True)
+METRICS_WINDOW_HOURS = _int_env("METRICS_WINDOW_HOURS", 24)
+
+
+# Streamlit app: uploads listed in the history picker, and the time budgets
+# (ms) for the first run in a process and for a rerun; runs over budget
+# are logged as warnings with their per-phase timings
+APP_HISTORY_LIMIT     = _int_env("APP_HISTORY_LIMIT", 500)
+APP_COLD_BUDGET_MS    = _int_env("APP_COLD_BUDGET_MS", 1500)
+APP_RERUN_BUDGET_MS   = _int_env("APP_RERUN_BUDGET_MS", 250)
+
+
+# Job queue (src.jobs) run by `python -m src.worker`: worker processes it
+# starts, jobs a worker claims at a time (processed as one batch), seconds
+# a claim lasts without a heartbeat before another worker may take the job
+# over, attempts before a job is failed, the retry delay (seconds, doubled
+# per attempt) and how often idle workers and the app poll the queue
+WORKER_PROCESSES  = _int_env("WORKER_PROCESSES", 2)
+JOB_CLAIM_SIZE    = _int_env("JOB_CLAIM_SIZE", 8)
+JOB_LEASE_SECONDS = _int_env("JOB_LEASE_SECONDS", 120)
+JOB_MAX_ATTEMPTS  = _int_env("JOB_MAX_ATTEMPTS", 3)
+JOB_RETRY_DELAY   = _float_env("JOB_RETRY_DELAY", 30.0)
+JOB_POLL_SECONDS  = _float_env("JOB_POLL_SECONDS", 2.0)
+
+
+# Compression for new blobs in BLOB_DIR: "zstd" (falls back to gzip if the
+# zstandard package is missing), "gzip" or "none"
+BLOB_CODEC = os.getenv("BLOB_CODEC", "zstd")
+
+
 # Ensure all directories exist
 
-for path in (BASE_DIR, INPUT_DIR, OUTPUT_DIR, LOG_DIR, DB_DIR):
+for path in (BASE_DIR, INPUT_DIR, OUTPUT_DIR, LOG_DIR, DB_DIR, BLOB_DIR):
     try:
         os.makedirs(path, exist_ok=True)
     except Exception as e:
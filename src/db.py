@@ -1,60 +1,302 @@
+import io
 import sqlite3
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from src.blobstore import get_blob_store
 from src.utils import DatabaseError
 
 
-def init_db(DB_PATH:str) -> sqlite3.Connection:
-    """Initialize SQLite DB and tables (if not exist)."""
-    try:
-        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-        c = conn.cursor()
-
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS uploads (
-            id TEXT PRIMARY KEY,
-            file_name TEXT,
-            file_blob BLOB,
-            uploaded_at TIMESTAMP,
-            model_name TEXT
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS metadata (
-            id TEXT,
-            batch_id TEXT,
-            doi_issn TEXT,
-            title TEXT,
-            authors TEXT,
-            summary TEXT,
-            processed_at TIMESTAMP,
-            model_name TEXT,
-            FOREIGN KEY(id) REFERENCES uploads(id),
-            FOREIGN KEY(batch_id) REFERENCES outputs(batch_id)
-        )""")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS outputs (
-            batch_id TEXT PRIMARY KEY,
-            excel_blob BLOB,
-            generated_at TIMESTAMP
-        )""")
+# --- schema migrations -------------------------------------------------------
+#
+# Each migration runs once, in order, inside its own transaction; the DB's
+# PRAGMA user_version records how many have been applied. Append new steps
+# to MIGRATIONS, never edit one that has shipped.
 
-        conn.commit()
-        
+def _m001_base_tables(c):
+    # IF NOT EXISTS so databases created before migrations existed pass through
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS uploads (
+        id TEXT PRIMARY KEY,
+        file_name TEXT,
+        file_blob BLOB,
+        uploaded_at TIMESTAMP,
+        model_name TEXT
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS metadata (
+        id TEXT,
+        batch_id TEXT,
+        doi_issn TEXT,
+        title TEXT,
+        authors TEXT,
+        summary TEXT,
+        processed_at TIMESTAMP,
+        model_name TEXT,
+        FOREIGN KEY(id) REFERENCES uploads(id),
+        FOREIGN KEY(batch_id) REFERENCES outputs(batch_id)
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS outputs (
+        batch_id TEXT PRIMARY KEY,
+        excel_blob BLOB,
+        generated_at TIMESTAMP
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS result_cache (
+        cache_key TEXT PRIMARY KEY,
+        content_hash TEXT,
+        model_name TEXT,
+        options TEXT,
+        doi_issn TEXT,
+        title TEXT,
+        authors TEXT,
+        summary TEXT,
+        created_at TIMESTAMP
+    )""")
+
+
+def _m002_lookup_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metadata_id ON metadata(id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metadata_batch_id ON metadata(batch_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_uploads_uploaded_at ON uploads(uploaded_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_content_hash ON result_cache(content_hash)")
+
+
+def _m003_blob_store(c):
+    # bytes move to src.blobstore; rows keep only the digest
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS blobs (
+        digest TEXT PRIMARY KEY,
+        size INTEGER,
+        stored_size INTEGER,
+        codec TEXT,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_blobs_refcount ON blobs(refcount)")
+    c.execute("ALTER TABLE uploads ADD COLUMN file_digest TEXT")
+    c.execute("ALTER TABLE outputs ADD COLUMN excel_digest TEXT")
+
+
+def _m004_text_cache(c):
+    # one row per (PDF, extraction parameters), and its pages
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS text_extractions (
+        content_hash TEXT,
+        params TEXT,
+        n_pages INTEGER,
+        created_at TIMESTAMP,
+        PRIMARY KEY (content_hash, params)
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS extracted_pages (
+        content_hash TEXT,
+        params TEXT,
+        page INTEGER,
+        method TEXT,
+        dpi INTEGER,
+        lang TEXT,
+        text TEXT,
+        PRIMARY KEY (content_hash, params, page)
+    ) WITHOUT ROWID""")
+
+
+def _m005_text_signatures(c):
+    # MinHash signature per extracted PDF and its LSH band buckets (src.dedup)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS text_signatures (
+        content_hash TEXT PRIMARY KEY,
+        signature BLOB,
+        n_shingles INTEGER,
+        created_at TIMESTAMP
+    )""")
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS lsh_buckets (
+        bucket INTEGER,
+        content_hash TEXT,
+        PRIMARY KEY (bucket, content_hash)
+    ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_uploads_file_digest ON uploads(file_digest)")
+
+
+def _m006_metrics(c):
+    # one row per timed pipeline stage (src.metrics); uid is NULL for
+    # batch-level spans such as a packed LLM request or the Excel export
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY,
+        batch_id TEXT,
+        uid TEXT,
+        stage TEXT NOT NULL,
+        page INTEGER,
+        started_at REAL NOT NULL,
+        duration_ms REAL NOT NULL,
+        cpu_ms REAL,
+        rss_mb REAL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        ok INTEGER NOT NULL DEFAULT 1
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_batch_id ON metrics(batch_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_uid ON metrics(uid)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_stage_started ON metrics(stage, started_at)")
+
+
+def _m007_jobs(c):
+    # durable work queue (src.jobs): one row per upload to summarize, or
+    # per re-summarize request, claimed by `python -m src.worker` processes
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        uid TEXT NOT NULL,
+        batch_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        max_pages INTEGER,
+        force INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        not_before REAL NOT NULL,
+        worker TEXT,
+        lease_until REAL,
+        error TEXT,
+        reused_from TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL,
+        FOREIGN KEY(uid) REFERENCES uploads(id)
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, not_before)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch_id ON jobs(batch_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_uid ON jobs(uid)")
+
+
+def _m008_job_fields(c):
+    # title/authors/summary of a job as streamed so far (JSON), for the app
+    c.execute("ALTER TABLE jobs ADD COLUMN fields TEXT")
+
+
+MIGRATIONS = [
+    _m001_base_tables,
+    _m002_lookup_indexes,
+    _m003_blob_store,
+    _m004_text_cache,
+    _m005_text_signatures,
+    _m006_metrics,
+    _m007_jobs,
+    _m008_job_fields,
+]
+
+
+def _user_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Apply pending migrations; returns the resulting schema version.
+
+    Each step takes the write lock first (BEGIN IMMEDIATE) and re-reads
+    user_version under it, so processes opening a fresh DB at the same
+    time wait for each other and apply every step exactly once. An
+    up-to-date DB is only read.
+    """
+    version = _user_version(conn)
+    while version < len(MIGRATIONS):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = _user_version(conn)
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn.cursor())
+                version += 1
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return version
+
+
+def connect_db(DB_PATH: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Open the SQLite DB in WAL mode, without touching its schema; for
+    processes started after init_db() has migrated it (queue workers).
+
+    WAL lets readers (history lookups in other sessions) run alongside a
+    writer, and the 30 s busy timeout makes concurrent writers wait for
+    the lock instead of failing with "database is locked". Pass
+    check_same_thread=False for a connection kept across threads that
+    never use it at the same time (a Streamlit session's reruns).
+    """
+    try:
+        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES, timeout=30,
+                               check_same_thread=check_same_thread)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")   # durable at checkpoints; safe with WAL
+        return conn
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to open database at {DB_PATH}: {e}")
+
+
+def init_db(DB_PATH:str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open the SQLite DB (as connect_db does) and bring its schema up to date."""
+    conn = connect_db(DB_PATH, check_same_thread)
+    try:
+        migrate(conn)
         return conn
 
     except sqlite3.Error as e:
-        
+        conn.close()
         raise DatabaseError(f"Failed to initialize database at {DB_PATH}: {e}")
 
-def insert_upload(conn, uid, file_name, file_bytes, llm_model):
-    """Insert a raw PDF upload record."""
+
+@contextmanager
+def batch_transaction(conn):
+    """
+    Group several inserts into one transaction: pass commit=False to the
+    insert_* calls inside the block; everything is committed on exit, or
+    rolled back if the block raises.
+    """
     try:
-        ts = datetime.now()
-        conn.execute(
-            "INSERT INTO uploads (id, file_name, file_blob, uploaded_at, model_name) VALUES (?,?,?,?,?)",
-            (uid, file_name, file_bytes, ts, llm_model)
-        )
+        yield conn
         conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+@contextmanager
+def savepoint(conn, name: str = "item"):
+    """
+    Inside a batch_transaction-style transaction (commit=False calls), make
+    the block all-or-nothing: if it raises, its writes are rolled back and
+    the rest of the transaction is kept.
+    """
+    if not conn.in_transaction:
+        # a SAVEPOINT outside a transaction would commit on RELEASE
+        conn.execute("BEGIN")
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute(f"ROLLBACK TO {name}")
+        conn.execute(f"RELEASE {name}")
+        raise
+    conn.execute(f"RELEASE {name}")
+
+def insert_upload(conn, uid, file_name, file_bytes, llm_model, commit: bool = True):
+    """Insert a raw PDF upload record; the bytes go to the blob store."""
+    try:
+        ts = datetime.now()
+        # the blob reference and the row go in together, or neither does
+        with savepoint(conn, "insert_upload"):
+            digest = get_blob_store().put(conn, file_bytes, commit=False)
+            conn.execute(
+                "INSERT INTO uploads (id, file_name, file_digest, uploaded_at, model_name) VALUES (?,?,?,?,?)",
+                (uid, file_name, digest, ts, llm_model)
+            )
+        if commit:
+            conn.commit()
         
     except sqlite3.IntegrityError as e:
         
@@ -65,7 +307,8 @@ def insert_upload(conn, uid, file_name, file_bytes, llm_model):
 
 def insert_metadata(conn, uid: str, batch_id: str,
                     doi: str, title: str,
-                    authors: str, summary: str, llm_model:str):
+                    authors: str, summary: str, llm_model:str,
+                    commit: bool = True):
     """
     Insert extracted metadata for a given upload and batch.
 
@@ -78,6 +321,7 @@ def insert_metadata(conn, uid: str, batch_id: str,
         authors: Author list
         summary: LLM-generated summary
         llm_model: model used
+        commit: commit right away (False inside batch_transaction)
 
     Raises:
         DatabaseError: on any sqlite3 failure.
@@ -93,20 +337,54 @@ def insert_metadata(conn, uid: str, batch_id: str,
             """,
             (uid, batch_id, doi, title, authors, summary, ts, llm_model)
         )
-        conn.commit()
+        if commit:
+            conn.commit()
        
     except sqlite3.Error as e:
         raise DatabaseError(f"Failed to insert metadata for uid={uid}: {e}")
 
-def insert_output(conn, batch_id, excel_bytes):
-    """Insert the final Excel blob of a batch run."""
+def insert_metadata_many(conn, rows, commit: bool = True):
+    """
+    Insert many metadata rows with one executemany and a single commit.
+
+    Args:
+        conn: sqlite3.Connection
+        rows: iterable of (uid, batch_id, doi, title, authors, summary, llm_model)
+        commit: commit right away (False inside batch_transaction)
+
+    Raises:
+        DatabaseError: on any sqlite3 failure.
+    """
     try:
         ts = datetime.now()
-        conn.execute(
-            "INSERT INTO outputs (batch_id, excel_blob, generated_at) VALUES (?,?,?)",
-            (batch_id, excel_bytes, ts)
+        conn.executemany(
+            """
+            INSERT INTO metadata
+              (id, batch_id, doi_issn, title, authors, summary, processed_at, model_name)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            ((uid, batch_id, doi, title, authors, summary, ts, llm_model)
+             for uid, batch_id, doi, title, authors, summary, llm_model in rows)
         )
-        conn.commit()
+        if commit:
+            conn.commit()
+
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to insert metadata batch: {e}")
+
+def insert_output(conn, batch_id, excel_bytes, commit: bool = True):
+    """Insert the final Excel of a batch run; the bytes go to the blob store."""
+    try:
+        ts = datetime.now()
+        # the blob reference and the row go in together, or neither does
+        with savepoint(conn, "insert_output"):
+            digest = get_blob_store().put(conn, excel_bytes, commit=False)
+            conn.execute(
+                "INSERT INTO outputs (batch_id, excel_digest, generated_at) VALUES (?,?,?)",
+                (batch_id, digest, ts)
+            )
+        if commit:
+            conn.commit()
         
     except sqlite3.IntegrityError as e:
         
@@ -117,13 +395,29 @@ def insert_output(conn, batch_id, excel_bytes):
 
 
 
-def fetch_all_uploads(conn):
+def delete_output(conn, batch_id, commit: bool = True):
+    """Delete a batch's Excel output, releasing its blob reference."""
+    try:
+        row = conn.execute("SELECT excel_digest FROM outputs WHERE batch_id = ?", (batch_id,)).fetchone()
+        conn.execute("DELETE FROM outputs WHERE batch_id = ?", (batch_id,))
+        if row and row[0]:
+            get_blob_store().release(conn, row[0], commit=False)
+        if commit:
+            conn.commit()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to delete output for batch_id={batch_id}: {e}")
+
+
+
+def fetch_all_uploads(conn, limit: int | None = None):
     """
-    Return a list of (id, file_name, uploaded_at) for all uploads.
+    Return a list of (id, file_name, uploaded_at) for all uploads, newest
+    first; with limit, only the newest limit (read off the uploaded_at index).
     """
     try:
         rows = conn.execute(
-            "SELECT id, file_name, uploaded_at FROM uploads ORDER BY uploaded_at DESC"
+            "SELECT id, file_name, uploaded_at FROM uploads ORDER BY uploaded_at DESC LIMIT ?",
+            (-1 if limit is None else limit,)
         ).fetchall()
         return rows
     except sqlite3.Error as e:
@@ -133,7 +427,7 @@ def fetch_all_uploads(conn):
 def fetch_metadata(conn, uid):
     """
     Return a dict of metadata for the given upload id, or None if not found.
-    Now includes batch_id.
+    Now includes batch_id. If the upload was re-summarized, the newest row wins.
     """
     try:
         row = conn.execute(
@@ -141,6 +435,8 @@ def fetch_metadata(conn, uid):
             SELECT batch_id, doi_issn, title, authors, summary, processed_at, model_name
               FROM metadata
              WHERE id = ?
+             ORDER BY processed_at DESC
+             LIMIT 1
             """,
             (uid,)
         ).fetchone()
@@ -163,32 +459,643 @@ def fetch_metadata(conn, uid):
 
 def fetch_upload_blob(conn, uid):
     """
-    Return the PDF blob for the given upload id, or None if not found.
+    Return (stream, file_name) for the given upload id, or (None, None)
+    if not found. The stream reads the PDF from the blob store; rows not
+    yet moved out by `python -m src.blobstore migrate` are served inline.
     """
     try:
         row = conn.execute(
-            "SELECT file_blob, file_name FROM uploads WHERE id = ?", (uid,)
+            "SELECT file_digest, file_blob, file_name FROM uploads WHERE id = ?", (uid,)
         ).fetchone()
         if not row:
             return None, None
-        blob, file_name = row
-        return blob, file_name
+        digest, blob, file_name = row
+        if digest:
+            return get_blob_store().open(conn, digest), file_name
+        return (io.BytesIO(blob) if blob is not None else None), file_name
     except sqlite3.Error as e:
         
         raise DatabaseError(f"Could not fetch upload blob for {uid}: {e}")
 
 def fetch_output_blob(conn, batch_id):
     """
-    Return the Excel blob for the given batch id, or None if not found.
+    Return a stream over the Excel for the given batch id, or None if not found.
     """
     try:
         row = conn.execute(
-            "SELECT excel_blob FROM outputs WHERE batch_id = ?", (batch_id,)
+            "SELECT excel_digest, excel_blob FROM outputs WHERE batch_id = ?", (batch_id,)
         ).fetchone()
         if not row:
             return None
-        blob = row[0]
-        return blob
+        digest, blob = row
+        if digest:
+            return get_blob_store().open(conn, digest)
+        return io.BytesIO(blob) if blob is not None else None
     except sqlite3.Error as e:
         
-        raise DatabaseError(f"Could not fetch output blob for {batch_id}: {e}")
\ No newline at end of file
+        raise DatabaseError(f"Could not fetch output blob for {batch_id}: {e}")
+
+
+def delete_upload(conn, uid, commit: bool = True):
+    """
+    Delete an upload and its metadata rows, releasing its blob reference.
+    The file itself is removed by the next `python -m src.blobstore gc`.
+    """
+    try:
+        row = conn.execute("SELECT file_digest FROM uploads WHERE id = ?", (uid,)).fetchone()
+        conn.execute("DELETE FROM metadata WHERE id = ?", (uid,))
+        conn.execute("DELETE FROM uploads WHERE id = ?", (uid,))
+        if row and row[0]:
+            get_blob_store().release(conn, row[0], commit=False)
+        if commit:
+            conn.commit()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to delete upload {uid}: {e}")
+
+
+def fetch_cached_result(conn, cache_key):
+    """
+    Return a dict with the cached doi_issn/title/authors/summary for
+    cache_key, or None if nothing has been stored for it yet.
+    """
+    try:
+        row = conn.execute(
+            """
+            SELECT doi_issn, title, authors, summary, model_name, created_at
+              FROM result_cache
+             WHERE cache_key = ?
+            """,
+            (cache_key,)
+        ).fetchone()
+        if not row:
+            return None
+
+        doi, title, authors, summary, model_name, created_at = row
+        return {
+            "doi_issn":   doi,
+            "title":      title,
+            "authors":    authors,
+            "summary":    summary,
+            "model_name": model_name,
+            "created_at": created_at
+        }
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch cached result for {cache_key}: {e}")
+
+
+def insert_cached_result(conn, cache_key: str, content_hash: str,
+                         llm_model: str, options: str,
+                         doi: str, title: str,
+                         authors: str, summary: str,
+                         commit: bool = True):
+    """
+    Store (or replace) the extracted metadata for a cache key.
+
+    Args:
+        conn: sqlite3.Connection
+        cache_key: key built from content hash, model and extraction options
+        content_hash: SHA-256 of the PDF bytes
+        llm_model: model used
+        options: canonical JSON of the extraction options
+        doi, title, authors, summary: the PaperMeta fields
+        commit: commit right away (False inside batch_transaction)
+
+    Raises:
+        DatabaseError: on any sqlite3 failure.
+    """
+    try:
+        ts = datetime.now()
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO result_cache
+              (cache_key, content_hash, model_name, options,
+               doi_issn, title, authors, summary, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (cache_key, content_hash, llm_model, options,
+             doi, title, authors, summary, ts)
+        )
+        if commit:
+            conn.commit()
+
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to insert cached result for {cache_key}: {e}")
+
+
+def fetch_extracted_pages(conn, content_hash: str, params: str | None = None):
+    """
+    Return the cached pages for a PDF as a list of dicts (page, method,
+    dpi, lang, text), or None if it was never extracted with params.
+    With params=None the most recent extraction of the PDF is returned.
+    """
+    try:
+        if params is None:
+            row = conn.execute(
+                """
+                SELECT params FROM text_extractions
+                 WHERE content_hash = ?
+                 ORDER BY created_at DESC
+                 LIMIT 1
+                """,
+                (content_hash,)
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT params FROM text_extractions WHERE content_hash = ? AND params = ?",
+                (content_hash, params)
+            ).fetchone()
+        if not row:
+            return None
+
+        rows = conn.execute(
+            """
+            SELECT page, method, dpi, lang, text
+              FROM extracted_pages
+             WHERE content_hash = ? AND params = ?
+             ORDER BY page
+            """,
+            (content_hash, row[0])
+        ).fetchall()
+        return [
+            {"page": page, "method": method, "dpi": dpi, "lang": lang, "text": text}
+            for page, method, dpi, lang, text in rows
+        ]
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch extracted pages for {content_hash}: {e}")
+
+
+def insert_extracted_pages(conn, content_hash: str, params: str, pages, commit: bool = True):
+    """
+    Store (or replace) the extracted pages of a PDF for one set of
+    extraction parameters.
+
+    Args:
+        conn: sqlite3.Connection
+        content_hash: SHA-256 of the PDF bytes
+        params: canonical JSON of the extraction parameters
+        pages: iterable of dicts with page, method, dpi, lang, text
+        commit: commit right away (False inside batch_transaction)
+
+    Raises:
+        DatabaseError: on any sqlite3 failure.
+    """
+    try:
+        pages = list(pages)
+        conn.execute(
+            "DELETE FROM extracted_pages WHERE content_hash = ? AND params = ?",
+            (content_hash, params)
+        )
+        conn.executemany(
+            """
+            INSERT INTO extracted_pages
+              (content_hash, params, page, method, dpi, lang, text)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            ((content_hash, params, p["page"], p["method"], p.get("dpi"), p.get("lang"), p["text"])
+             for p in pages)
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO text_extractions (content_hash, params, n_pages, created_at) VALUES (?,?,?,?)",
+            (content_hash, params, len(pages), datetime.now())
+        )
+        if commit:
+            conn.commit()
+
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to insert extracted pages for {content_hash}: {e}")
+
+
+def fetch_upload_digest(conn, uid):
+    """Return the content hash (blob digest) of an upload, or None."""
+    try:
+        row = conn.execute("SELECT file_digest FROM uploads WHERE id = ?", (uid,)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch digest for {uid}: {e}")
+
+
+def fetch_upload_by_digest(conn, digest: str):
+    """Return (id, file_name) of the newest upload of a PDF, or None."""
+    try:
+        return conn.execute(
+            """
+            SELECT id, file_name FROM uploads
+             WHERE file_digest = ?
+             ORDER BY uploaded_at DESC
+             LIMIT 1
+            """,
+            (digest,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch upload for digest {digest}: {e}")
+
+
+def fetch_latest_cached_result(conn, content_hash: str, model_name: str):
+    """
+    Return the newest result_cache row (as fetch_cached_result does) for
+    a PDF and model, whatever the extraction options, or None.
+    """
+    try:
+        row = conn.execute(
+            """
+            SELECT cache_key FROM result_cache
+             WHERE content_hash = ? AND model_name = ?
+             ORDER BY created_at DESC
+             LIMIT 1
+            """,
+            (content_hash, model_name)
+        ).fetchone()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch cached result for {content_hash}: {e}")
+    return fetch_cached_result(conn, row[0]) if row else None
+
+
+def insert_text_signature(conn, content_hash: str, signature: bytes,
+                          n_shingles: int, buckets, commit: bool = True):
+    """
+    Store (or replace) the MinHash signature of a PDF's text and its LSH
+    band buckets.
+
+    Args:
+        conn: sqlite3.Connection
+        content_hash: SHA-256 of the PDF bytes
+        signature: packed MinHash values
+        n_shingles: number of distinct shingles the signature was built from
+        buckets: one integer bucket id per LSH band
+        commit: commit right away (False inside batch_transaction)
+
+    Raises:
+        DatabaseError: on any sqlite3 failure.
+    """
+    try:
+        # lsh_buckets is keyed by bucket, so only scan it for a re-index
+        if conn.execute("SELECT 1 FROM text_signatures WHERE content_hash = ?", (content_hash,)).fetchone():
+            conn.execute("DELETE FROM lsh_buckets WHERE content_hash = ?", (content_hash,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO lsh_buckets (bucket, content_hash) VALUES (?, ?)",
+            ((b, content_hash) for b in buckets)
+        )
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO text_signatures
+              (content_hash, signature, n_shingles, created_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            (content_hash, signature, n_shingles, datetime.now())
+        )
+        if commit:
+            conn.commit()
+
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to insert text signature for {content_hash}: {e}")
+
+
+def fetch_lsh_candidates(conn, buckets, exclude: str | None = None):
+    """
+    Return (content_hash, signature) for every indexed PDF sharing at
+    least one LSH bucket with buckets, except exclude.
+    """
+    buckets = list(buckets)
+    if not buckets:
+        return []
+    try:
+        return conn.execute(
+            f"""
+            SELECT s.content_hash, s.signature
+              FROM text_signatures s
+             WHERE s.content_hash IN (
+                   SELECT content_hash FROM lsh_buckets
+                    WHERE bucket IN ({",".join("?" * len(buckets))})
+             )
+               AND s.content_hash IS NOT ?
+            """,
+            (*buckets, exclude)
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch LSH candidates: {e}")
+
+
+_METRIC_COLUMNS = ("batch_id", "uid", "stage", "page", "started_at", "duration_ms",
+                   "cpu_ms", "rss_mb", "prompt_tokens", "completion_tokens", "ok")
+
+
+def insert_metrics_many(conn, rows, commit: bool = True):
+    """
+    Insert timed spans with one executemany.
+
+    Args:
+        conn: sqlite3.Connection
+        rows: iterable of (batch_id, uid, stage, page, started_at, duration_ms,
+              cpu_ms, rss_mb, prompt_tokens, completion_tokens, ok)
+        commit: commit right away (False inside batch_transaction)
+
+    Raises:
+        DatabaseError: on any sqlite3 failure.
+    """
+    try:
+        conn.executemany(
+            f"INSERT INTO metrics ({', '.join(_METRIC_COLUMNS)}) VALUES ({', '.join('?' * len(_METRIC_COLUMNS))})",
+            rows
+        )
+        if commit:
+            conn.commit()
+
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to insert metrics: {e}")
+
+
+def fetch_metrics(conn, batch_id: str | None = None, uid: str | None = None):
+    """
+    Return the spans of a batch and/or an upload as dicts keyed by the
+    metrics columns, oldest first.
+    """
+    where, args = [], []
+    if batch_id is not None:
+        where.append("batch_id = ?")
+        args.append(batch_id)
+    if uid is not None:
+        where.append("uid = ?")
+        args.append(uid)
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT {', '.join(_METRIC_COLUMNS)} FROM metrics
+            {"WHERE " + " AND ".join(where) if where else ""}
+             ORDER BY started_at, id
+            """,
+            args
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch metrics: {e}")
+    return [dict(zip(_METRIC_COLUMNS, row)) for row in rows]
+
+
+def fetch_metric_totals(conn):
+    """
+    Return per-stage totals over every recorded span: (stage, count,
+    errors, duration_ms sum, cpu_ms sum, prompt_tokens sum,
+    completion_tokens sum).
+    """
+    try:
+        return conn.execute(
+            """
+            SELECT stage, COUNT(*), SUM(ok = 0), TOTAL(duration_ms), TOTAL(cpu_ms),
+                   TOTAL(prompt_tokens), TOTAL(completion_tokens)
+              FROM metrics
+             GROUP BY stage
+             ORDER BY stage
+            """
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch metric totals: {e}")
+
+
+def fetch_stage_durations(conn, since: float):
+    """Return (stage, duration_ms) of the spans started at or after since (Unix time)."""
+    try:
+        return conn.execute(
+            "SELECT stage, duration_ms FROM metrics WHERE started_at >= ? ORDER BY stage",
+            (since,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch stage durations: {e}")
+
+
+_JOB_COLUMNS = ("id", "uid", "batch_id", "kind", "model_name", "max_pages", "force", "state",
+                "attempts", "not_before", "worker", "lease_until", "error", "reused_from",
+                "created_at", "updated_at", "fields")
+
+
+def insert_job(conn, uid: str, batch_id: str, kind: str, model_name: str,
+               max_pages: int | None = None, force: bool = False, commit: bool = True) -> int:
+    """Queue a job for an upload; returns its id."""
+    try:
+        now = time.time()
+        cur = conn.execute(
+            """
+            INSERT INTO jobs
+              (uid, batch_id, kind, model_name, max_pages, force, state, not_before, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)
+            """,
+            (uid, batch_id, kind, model_name, max_pages, int(force), now, now, now)
+        )
+        if commit:
+            conn.commit()
+        return cur.lastrowid
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to queue job for uid={uid}: {e}")
+
+
+def claim_jobs(conn, worker: str, limit: int, lease_until: float):
+    """
+    Atomically claim up to limit queued jobs that are due, all from the
+    oldest batch that has any, for worker until lease_until. They move to
+    "extracting" and their attempts are counted. Returns them as dicts
+    keyed by the jobs columns, in queue order.
+    """
+    now = time.time()
+    try:
+        # IMMEDIATE takes the write lock up front, so two workers cannot
+        # both read the same queued rows
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT batch_id FROM jobs WHERE state = 'queued' AND not_before <= ? ORDER BY id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return []
+            ids = [r[0] for r in conn.execute(
+                """
+                SELECT id FROM jobs
+                 WHERE batch_id = ? AND state = 'queued' AND not_before <= ?
+                 ORDER BY id
+                 LIMIT ?
+                """,
+                (row[0], now, limit)
+            )]
+            marks = ", ".join("?" * len(ids))
+            conn.execute(
+                f"""
+                UPDATE jobs
+                   SET state = 'extracting', worker = ?, lease_until = ?, attempts = attempts + 1,
+                       fields = NULL, updated_at = ?
+                 WHERE id IN ({marks})
+                """,
+                (worker, lease_until, now, *ids)
+            )
+            rows = conn.execute(
+                f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id IN ({marks}) ORDER BY id", ids
+            ).fetchall()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not claim jobs: {e}")
+    return [dict(zip(_JOB_COLUMNS, r)) for r in rows]
+
+
+def update_job(conn, job_id: int, worker: str, state: str, error: str | None = None,
+               not_before: float | None = None, reused_from: str | None = None,
+               fields: str | None = None, commit: bool = True) -> bool:
+    """
+    Move a job claimed by worker to state (a retry goes back to "queued"
+    with not_before); fields replaces its streamed fields (JSON). Returns
+    False, changing nothing, if the job is no longer that worker's, e.g.
+    its lease expired and another took it.
+    """
+    try:
+        now = time.time()
+        released = state not in ("extracting", "summarizing")
+        cur = conn.execute(
+            """
+            UPDATE jobs
+               SET state = ?, error = ?, reused_from = COALESCE(?, reused_from),
+                   not_before = COALESCE(?, not_before), fields = COALESCE(?, fields), updated_at = ?,
+                   worker = CASE WHEN ? THEN NULL ELSE worker END,
+                   lease_until = CASE WHEN ? THEN NULL ELSE lease_until END
+             WHERE id = ? AND worker = ? AND state IN ('extracting', 'summarizing')
+            """,
+            (state, error, reused_from, not_before, fields, now, released, released, job_id, worker)
+        )
+        if commit:
+            conn.commit()
+        return cur.rowcount == 1
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to update job {job_id}: {e}")
+
+
+def extend_job_leases(conn, worker: str, lease_until: float, commit: bool = True) -> int:
+    """Renew the leases of the jobs worker is running; returns how many."""
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE worker = ? AND state IN ('extracting', 'summarizing')",
+            (lease_until, worker)
+        )
+        if commit:
+            conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to renew leases of {worker}: {e}")
+
+
+def requeue_expired_jobs(conn, max_attempts: int, commit: bool = True):
+    """
+    Release the jobs whose worker stopped renewing its lease (crashed or
+    killed): back to "queued", or "failed" once max_attempts are used up.
+    Returns the batch ids of the jobs that failed.
+    """
+    now = time.time()
+    try:
+        failed = [r[0] for r in conn.execute(
+            """
+            SELECT DISTINCT batch_id FROM jobs
+             WHERE state IN ('extracting', 'summarizing') AND lease_until < ? AND attempts >= ?
+            """,
+            (now, max_attempts)
+        )]
+        conn.execute(
+            """
+            UPDATE jobs
+               SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                   error = 'worker stopped before finishing (lease expired)',
+                   worker = NULL, lease_until = NULL, not_before = ?, updated_at = ?
+             WHERE state IN ('extracting', 'summarizing') AND lease_until < ?
+            """,
+            (max_attempts, now, now, now)
+        )
+        if commit:
+            conn.commit()
+        return failed
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to requeue expired jobs: {e}")
+
+
+def requeue_failed_jobs(conn, batch_id: str | None = None, uid: str | None = None,
+                        commit: bool = True) -> int:
+    """Queue failed jobs (of a batch and/or upload) again with fresh attempts; returns how many."""
+    where, args = ["state = 'failed'"], []
+    if batch_id is not None:
+        where.append("batch_id = ?")
+        args.append(batch_id)
+    if uid is not None:
+        where.append("uid = ?")
+        args.append(uid)
+    try:
+        now = time.time()
+        cur = conn.execute(
+            f"""
+            UPDATE jobs SET state = 'queued', attempts = 0, error = NULL, not_before = ?, updated_at = ?
+             WHERE {" AND ".join(where)}
+            """,
+            (now, now, *args)
+        )
+        if commit:
+            conn.commit()
+        return cur.rowcount
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Failed to requeue jobs: {e}")
+
+
+def fetch_jobs(conn, batch_id: str | None = None, uid: str | None = None):
+    """
+    Return the jobs of a batch and/or an upload as dicts keyed by the jobs
+    columns plus the upload's file_name, in queue order.
+    """
+    where, args = [], []
+    if batch_id is not None:
+        where.append("j.batch_id = ?")
+        args.append(batch_id)
+    if uid is not None:
+        where.append("j.uid = ?")
+        args.append(uid)
+    try:
+        rows = conn.execute(
+            f"""
+            SELECT {', '.join('j.' + c for c in _JOB_COLUMNS)}, u.file_name
+              FROM jobs j LEFT JOIN uploads u ON u.id = j.uid
+            {"WHERE " + " AND ".join(where) if where else ""}
+             ORDER BY j.id
+            """,
+            args
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch jobs: {e}")
+    return [dict(zip(_JOB_COLUMNS + ("file_name",), row)) for row in rows]
+
+
+def fetch_job_counts(conn):
+    """Return (state, count) of all jobs, plus the number due now among the queued."""
+    try:
+        return conn.execute(
+            """
+            SELECT state, COUNT(*), SUM(state = 'queued' AND not_before <= ?)
+              FROM jobs
+             GROUP BY state
+             ORDER BY state
+            """,
+            (time.time(),)
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch job counts: {e}")
+
+
+def fetch_batch_metadata(conn, batch_id: str):
+    """
+    Return (doi_issn, title, authors, summary) of the batch's metadata
+    rows, in the order its jobs were queued.
+    """
+    try:
+        return conn.execute(
+            """
+            SELECT m.doi_issn, m.title, m.authors, m.summary
+              FROM metadata m JOIN jobs j ON j.uid = m.id AND j.batch_id = m.batch_id
+             WHERE m.batch_id = ?
+             ORDER BY j.id
+            """,
+            (batch_id,)
+        ).fetchall()
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not fetch metadata of batch {batch_id}: {e}")
@@ -0,0 +1,199 @@
+"""
+Near-duplicate detection over extracted paper text.
+
+The same paper arrives as an arXiv preprint, a camera-ready version and a
+journal reprint; the bytes (and so the content hash) differ, the text
+barely does. Each extracted text gets a MinHash signature over its word
+5-grams, split into LSH bands whose hashes are stored in SQLite
+(text_signatures / lsh_buckets). A lookup probes one indexed bucket per
+band and only scores the few PDFs that share one, so it stays a handful
+of index seeks however many papers are stored.
+
+    python -m src.dedup index   # signatures for PDFs extracted before this existed
+    python -m src.dedup stats
+"""
+import argparse
+import hashlib
+import logging
+import re
+import sys
+import unicodedata
+import zlib
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+
+from src.config import DB_PATH, DEDUP_THRESHOLD
+from src.db import (
+    fetch_extracted_pages,
+    fetch_latest_cached_result,
+    fetch_lsh_candidates,
+    insert_text_signature,
+)
+from src.summarizer import PaperMeta
+from src.utils import setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+NUM_PERM = 128
+BANDS    = 16
+ROWS     = NUM_PERM // BANDS    # candidates from ~0.7 Jaccard up
+SHINGLE  = 5                    # words per shingle
+MIN_SHINGLES = 100              # less text than this is not worth matching
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_CHUNK = 4096                   # shingles hashed per step, bounds the temp matrix
+
+# fixed seed: signatures must stay comparable across runs
+_rng = np.random.default_rng(0x5EED)
+_A = _rng.integers(1, 2**64, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**64, size=NUM_PERM, dtype=np.uint64)
+
+
+@dataclass
+class Signature:
+    """MinHash of one text: NUM_PERM uint32 values."""
+    values: np.ndarray
+    n_shingles: int
+
+    def buckets(self) -> List[int]:
+        """One signed 64-bit bucket id per LSH band (fits an SQLite INTEGER)."""
+        out = []
+        for band in range(BANDS):
+            rows = self.values[band * ROWS:(band + 1) * ROWS].tobytes()
+            digest = hashlib.blake2b(rows, digest_size=8, salt=band.to_bytes(16, "little")).digest()
+            out.append(int.from_bytes(digest, "little", signed=True))
+        return out
+
+    def similarity(self, other: "Signature") -> float:
+        """Estimated Jaccard similarity of the two shingle sets."""
+        return float(np.mean(self.values == other.values))
+
+    @classmethod
+    def from_bytes(cls, blob: bytes, n_shingles: int = 0) -> "Signature":
+        return cls(np.frombuffer(blob, dtype=np.uint32), n_shingles)
+
+
+@dataclass
+class Duplicate:
+    """An indexed PDF whose text closely matches, and its stored result if any."""
+    content_hash: str
+    similarity: float
+    meta: PaperMeta | None = None
+
+
+def normalize_text(text: str) -> List[str]:
+    """Lower-cased ASCII words, with words hyphenated across lines joined."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    text = re.sub(r"-\s*\n\s*", "", text.lower())
+    return _WORD_RE.findall(text)
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """Distinct 32-bit hashes of the text's word SHINGLE-grams."""
+    words = normalize_text(text)
+    if len(words) < SHINGLE:
+        return np.empty(0, dtype=np.uint64)
+    wh = np.fromiter((zlib.crc32(w.encode()) for w in words), dtype=np.uint64, count=len(words))
+    n = len(words) - SHINGLE + 1
+    h = np.zeros(n, dtype=np.uint64)
+    for k in range(SHINGLE):
+        # polynomial rolling hash; uint64 arithmetic wraps mod 2**64
+        h = h * np.uint64(0x100000001B3) + wh[k:k + n]
+    return np.unique((h >> np.uint64(32)) ^ (h & np.uint64(0xFFFFFFFF)))
+
+
+def minhash(text: str) -> Signature | None:
+    """MinHash signature of text, or None if it has too few shingles."""
+    x = shingle_hashes(text)
+    if len(x) < MIN_SHINGLES:
+        return None
+    sig = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        for i in range(0, len(x), _CHUNK):
+            # multiply-shift hashing: top 32 bits of (a*x + b) mod 2**64
+            hv = (_A[:, None] * x[None, i:i + _CHUNK] + _B[:, None]) >> np.uint64(32)
+            np.minimum(sig, hv.min(axis=1).astype(np.uint32), out=sig)
+    return Signature(sig, len(x))
+
+
+def index_signature(conn, content_hash: str, sig: Signature, commit: bool = True) -> None:
+    """Add (or refresh) a PDF's signature in the LSH index."""
+    insert_text_signature(conn, content_hash, sig.values.tobytes(), sig.n_shingles,
+                          sig.buckets(), commit=commit)
+
+
+def find_duplicates(conn, sig: Signature, threshold: float = DEDUP_THRESHOLD,
+                    exclude: str | None = None) -> List[Duplicate]:
+    """Indexed PDFs with estimated similarity >= threshold, best first."""
+    rows = fetch_lsh_candidates(conn, sig.buckets(), exclude=exclude)
+    if not rows:
+        return []
+    values = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.uint32).reshape(len(rows), NUM_PERM)
+    scores = (values == sig.values).mean(axis=1)
+    found = [Duplicate(h, float(s)) for (h, _), s in zip(rows, scores) if s >= threshold]
+    return sorted(found, key=lambda d: d.similarity, reverse=True)
+
+
+def find_reusable(conn, sig: Signature, model_name: str, threshold: float = DEDUP_THRESHOLD,
+                  exclude: str | None = None) -> Duplicate | None:
+    """The closest near-duplicate that already has a result from model_name."""
+    for dup in find_duplicates(conn, sig, threshold, exclude):
+        row = fetch_latest_cached_result(conn, dup.content_hash, model_name)
+        if row is not None:
+            dup.meta = PaperMeta(
+                doi_issn=row["doi_issn"] or "",
+                title=row["title"] or "",
+                authors=row["authors"] or "",
+                summary=row["summary"] or "",
+            )
+            return dup
+    return None
+
+
+# --- CLI ---------------------------------------------------------------------
+
+def backfill(conn) -> int:
+    """Index every PDF in the text cache that has no signature yet."""
+    hashes = [h for (h,) in conn.execute(
+        """
+        SELECT DISTINCT content_hash FROM text_extractions
+         WHERE content_hash NOT IN (SELECT content_hash FROM text_signatures)
+        """
+    )]
+    n = 0
+    for content_hash in hashes:
+        pages = fetch_extracted_pages(conn, content_hash)
+        sig = minhash("\n\n".join(p["text"] for p in pages or []))
+        if sig is not None:
+            index_signature(conn, content_hash, sig, commit=False)
+            n += 1
+    conn.commit()
+    return n
+
+
+def main(argv=None) -> int:
+    from src.db import init_db
+
+    ap = argparse.ArgumentParser(prog="python -m src.dedup", description="Manage the near-duplicate index.")
+    ap.add_argument("command", choices=["index", "stats"])
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args(argv)
+
+    conn = init_db(args.db)
+    if args.command == "index":
+        print(f"indexed {backfill(conn)} PDFs")
+    else:
+        papers = conn.execute("SELECT COUNT(*) FROM text_signatures").fetchone()[0]
+        buckets = conn.execute("SELECT COUNT(*) FROM lsh_buckets").fetchone()[0]
+        print(f"papers: {papers}")
+        print(f"bucket rows: {buckets}")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Offline DOI -> title/authors/ISSN index.
+
+A Crossref or OpenAlex JSONL snapshot (optionally gzipped; Crossref's
+{"items": [...]} lines work too) is imported once into its own SQLite
+file, DOI_INDEX_PATH, kept apart from the app DB so millions of records
+do not bloat it. Once a paper's DOI is found locally, its title and
+authors come from here instead of the LLM.
+
+    python -m src.doi_index import crossref-2024/*.jsonl.gz
+    python -m src.doi_index lookup 10.1109/ICCV.2017.324
+    python -m src.doi_index bench --records 2000000
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List
+
+from src.config import DOI_INDEX_PATH
+from src.utils import DatabaseError, setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS doi_records (
+    doi TEXT PRIMARY KEY,
+    title TEXT,
+    authors TEXT,
+    issn TEXT,
+    year INTEGER
+) WITHOUT ROWID
+"""
+
+_DOI_PREFIXES = ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi:")
+
+
+@dataclass
+class DoiRecord:
+    doi: str
+    title: str
+    authors: str            # comma-separated, as in PaperMeta
+    issn: str = ""
+    year: int | None = None
+
+
+def normalize_doi(doi: str) -> str:
+    """DOIs are case-insensitive; store and look up the lower-cased bare form."""
+    doi = doi.strip().lower()
+    for prefix in _DOI_PREFIXES:
+        if doi.startswith(prefix):
+            return doi[len(prefix):]
+    return doi
+
+
+def _first(value) -> str:
+    if isinstance(value, list):
+        value = value[0] if value else ""
+    return (value or "").strip() if isinstance(value, str) else ""
+
+
+def parse_record(obj: dict) -> DoiRecord | None:
+    """A DoiRecord from one Crossref work or OpenAlex work, or None if it has no DOI/title."""
+    if "DOI" in obj:
+        # Crossref: title is a list, authors are {given, family}
+        doi, title = obj["DOI"], _first(obj.get("title"))
+        authors = ", ".join(
+            " ".join(p for p in (a.get("given"), a.get("family")) if p) or a.get("name", "")
+            for a in obj.get("author") or []
+        )
+        issn = _first(obj.get("ISSN"))
+        parts = (obj.get("issued") or {}).get("date-parts") or [[None]]
+        year = parts[0][0] if parts and parts[0] else None
+    elif obj.get("doi"):
+        # OpenAlex: doi is a URL, authors are authorships[].author.display_name
+        doi, title = obj["doi"], _first(obj.get("title") or obj.get("display_name"))
+        authors = ", ".join(
+            (a.get("author") or {}).get("display_name") or a.get("raw_author_name") or ""
+            for a in obj.get("authorships") or []
+        )
+        source = (obj.get("primary_location") or {}).get("source") or {}
+        issn = _first(source.get("issn_l") or source.get("issn"))
+        year = obj.get("publication_year")
+    else:
+        return None
+    if not title:
+        return None
+    return DoiRecord(normalize_doi(doi), " ".join(title.split()), authors.strip(", "), issn,
+                     year if isinstance(year, int) else None)
+
+
+def iter_records(path: str) -> Iterator[DoiRecord]:
+    """Records of one JSONL dump file; malformed lines are skipped."""
+    opener = gzip.open if path.endswith(".gz") else open
+    bad = 0
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                bad += 1
+                continue
+            for item in obj.get("items", [obj]) if isinstance(obj, dict) else []:
+                rec = parse_record(item) if isinstance(item, dict) else None
+                if rec is not None:
+                    yield rec
+    if bad:
+        logger.warning(f"[doi_index] {path}: skipped {bad} malformed lines")
+
+
+def open_index(path: str = DOI_INDEX_PATH) -> sqlite3.Connection:
+    """Open (creating if needed) the DOI index for writing."""
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        conn.commit()
+        return conn
+    except sqlite3.Error as e:
+        raise DatabaseError(f"Could not open DOI index {path}: {e}")
+
+
+def import_records(conn: sqlite3.Connection, records: Iterable[DoiRecord], batch_size: int = 50_000) -> int:
+    """
+    Bulk-load records; a DOI seen again replaces the earlier record.
+
+    Rows go to an unindexed temp table first and are then inserted in DOI
+    order, which turns millions of random B-tree inserts into appends.
+    """
+    try:
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA cache_size=-262144")     # 256 MiB
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS staging (doi TEXT, title TEXT, authors TEXT, issn TEXT, year INTEGER)")
+        n = 0
+        batch: List[tuple] = []
+        for rec in records:
+            batch.append((rec.doi, rec.title, rec.authors, rec.issn, rec.year))
+            if len(batch) >= batch_size:
+                conn.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?)", batch)
+                n += len(batch)
+                batch.clear()
+        if batch:
+            conn.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?)", batch)
+            n += len(batch)
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO doi_records (doi, title, authors, issn, year)
+            SELECT doi, title, authors, issn, year FROM staging ORDER BY doi, rowid
+            """
+        )
+        conn.execute("DROP TABLE staging")
+        conn.commit()
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return n
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise DatabaseError(f"DOI import failed: {e}")
+
+
+def import_dump(paths: Iterable[str], index_path: str = DOI_INDEX_PATH) -> int:
+    """Import JSONL dump files into the index at index_path; returns records read."""
+    conn = open_index(index_path)
+    try:
+        total = 0
+        for path in paths:
+            n = import_records(conn, iter_records(path))
+            logger.info(f"[doi_index] imported {n} records from {path}")
+            total += n
+        return total
+    finally:
+        conn.close()
+
+
+# --- lookups -------------------------------------------------------------------
+#
+# Lookups come from the extraction threads, so each thread keeps its own
+# read-only connection per index file.
+
+_local = threading.local()
+
+
+def _reader(path: str) -> sqlite3.Connection | None:
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        if not os.path.exists(path):
+            return None
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conns[path] = conn
+    return conn
+
+
+def lookup_doi(doi: str, index_path: str = DOI_INDEX_PATH) -> DoiRecord | None:
+    """The indexed record for doi, or None (also when no index was imported)."""
+    conn = _reader(index_path)
+    if conn is None:
+        return None
+    try:
+        row = conn.execute(
+            "SELECT doi, title, authors, issn, year FROM doi_records WHERE doi = ?",
+            (normalize_doi(doi),)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"[doi_index] lookup failed for {doi}: {e}")
+        return None
+    return DoiRecord(*row) if row else None
+
+
+# --- CLI -------------------------------------------------------------------------
+
+def _synthetic_dump(path: str, n: int) -> List[str]:
+    """Write n Crossref-style records; returns a sample of their DOIs."""
+    rng = random.Random(0)
+    sample = []
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            doi = f"10.{1000 + rng.randrange(9000)}/bench.{rng.getrandbits(40):x}.{i}"
+            if i % max(1, n // 10_000) == 0:
+                sample.append(doi)
+            f.write(json.dumps({
+                "DOI": doi,
+                "title": [f"Synthetic paper number {i} on topic {rng.randrange(500)}"],
+                "author": [{"given": "Ada", "family": f"Author{rng.randrange(10**6)}"} for _ in range(rng.randint(1, 6))],
+                "ISSN": [f"{rng.randrange(10**4):04d}-{rng.randrange(10**4):04d}"],
+                "issued": {"date-parts": [[rng.randint(1950, 2025)]]},
+            }) + "\n")
+    return sample
+
+
+def bench(n_records: int, n_lookups: int = 20_000) -> dict:
+    """Import n_records synthetic records into a temp index and time lookups."""
+    with tempfile.TemporaryDirectory() as tmp:
+        dump, index = os.path.join(tmp, "dump.jsonl"), os.path.join(tmp, "doi_index.db")
+        sample = _synthetic_dump(dump, n_records)
+        t0 = time.perf_counter()
+        import_dump([dump], index)
+        import_s = time.perf_counter() - t0
+
+        rng = random.Random(1)
+        lat = []
+        for i in range(n_lookups):
+            # half hits, half misses
+            doi = rng.choice(sample) if i % 2 == 0 else f"10.9999/missing.{i}"
+            t = time.perf_counter()
+            lookup_doi(doi, index)
+            lat.append(time.perf_counter() - t)
+        lat.sort()
+        conns = getattr(_local, "conns", {})
+        conns.pop(index).close()
+        return {
+            "records": n_records,
+            "import_s": round(import_s, 2),
+            "import_records_per_s": round(n_records / import_s),
+            "index_mb": round(os.path.getsize(index) / 2**20, 1),
+            "lookup_p50_us": round(lat[len(lat) // 2] * 1e6, 1),
+            "lookup_p99_us": round(lat[int(len(lat) * 0.99)] * 1e6, 1),
+        }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.doi_index", description="Manage the offline DOI index.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("import", help="import Crossref/OpenAlex JSONL(.gz) dump files")
+    p.add_argument("paths", nargs="+")
+    p = sub.add_parser("lookup", help="print the record for a DOI")
+    p.add_argument("doi")
+    p = sub.add_parser("bench", help="time import and lookups on synthetic records")
+    p.add_argument("--records", type=int, default=1_000_000)
+    ap.add_argument("--index", default=DOI_INDEX_PATH)
+    args = ap.parse_args(argv)
+
+    if args.command == "import":
+        t0 = time.perf_counter()
+        n = import_dump(args.paths, args.index)
+        print(f"imported {n} records in {time.perf_counter() - t0:.1f}s into {args.index}")
+    elif args.command == "lookup":
+        rec = lookup_doi(args.doi, args.index)
+        print(rec if rec else "not found")
+        return 0 if rec else 1
+    else:
+        for k, v in bench(args.records).items():
+            print(f"{k}: {v}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
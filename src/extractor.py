@@ -1,100 +1,472 @@
+import atexit
 import logging
+import multiprocessing
 import os
+import sys
+import threading
+import uuid
+import warnings
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 
-import pytesseract
 from tqdm import tqdm
+from src import metrics
+from src.config import EXTRACT_WORKERS, OCR_ADAPTIVE_DPI, OCR_ENGINE, OCR_PREPROCESS, OCR_WORKERS
+from src.ocr import get_ocr_engine, ocr_page, summarize_stats
+from src.selection import approx_tokens
 from src.utils import TextExtractionError, OCRExtractionError, setup_logger
 import fitz                        # PyMuPDF
-from typing import List
-from PIL import Image
-from langchain.schema import Document 
+from contextlib import closing
+from typing import BinaryIO, Iterator, List, Union
+from langchain_core.documents import Document
 
 
 
 logger = setup_logger(__name__, level=logging.INFO)
 
 
-def _load_native_mupdf(pdf_path: str) -> List[Document]:
+# A PDF can be given as a path or as its bytes (e.g. straight from an upload)
+PdfSource = Union[str, bytes, bytearray]
+
+
+def _open_pdf(pdf: PdfSource) -> fitz.Document:
+    """Open a path on disk, or in-memory bytes as a PyMuPDF stream (no temp file)."""
+    if isinstance(pdf, (bytes, bytearray)):
+        return fitz.open(stream=pdf, filetype="pdf")
+    return fitz.open(pdf)
+
+
+# Pages with less embedded text than this are sent to OCR, unless they
+# draw nothing at all (blank pages).
+MIN_PAGE_CHARS = 50
+
+# Expected OCR yield of one page, used to budget pages not yet OCR'd.
+_OCR_PAGE_CHARS_ESTIMATE = 2000
+
+
+def _page_needs_ocr(page, text: str, min_page_chars: int) -> bool:
+    """
+    No usable text layer, but something drawn: a scan (possibly inside a
+    Form XObject) or text converted to outlines.
+    """
+    return len(text) < min_page_chars and bool(page.get_contents())
+
+
+def _iter_native_mupdf(pdf: PdfSource, min_page_chars: int | None = None) -> Iterator[Document]:
     """
-    Very fast embedded-text extraction with PyMuPDF.
+    Lazily yield one Document per page with PyMuPDF's embedded text.
+    Pages are only read as the caller pulls them, so stopping early
+    skips the rest of the file.
+
+    With min_page_chars set, pages without a usable text layer are
+    flagged with metadata["needs_ocr"] = True.
     """
-    docs = []
     try:
-        doc = fitz.open(pdf_path)
-        logger.info(f"[mupdf] {len(doc)} pages; extracting text natively")
-        for i, page in enumerate(tqdm(doc, desc="Extracting text", unit="page"), start=1):
-            txt = page.get_text().strip()
-            docs.append(Document(page_content=txt, metadata={"page": i}))
-            logger.debug(f"[mupdf] page {i}: {len(txt)} chars")
+        with _open_pdf(pdf) as doc:
+            logger.info(f"[mupdf] {len(doc)} pages; extracting text natively")
+            for i, page in enumerate(doc, start=1):
+                txt = page.get_text().strip()
+                logger.debug(f"[mupdf] page {i}: {len(txt)} chars")
+                meta = {"page": i, "method": "native"}
+                if min_page_chars is not None and _page_needs_ocr(page, txt, min_page_chars):
+                    meta["needs_ocr"] = True
+                yield Document(page_content=txt, metadata=meta)
     except Exception as e:
         logger.warning(f"[mupdf] text extraction failed: {e}")
-    return docs
 
 
-def _render_page_to_pil(page, dpi: int):
+def _load_native_mupdf(pdf: PdfSource, min_page_chars: int | None = None) -> List[Document]:
+    """
+    Very fast embedded-text extraction with PyMuPDF (every page).
+    """
+    return list(tqdm(_iter_native_mupdf(pdf, min_page_chars), desc="Extracting text", unit="page"))
+
+
+def _budget_reached(chars: int, max_chars: int | None, max_tokens: int | None) -> bool:
+    if max_chars is not None and chars >= max_chars:
+        return True
+    if max_tokens is not None and approx_tokens(chars) >= max_tokens:
+        return True
+    return False
+
+
+def _take_within_budget(
+    docs: Iterator[Document],
+    max_chars: int | None = None,
+    max_tokens: int | None = None
+) -> List[Document]:
+    """
+    Pull pages from docs until the joined text reaches max_chars or
+    max_tokens, then close the iterator so no further pages are read.
+    Pages flagged needs_ocr count at their expected OCR yield.
+    """
+    taken: List[Document] = []
+    chars = 0
+    with closing(docs):
+        for d in docs:
+            taken.append(d)
+            if d.metadata.get("needs_ocr"):
+                chars += _OCR_PAGE_CHARS_ESTIMATE
+            elif d.page_content:
+                chars += len(d.page_content) + 2     # "\n\n" separator
+            if _budget_reached(chars, max_chars, max_tokens):
+                logger.info(f"[extract_text] budget reached after {len(taken)} pages ({chars} chars)")
+                break
+    return taken
+
+
+def _ocr_doc(text: str, page_no: int, lang: str, stats: dict) -> Document:
+    return Document(page_content=text,
+                    metadata={"page": page_no, "method": "ocr", "dpi": stats["dpi"],
+                              "lang": lang, "ocr_stats": stats})
+
+
+def _log_ocr_summary(tag: str, docs: List[Document]) -> None:
+    logger.info(f"[{tag}] Completed OCR for {len(docs)} pages: "
+                f"{summarize_stats([d.metadata['ocr_stats'] for d in docs])}")
+
+def _select_pages(total_pages: int, max_pages: int | None, pages: List[int] | None):
+    if pages is not None:
+        return [i for i in pages if i < total_pages]
+    return range(total_pages) if max_pages is None else range(min(max_pages, total_pages))
 
-    zoom = dpi / 72
-    mat  = fitz.Matrix(zoom, zoom)
-    pix  = page.get_pixmap(matrix=mat, alpha=False)
-    # build a PIL image from pixmap
-    mode = "RGB" if pix.n < 4 else "RGBA"
-    img  = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-    return img
 
 def _load_ocr_sequential(
-    pdf_path: str,
+    pdf: PdfSource,
     dpi: int = 200,
     lang: str = "eng",
-    max_pages: int | None = None
+    max_pages: int | None = None,
+    max_chars: int | None = None,
+    max_tokens: int | None = None,
+    pages: List[int] | None = None,
+    adaptive: bool = OCR_ADAPTIVE_DPI,
+    preprocess: bool = OCR_PREPROCESS,
+    engine: str | None = None
 ) -> List[Document]:
     """
-    Render pages via PyMuPDF + PIL, then OCR with pytesseract.
-    No external poppler; much faster than convert_from_path().
+    Render pages to grayscale via PyMuPDF (see src/ocr.py), then OCR with
+    the OCR_ENGINE backend (or engine). No external poppler; much faster than convert_from_path().
+    Stops early once max_chars / max_tokens of text have been collected.
+    pages (0-based) restricts OCR to those pages instead of the first max_pages.
+    With adaptive set, dpi is only the fallback when a page's text line
+    height cannot be measured.
     """ 
     docs: List[Document] = []
-    doc = fitz.open(pdf_path)
+    chars = 0
+    doc = _open_pdf(pdf)
     total_pages = len(doc)
     
-    page_range = range(total_pages) if max_pages is None else range(min(max_pages, total_pages))
+    page_range = _select_pages(total_pages, max_pages, pages)
 
-    logger.info(f"[OCR-seq] Rendering {len(page_range)} pages via PyMuPDF at {dpi} DPI")
+    logger.info(f"[OCR-seq] Rendering {len(page_range)} pages via PyMuPDF "
+                f"({'adaptive' if adaptive else dpi} DPI)")
     for i in tqdm(page_range, desc="Pages OCR’d", unit="pg"):
         page = doc[i]
         try:
-            img = _render_page_to_pil(page, dpi)
-            text = pytesseract.image_to_string(img, lang=lang, config="--psm 3")
-            docs.append(Document(page_content=text, metadata={"page": i+1}))
-            logger.debug(f"[OCR-seq] page {i+1}: {len(text)} chars")
+            text, stats = ocr_page(page, lang, dpi, adaptive, preprocess, engine)
+            docs.append(_ocr_doc(text, i+1, lang, stats))
+            logger.debug(f"[OCR-seq] page {i+1}: {len(text)} chars at {stats['dpi']} DPI")
         except Exception as e:
             logger.error(f"[OCR-seq] error on page {i+1}: {e}")
             raise OCRExtractionError(f"OCR failed on page {i+1}: {e}")
+        chars += len(text) + 2
+        if _budget_reached(chars, max_chars, max_tokens):
+            logger.info(f"[OCR-seq] budget reached after {len(docs)} pages")
+            break
+
+    _log_ocr_summary("OCR-seq", docs)
+    return docs
+
+
+# --- shared OCR process pool -------------------------------------------------
+#
+# One spawn pool serves every document for the life of the process, so each
+# worker keeps its OCR engine (and, with tesserocr, the loaded model) across
+# pages and documents. In-memory PDFs reach the workers through shared
+# memory; each worker keeps the last few opened documents.
+
+_ocr_pool: ProcessPoolExecutor | None = None
+_ocr_pool_lock = threading.Lock()
+
+# Documents kept open per worker; enough for every file being extracted at once
+_WORKER_DOC_CACHE = EXTRACT_WORKERS
+
+_worker_docs: "OrderedDict[str, fitz.Document]" = OrderedDict()
+
+
+def _init_ocr_worker(engine: str | None):
+    # load the engine up front, not on the first page
+    get_ocr_engine(engine)
+
+
+def _get_ocr_pool() -> ProcessPoolExecutor:
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            # spawn, not fork: Streamlit runs us from a multi-threaded server process
+            _ocr_pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_ocr_worker,
+                initargs=(OCR_ENGINE,)
+            )
+            logger.info(f"[OCR-par] started pool of {OCR_WORKERS} OCR processes")
+        return _ocr_pool
+
+
+def shutdown_ocr_pool() -> None:
+    """Stop the shared OCR workers; the next parallel OCR call starts new ones."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        pool, _ocr_pool = _ocr_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
 
-    logger.info(f"[OCR-seq] Completed OCR for {len(docs)} pages")
+
+atexit.register(shutdown_ocr_pool)
+
+
+def _share_pdf(pdf: PdfSource):
+    """(source descriptor for the workers, shared memory block to release or None)."""
+    if not isinstance(pdf, (bytes, bytearray)):
+        return ("path", os.path.abspath(pdf)), None
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(pdf)))
+    shm.buf[:len(pdf)] = pdf
+    return ("shm", shm.name, len(pdf)), shm
+
+
+def _worker_open(doc_key: str, source) -> fitz.Document:
+    doc = _worker_docs.get(doc_key)
+    if doc is not None:
+        _worker_docs.move_to_end(doc_key)
+        return doc
+    if source[0] == "path":
+        doc = fitz.open(source[1])
+    else:
+        _, name, size = source
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # spawned workers share the parent's resource tracker, so the
+            # block stays registered once and the parent unlinks it
+            doc = _open_pdf(bytes(shm.buf[:size]))
+        finally:
+            shm.close()
+    _worker_docs[doc_key] = doc
+    while len(_worker_docs) > _WORKER_DOC_CACHE:
+        _worker_docs.popitem(last=False)[1].close()
+    return doc
+
+
+def _ocr_page_worker(doc_key: str, source, page_no: int, dpi: int, lang: str,
+                     adaptive: bool, preprocess: bool, engine: str | None):
+    try:
+        return ocr_page(_worker_open(doc_key, source)[page_no], lang, dpi, adaptive, preprocess, engine)
+    except Exception as e:
+        raise OCRExtractionError(f"OCR failed on page {page_no+1}: {e}")
+
+
+def _load_ocr_parallel(
+    pdf: PdfSource,
+    dpi: int = 200,
+    lang: str = "eng",
+    max_pages: int | None = None,
+    workers: int | None = None,
+    max_chars: int | None = None,
+    max_tokens: int | None = None,
+    pages: List[int] | None = None,
+    adaptive: bool = OCR_ADAPTIVE_DPI,
+    preprocess: bool = OCR_PREPROCESS,
+    engine: str | None = None
+) -> List[Document]:
+    """
+    Same as _load_ocr_sequential, but renders and OCRs pages on the shared
+    OCR process pool, keeping at most `workers` pages of this document in
+    flight. Page order is preserved; any page failure cancels the pages
+    still queued and raises OCRExtractionError. Reaching max_chars /
+    max_tokens stops submitting pages.
+    """
+    with _open_pdf(pdf) as doc:
+        total_pages = len(doc)
+
+    page_range = _select_pages(total_pages, max_pages, pages)
+    workers = min(workers or OCR_WORKERS, OCR_WORKERS, len(page_range))
+    if workers <= 1:
+        return _load_ocr_sequential(pdf, dpi=dpi, lang=lang, max_pages=max_pages,
+                                    max_chars=max_chars, max_tokens=max_tokens, pages=pages,
+                                    adaptive=adaptive, preprocess=preprocess, engine=engine)
+
+    logger.info(f"[OCR-par] Rendering {len(page_range)} pages "
+                f"({'adaptive' if adaptive else dpi} DPI), {workers} at a time")
+    docs: List[Document] = []
+    chars = 0
+    doc_key = uuid.uuid4().hex
+    source, shm = _share_pdf(pdf)
+    pool = _get_ocr_pool()
+    todo = iter(page_range)
+    window = deque()
+
+    def submit_next():
+        i = next(todo, None)
+        if i is not None:
+            window.append((i, pool.submit(_ocr_page_worker, doc_key, source, i, dpi, lang,
+                                          adaptive, preprocess, engine)))
+
+    try:
+        for _ in range(workers):
+            submit_next()
+        with tqdm(total=len(page_range), desc="Pages OCR’d", unit="pg") as bar:
+            while window:
+                i, fut = window.popleft()
+                text, stats = fut.result()
+                bar.update()
+                docs.append(_ocr_doc(text, i+1, lang, stats))
+                logger.debug(f"[OCR-par] page {i+1}: {len(text)} chars at {stats['dpi']} DPI")
+                chars += len(text) + 2
+                if _budget_reached(chars, max_chars, max_tokens):
+                    logger.info(f"[OCR-par] budget reached after {len(docs)} pages")
+                    break
+                submit_next()
+    except OCRExtractionError as e:
+        logger.error(f"[OCR-par] {e}")
+        raise
+    except BrokenProcessPool as e:
+        logger.error(f"[OCR-par] worker pool died: {e}")
+        shutdown_ocr_pool()
+        raise OCRExtractionError(f"Parallel OCR failed: {e}")
+    except Exception as e:
+        logger.error(f"[OCR-par] worker pool failed: {e}")
+        raise OCRExtractionError(f"Parallel OCR failed: {e}")
+    finally:
+        # drop this document's queued pages; wait for running ones before
+        # the shared memory goes away
+        for _, fut in window:
+            fut.cancel()
+        wait([fut for _, fut in window])
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    _log_ocr_summary("OCR-par", docs)
     return docs
 
 
 
 
-def extract_text(pdf_path: str, min_chars: int = 200, ocr_max_pages:int | None = None) -> str:
+def join_pages(docs: List[Document]) -> str:
+    """Join per-page Documents into the text handed to the summarizer."""
+    return "\n\n".join(d.page_content for d in docs if d.page_content)
+
+
+def extract_pages(
+    pdf: PdfSource | BinaryIO,
+    min_page_chars: int = MIN_PAGE_CHARS,
+    ocr_max_pages: int | None = None,
+    ocr_workers: int | None = None,
+    max_chars: int | None = None,
+    max_tokens: int | None = None,
+    ocr_dpi: int = 200,
+    ocr_lang: str = "eng",
+    ocr_adaptive_dpi: bool = OCR_ADAPTIVE_DPI,
+    ocr_preprocess: bool = OCR_PREPROCESS,
+    ocr_engine: str | None = None
+) -> List[Document]:
+    """
+    Per-page variant of extract_text. Each Document's metadata carries
+    "page" and "method" ("native" or "ocr"; OCR pages also "dpi"/"lang"
+    and "ocr_stats", the per-page render/OCR timings and buffer sizes).
+
+    Every page is classified on its own: pages with a usable text layer
+    keep their native text, and only non-blank pages with less than
+    min_page_chars of embedded text are OCR'd (within the first
+    ocr_max_pages pages, if set).
+    """
+
+    if hasattr(pdf, "read"):
+        pdf = pdf.read()
+    elif isinstance(pdf, str) and not os.path.isfile(pdf):
+        raise TextExtractionError(f"File not found: {pdf}")
+
+
+    with metrics.span("extract_native"):
+        if max_chars is None and max_tokens is None:
+            docs = _load_native_mupdf(pdf, min_page_chars)
+        else:
+            docs = _take_within_budget(_iter_native_mupdf(pdf, min_page_chars), max_chars, max_tokens)
+
+    ocr_pages = [
+        d.metadata["page"] - 1 for d in docs
+        if d.metadata.pop("needs_ocr", False)
+        and (ocr_max_pages is None or d.metadata["page"] <= ocr_max_pages)
+    ]
+    if not ocr_pages:
+        logger.info(f"[mupdf] succeeded with {len(join_pages(docs))} chars")
+    else:
+        logger.info(f"[extract_text] {len(ocr_pages)}/{len(docs)} pages have no text layer; OCR'ing those")
+        # pages are OCR'd in worker processes, so CPU time is not this thread's
+        with metrics.span("ocr", cpu=False):
+            ocr_docs = _load_ocr_parallel(
+                pdf,
+                dpi=ocr_dpi,
+                lang=ocr_lang,
+                workers=ocr_workers,
+                pages=ocr_pages,
+                adaptive=ocr_adaptive_dpi,
+                preprocess=ocr_preprocess,
+                engine=ocr_engine
+            )
+        for d in ocr_docs:
+            stats = d.metadata["ocr_stats"]
+            metrics.record("ocr_page", stats["render_ms"] + stats["prep_ms"] + stats.get("ocr_ms", 0.0),
+                           page=d.metadata["page"], rss_mb=stats.get("peak_rss_mb"))
+        by_page = {d.metadata["page"]: d for d in ocr_docs}
+        docs = [by_page.get(d.metadata["page"], d) for d in docs]
+
+    if not join_pages(docs).strip():
+        if ocr_pages:
+            raise OCRExtractionError("OCR returned no text")
+        raise TextExtractionError("No text layer and no scanned pages to OCR")
+    return docs
 
-    if not os.path.isfile(pdf_path):
-        raise TextExtractionError(f"File not found: {pdf_path}")
 
+def extract_text(
+    pdf: PdfSource | BinaryIO,
+    min_chars: int | None = None,
+    ocr_max_pages: int | None = None,
+    ocr_workers: int | None = None,
+    max_chars: int | None = None,
+    max_tokens: int | None = None,
+    *,
+    min_page_chars: int = MIN_PAGE_CHARS
+) -> str:
+    """
+    Extract the text of a PDF: native text for pages that have a text
+    layer, OCR for scanned pages (see extract_pages).
 
-    native_docs = _load_native_mupdf(pdf_path)
-    native_text = "\n\n".join(d.page_content for d in native_docs if d.page_content)
-    if len(native_text) >= min_chars:
-        logger.info(f"[mupdf] succeeded with {len(native_text)} chars")
-        return native_text
+    pdf may be a path, the PDF bytes, or a readable binary buffer; bytes
+    and buffers are opened in memory without touching the disk.
 
-    logger.info(f"[extract_text] native only {len(native_text)} chars; falling back to OCR")
-    ocr_docs = _load_ocr_sequential(
-        pdf_path,
-        dpi=200,
-        lang="eng",
-        max_pages=ocr_max_pages
-    )
-    ocr_text = "\n\n".join(d.page_content for d in ocr_docs if d.page_content)
-    if not ocr_text.strip():
-        raise OCRExtractionError("Sequential OCR returned no text")
-    return ocr_text
+    With max_chars and/or max_tokens set, pages are pulled lazily and
+    extraction stops as soon as the budget is met; without them every
+    page is read (full-document mode).
+
+    min_chars is deprecated and keeps its old, document-wide meaning:
+    every page is OCR'd if the whole text layer is shorter than that,
+    none otherwise. Pass min_page_chars instead.
+    """
+    if min_chars is not None:
+        warnings.warn("extract_text(min_chars) is deprecated; pass min_page_chars= (a per-page threshold)",
+                      DeprecationWarning, stacklevel=2)
+        if hasattr(pdf, "read"):
+            pdf = pdf.read()
+        native = join_pages(_iter_native_mupdf(pdf))
+        min_page_chars = 0 if len(native.strip()) >= min_chars else sys.maxsize
+    return join_pages(extract_pages(
+        pdf,
+        min_page_chars=min_page_chars,
+        ocr_max_pages=ocr_max_pages,
+        ocr_workers=ocr_workers,
+        max_chars=max_chars,
+        max_tokens=max_tokens
+    ))
@@ -1,7 +1,16 @@
-from src.utils import DOIParsingError, TitleAuthorParsingError
+from src.config import LOCAL_META_MIN_CONFIDENCE
+from src.utils import DOIParsingError, TitleAuthorParsingError, setup_logger
+import logging
 import re
-from typing import Tuple
-from .extractor import extract_text
+import statistics
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from .doi_index import lookup_doi
+from .extractor import PdfSource, _open_pdf, extract_text
+
+
+logger = setup_logger(__name__, level=logging.INFO)
 
 DOI_REGEX  = re.compile(r"\b10\.\d{4,9}/[-._;()/:A-Z0-9]+\b", re.I)
 ISSN_REGEX = re.compile(r"\b\d{4}-\d{3}[\dX]\b")
@@ -43,4 +52,274 @@ def extract_all(pdf_path: str) -> dict:
         "doi_issn": doi or issn,
         "title": title,
         "authors": authors,
-    }
\ No newline at end of file
+    }
+
+
+# --- local metadata fast path ------------------------------------------------
+#
+# DOI/ISSN, title and authors are read from the PDF itself where possible:
+# the XMP/Info metadata, regexes over the first page, and the font sizes of
+# the first page's lines (the title is the largest text near the top, the
+# authors are the rows right below it). Every guess carries a confidence;
+# fields at or above LOCAL_META_MIN_CONFIDENCE are not asked of the LLM.
+
+@dataclass
+class FieldGuess:
+    value: str
+    confidence: float
+    source: str
+
+
+@dataclass
+class LocalMetadata:
+    doi_issn: FieldGuess | None = None
+    title:    FieldGuess | None = None
+    authors:  FieldGuess | None = None
+
+    def known(self, min_confidence: float = LOCAL_META_MIN_CONFIDENCE) -> Dict[str, str]:
+        """Fields confident enough to skip the LLM, as {field: value}."""
+        return {
+            name: guess.value
+            for name, guess in (("doi_issn", self.doi_issn), ("title", self.title), ("authors", self.authors))
+            if guess is not None and guess.value and guess.confidence >= min_confidence
+        }
+
+
+_ISSN_LABEL_RE = re.compile(r"\b(?:e-?|p-?|print\s+|online\s+)?ISSN[:\s]*(\d{4}-\d{3}[\dX])", re.I)
+
+# Info-dict titles that are file names or tool defaults, not paper titles
+_JUNK_TITLE_RE = re.compile(r"^(microsoft word|untitled|title|document\d*|slide \d+)\b|\.(docx?|pdf|tex|dvi|ps)$", re.I)
+
+_NAME_PARTICLES = {"van", "von", "de", "der", "den", "da", "di", "du", "la", "le", "del", "dos", "bin", "al"}
+_NOT_NAME_WORDS = re.compile(
+    r"\b(university|universit|department|institute|school|college|laborator|lab|inc|corp|"
+    r"abstract|center|centre|faculty|research|science|email|correspondence)", re.I
+)
+_AUTHOR_MARKS_RE = re.compile(r"[\d*†‡§¶#∗⋆✉]+|\S+@\S+")
+_AUTHOR_SPLIT_RE = re.compile(r"\s*(?:,|;|&|\band\b)\s*")
+
+
+# LaTeX PDFs often emit accents as a spacing mark before the letter ("Doll´ar")
+_SPACING_ACCENTS = {"´": "\u0301", "`": "\u0300", "¨": "\u0308", "ˆ": "\u0302", "˜": "\u0303"}
+_SPACING_ACCENT_RE = re.compile("([" + "".join(_SPACING_ACCENTS) + "])([A-Za-z])")
+
+
+def _fix_accents(text: str) -> str:
+    return _SPACING_ACCENT_RE.sub(
+        lambda m: unicodedata.normalize("NFC", m.group(2) + _SPACING_ACCENTS[m.group(1)]), text
+    )
+
+
+def _norm(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "", text.lower())
+
+
+def _agrees(a: str, b: str) -> bool:
+    a, b = _norm(a), _norm(b)
+    return bool(a and b) and (a == b or a in b or b in a)
+
+
+def _clean_doi(doi: str) -> str:
+    return doi.rstrip(".,;:)")
+
+
+def _issn_valid(issn: str) -> bool:
+    digits = issn.replace("-", "")
+    total = sum(int(c) * w for c, w in zip(digits[:7], range(8, 1, -1)))
+    check = (11 - total % 11) % 11
+    return digits[7].upper() == ("X" if check == 10 else str(check))
+
+
+def _guess_doi_issn(first_page: str, info: dict, xmp: str) -> FieldGuess | None:
+    for source, text, conf in (("xmp", xmp, 0.95), ("info", f"{info.get('subject', '')} {info.get('keywords', '')}", 0.95)):
+        m = DOI_REGEX.search(text or "")
+        if m:
+            return FieldGuess(_clean_doi(m.group(0)), conf, source)
+
+    # only the first page: later DOIs are usually references
+    dois = {_clean_doi(m.group(0)) for m in DOI_REGEX.finditer(first_page)}
+    if len(dois) == 1:
+        return FieldGuess(dois.pop(), 0.9, "first-page")
+    if dois:
+        first = _clean_doi(DOI_REGEX.search(first_page).group(0))
+        return FieldGuess(first, 0.6, "first-page")
+
+    m = _ISSN_LABEL_RE.search(first_page)
+    if m and _issn_valid(m.group(1)):
+        return FieldGuess(m.group(1), 0.85, "first-page")
+    for m in ISSN_REGEX.finditer(first_page):
+        # unlabelled: the checksum rules out year ranges like 2019-2020
+        if _issn_valid(m.group(0)):
+            return FieldGuess(m.group(0), 0.5, "first-page")
+    return None
+
+
+def _page_rows(page) -> List[Tuple[float, float, str]]:
+    """
+    (top, font size, text) per visual row of the page, top to bottom.
+    Separate text lines on one row (e.g. author columns) are joined with
+    ", " and superscripts (affiliation marks) are dropped.
+    """
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            # horizontal text only; skips rotated margin stamps (arXiv ids)
+            if abs(line["dir"][1]) > 0.1:
+                continue
+            spans = [sp for sp in line["spans"] if sp["text"].strip()]
+            if not spans:
+                continue
+            size = max(sp["size"] for sp in spans)
+            text = "".join(
+                sp["text"] for sp in line["spans"]
+                if not sp["text"].strip() or (not (sp["flags"] & 1) and sp["size"] >= 0.8 * size)
+            ).strip()
+            text = _fix_accents(re.sub(r"\s+", " ", text))
+            if text:
+                lines.append((line["bbox"][1], line["bbox"][0], size, text))
+    lines.sort()
+
+    rows: List[List] = []
+    for top, left, size, text in lines:
+        if rows and abs(top - rows[-1][0]) <= 3:
+            rows[-1][1] = max(rows[-1][1], size)
+            rows[-1][2].append((left, text))
+        else:
+            rows.append([top, size, [(left, text)]])
+    return [
+        (top, size, ", ".join(t for _, t in sorted(parts)))
+        for top, size, parts in rows
+    ]
+
+
+def _body_size(page) -> float:
+    sizes = [
+        sp["size"]
+        for block in page.get_text("dict")["blocks"]
+        for line in block.get("lines", [])
+        for sp in line["spans"]
+        for _ in range(len(sp["text"].strip()))
+    ]
+    return statistics.median(sizes) if sizes else 0.0
+
+
+def _parse_names(row: str) -> List[str] | None:
+    """The row as a list of person names, or None if it does not look like one."""
+    if _NOT_NAME_WORDS.search(row):
+        return None
+    names = [n.strip(" .,") for n in _AUTHOR_SPLIT_RE.split(_AUTHOR_MARKS_RE.sub(" ", row))]
+    names = [re.sub(r"\s+", " ", n) for n in names if n.strip(" .,")]
+    if not names or len(names) > 30:
+        return None
+    for name in names:
+        words = name.split()
+        if not 2 <= len(words) <= 5:
+            return None
+        for w in words:
+            if w.lower() in _NAME_PARTICLES:
+                continue
+            if not w[0].isupper() or any(c.isdigit() for c in w):
+                return None
+    return names
+
+
+def _guess_title_authors(page, info: dict) -> Tuple[FieldGuess | None, FieldGuess | None]:
+    rows = _page_rows(page)
+    body = _body_size(page)
+    half = page.rect.height / 2
+
+    candidates = [r for r in rows if r[0] < half and len(r[2]) >= 8 and len(r[2].split()) >= 2]
+    title = authors = None
+    title_end = -1
+    if candidates:
+        size = max(r[1] for r in candidates)
+        start = next(i for i, r in enumerate(rows) if r in candidates and r[1] >= size - 0.5)
+        end = start
+        while end + 1 < len(rows) and rows[end + 1][1] >= size - 0.5 and rows[end + 1][0] - rows[end][0] < 2.5 * size:
+            end += 1
+        text = " ".join(r[2] for r in rows[start:end + 1])
+        ratio = size / body if body else 1.0
+        conf = 0.85 if ratio >= 1.3 else 0.7 if ratio >= 1.15 else 0.5
+        title = FieldGuess(text, conf, "font-size")
+        title_end = end
+
+    meta_title = (info.get("title") or "").strip()
+    if meta_title and len(meta_title.split()) >= 3 and not _JUNK_TITLE_RE.search(meta_title):
+        if title and _agrees(title.value, meta_title):
+            title = FieldGuess(title.value, 0.95, "font-size+info")
+        elif title is None or title.confidence < 0.7:
+            title = FieldGuess(meta_title, 0.7, "info")
+
+    if title_end >= 0:
+        # author rows sit right below the title, before the abstract
+        names: List[str] = []
+        for top, size, text in rows[title_end + 1:title_end + 5]:
+            if text.lower().startswith("abstract"):
+                break
+            parsed = _parse_names(text)
+            if parsed:
+                names.extend(parsed)
+            elif names:
+                break
+        if names:
+            authors = FieldGuess(", ".join(names), 0.8, "font-size")
+
+    meta_author = (info.get("author") or "").strip()
+    if meta_author and (" " in meta_author or "," in meta_author):
+        if authors and _agrees(authors.value.split(",")[0], meta_author):
+            authors = FieldGuess(authors.value, 0.95, "font-size+info")
+        elif authors is None:
+            authors = FieldGuess(meta_author, 0.7, "info")
+    return title, authors
+
+
+def _apply_doi_index(local: LocalMetadata) -> None:
+    """
+    Replace the title/author guesses with the offline DOI index's record.
+    A weak DOI guess (e.g. one of several on page 1) is only trusted if
+    the record's title agrees with the title found on the page.
+    """
+    doi = local.doi_issn
+    if doi is None or not DOI_REGEX.fullmatch(doi.value):
+        return
+    record = lookup_doi(doi.value)
+    if record is None:
+        return
+    if doi.confidence < LOCAL_META_MIN_CONFIDENCE and not (local.title and _agrees(local.title.value, record.title)):
+        return
+    doi.confidence = max(doi.confidence, 0.95)
+    local.title = FieldGuess(record.title, 0.98, "doi-index")
+    if record.authors:
+        local.authors = FieldGuess(record.authors, 0.98, "doi-index")
+
+
+def extract_local_metadata(pdf: PdfSource, first_page_text: str | None = None) -> LocalMetadata:
+    """
+    Deterministic DOI/ISSN, title and author guesses with confidences.
+    first_page_text (e.g. OCR output) is used for the regexes when the PDF
+    has no text layer on its first page.
+    """
+    try:
+        with _open_pdf(pdf) as doc:
+            if len(doc) == 0:
+                return LocalMetadata()
+            info = doc.metadata or {}
+            xmp = doc.get_xml_metadata() or ""
+            page = doc[0]
+            text = page.get_text() or first_page_text or ""
+            doi_issn = _guess_doi_issn(text, info, xmp)
+            title, authors = _guess_title_authors(page, info)
+    except Exception as e:
+        logger.warning(f"[metadata] local extraction failed: {e}")
+        return LocalMetadata()
+
+    local = LocalMetadata(doi_issn=doi_issn, title=title, authors=authors)
+    _apply_doi_index(local)
+    logger.info(
+        "[metadata] local guesses: " + ", ".join(
+            f"{name}={g.confidence:.2f} ({g.source})" if g else f"{name}=none"
+            # after the DOI index, so the log shows the sources and confidences used
+            for name, g in (("doi_issn", local.doi_issn), ("title", local.title), ("authors", local.authors))
+        )
+    )
+    return local
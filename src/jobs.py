@@ -0,0 +1,247 @@
+"""
+Durable job queue in SQLite.
+
+Callers only enqueue: store the upload, then enqueue() a job for it in
+the same transaction. Worker processes (`python -m src.worker`) claim()
+due jobs, a batch at a time, under a lease they keep renewing, and move
+each job through
+
+    queued -> extracting -> summarizing -> done | failed
+
+A failed attempt goes back to "queued" after JOB_RETRY_DELAY seconds,
+doubled per attempt, until JOB_MAX_ATTEMPTS are used up. The jobs of a
+worker that dies stop having their lease renewed and are requeued by the
+next claim. The queue is in the DB, so jobs survive app and worker
+restarts and any number of workers can share it. Once every job of a
+batch is done or failed, finish_batch() writes the batch's Excel.
+
+    python -m src.jobs status [--batch <batch_id>]
+    python -m src.jobs retry --batch <batch_id>     # requeue failed jobs
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from src import metrics
+from src.config import (
+    DB_PATH,
+    JOB_CLAIM_SIZE,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_DELAY,
+    OUTPUT_DIR
+)
+from src.db import (
+    batch_transaction,
+    claim_jobs,
+    delete_output,
+    fetch_batch_metadata,
+    fetch_job_counts,
+    fetch_jobs,
+    init_db,
+    insert_job,
+    insert_metadata,
+    insert_output,
+    requeue_expired_jobs,
+    requeue_failed_jobs,
+    update_job
+)
+from src.utils import DatabaseError, setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+STATES = ("queued", "extracting", "summarizing", "done", "failed")
+FINISHED = ("done", "failed")
+
+# "summarize": the full pipeline for a new upload; "resummarize": only the
+# LLM stage for an existing one, from its cached text
+KINDS = ("summarize", "resummarize")
+
+
+@dataclass
+class Job:
+    """A claimed job, as a worker sees it."""
+    id: int
+    uid: str
+    batch_id: str
+    kind: str
+    model_name: str
+    max_pages: Optional[int]
+    force: bool
+    attempts: int                   # including the current one
+    waited_s: float                 # due but unclaimed, before this attempt
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "Job":
+        return cls(row["id"], row["uid"], row["batch_id"], row["kind"], row["model_name"],
+                   row["max_pages"], bool(row["force"]), row["attempts"],
+                   max(row["updated_at"] - row["not_before"], 0.0))
+
+
+def enqueue(conn, uid: str, batch_id: str, model_name: str, kind: str = "summarize",
+            max_pages: int | None = None, force: bool = False, commit: bool = True) -> int:
+    """Queue a job for upload uid; returns its id. force skips the result cache and near-duplicate reuse."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown job kind {kind!r}; expected one of {KINDS}")
+    return insert_job(conn, uid, batch_id, kind, model_name, max_pages, force, commit=commit)
+
+
+def claim(conn, worker: str, limit: int | None = None) -> List[Job]:
+    """
+    Requeue jobs whose lease expired, then claim up to limit (default
+    JOB_CLAIM_SIZE) due jobs of the oldest waiting batch for worker.
+    """
+    for batch_id in requeue_expired_jobs(conn, JOB_MAX_ATTEMPTS):
+        # out of attempts; the batch may be finished now
+        finish_batch(conn, batch_id)
+    rows = claim_jobs(conn, worker, limit or JOB_CLAIM_SIZE, time.time() + JOB_LEASE_SECONDS)
+    return [Job.from_row(r) for r in rows]
+
+
+def mark_summarizing(conn, job: Job, worker: str) -> bool:
+    """The job's text is extracted; it moves on to the LLM stage."""
+    return update_job(conn, job.id, worker, "summarizing")
+
+
+def store_fields(conn, job: Job, worker: str, fields: Dict[str, str]) -> bool:
+    """Save the title/authors/summary streamed so far, for the app to show."""
+    return update_job(conn, job.id, worker, "summarizing", fields=json.dumps(fields))
+
+
+def job_fields(row: Dict) -> Dict[str, str]:
+    """The streamed (or, once done, final) fields of a fetch_jobs() row."""
+    return json.loads(row["fields"]) if row.get("fields") else {}
+
+
+def complete(conn, job: Job, worker: str, meta, reused_from: str | None = None,
+             commit: bool = True) -> bool:
+    """
+    Store the job's metadata row and mark it done, in one transaction with
+    commit=False (batch_transaction); its fields become the final ones.
+    Returns False and writes nothing if the job is no longer this worker's.
+    """
+    if not update_job(conn, job.id, worker, "done", reused_from=reused_from,
+                      fields=json.dumps(meta.model_dump()), commit=False):
+        logger.warning(f"[jobs] job {job.id} (UID={job.uid}) was taken over by another worker; dropping its result")
+        if commit:
+            conn.commit()
+        return False
+    insert_metadata(conn, job.uid, job.batch_id, meta.doi_issn, meta.title,
+                    meta.authors, meta.summary, job.model_name, commit=commit)
+    return True
+
+
+def fail(conn, job: Job, worker: str, error: Exception) -> str:
+    """Record a failed attempt; returns the job's new state, "queued" (retry) or "failed"."""
+    message = f"{type(error).__name__}: {error}"
+    if job.attempts < JOB_MAX_ATTEMPTS:
+        delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        update_job(conn, job.id, worker, "queued", error=message, not_before=time.time() + delay)
+        logger.warning(f"[jobs] job {job.id} (UID={job.uid}) attempt {job.attempts} failed, retrying in {delay:.0f} s: {message}")
+        return "queued"
+    update_job(conn, job.id, worker, "failed", error=message)
+    logger.error(f"[jobs] job {job.id} (UID={job.uid}) failed after {job.attempts} attempts: {message}")
+    return "failed"
+
+
+def batch_progress(jobs: List[Dict]) -> Dict[str, int]:
+    """Job count per state of fetch_jobs() rows, plus "total"."""
+    counts = dict.fromkeys(STATES, 0)
+    for j in jobs:
+        counts[j["state"]] += 1
+    counts["total"] = len(jobs)
+    return counts
+
+
+def is_finished(jobs: List[Dict]) -> bool:
+    return bool(jobs) and all(j["state"] in FINISHED for j in jobs)
+
+
+def batch_excel(records) -> bytes:
+    """The Excel of a batch: one row of (doi_issn, title, authors, summary) per paper."""
+    import pandas as pd
+
+    df = pd.DataFrame(records, columns=["DOI/ISSN", "Title", "Authors", "Summary"])
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, sheet_name="Metadata")
+    return buf.getvalue()
+
+
+def finish_batch(conn, batch_id: str) -> bool:
+    """
+    Write the batch's Excel (replacing an earlier one, e.g. before failed
+    jobs were retried) once all its jobs are done or failed. Returns True
+    if it was written.
+    """
+    if not is_finished(fetch_jobs(conn, batch_id=batch_id)):
+        return False
+    records = fetch_batch_metadata(conn, batch_id)
+    if not records:
+        logger.warning(f"[jobs] batch {batch_id} finished without results")
+        return False
+    with metrics.span("excel"):
+        excel_bytes = batch_excel(records)
+    output_path = os.path.join(OUTPUT_DIR, f"{batch_id}.xlsx")
+    with open(output_path, "wb") as f:
+        f.write(excel_bytes)
+    with batch_transaction(conn):
+        delete_output(conn, batch_id, commit=False)
+        insert_output(conn, batch_id, excel_bytes, commit=False)
+    logger.info(f"[jobs] batch {batch_id} finished: {len(records)} papers, Excel at {output_path}")
+    return True
+
+
+# --- CLI -----------------------------------------------------------------------
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.jobs", description="Inspect and retry queued jobs.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("status", help="jobs per state, or the jobs of a batch")
+    p.add_argument("--batch")
+    p = sub.add_parser("retry", help="queue failed jobs again")
+    p.add_argument("--batch")
+    p.add_argument("--uid")
+    p.add_argument("--all", action="store_true", help="every failed job")
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args(argv)
+
+    conn = init_db(args.db)
+    try:
+        if args.command == "retry":
+            if not (args.batch or args.uid or args.all):
+                ap.error("retry needs --batch, --uid or --all")
+            n = requeue_failed_jobs(conn, batch_id=args.batch, uid=args.uid)
+            print(f"requeued {n} jobs")
+            return 0
+        if args.batch:
+            jobs = fetch_jobs(conn, batch_id=args.batch)
+            if not jobs:
+                print("no such batch")
+                return 1
+            for j in jobs:
+                print(f"{j['id']:>7}  {j['state']:<12}{j['attempts']:>3}  {j['file_name'] or j['uid']}"
+                      + (f"  ({j['error']})" if j["error"] and j["state"] != "done" else ""))
+            return 0
+        rows = fetch_job_counts(conn)
+        if not rows:
+            print("queue is empty")
+        for state, n, due in rows:
+            print(f"{state:<12}{n:>8}" + (f"  ({due} due)" if state == "queued" else ""))
+        return 0
+    except DatabaseError as e:
+        print(e.message, file=sys.stderr)
+        return 2
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
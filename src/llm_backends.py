@@ -0,0 +1,147 @@
+"""
+Chat backends behind LLMModel.
+
+Every backend is a chat model with LangChain's call shape: invoke(messages)
+and ainvoke(messages) return an AIMessage, astream(messages) yields
+AIMessageChunks, and usage_metadata carries the token counts the rate
+limiter and src.metrics read. Two are built in:
+
+- "groq":   ChatGroq against the Groq API (needs GROQ_API_KEY)
+- "openai": any OpenAI-compatible /chat/completions server, e.g. a local
+            llama.cpp server, Ollama (http://localhost:11434/v1) or vLLM,
+            at OLLAMA_URL
+
+The backend of each model comes from LLM_BACKENDS (default
+DEFAULT_LLM_BACKEND); a URL there selects "openai" at that URL, so
+several local servers can serve different models.
+"""
+import json
+import os
+from typing import AsyncIterator, Dict, List, Tuple
+
+import httpx
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from src.config import DEFAULT_LLM_BACKEND, LLM_BACKENDS, LLM_TIMEOUT, OLLAMA_URL
+from src.utils import SummarizationError
+
+
+BACKENDS = ("groq", "openai")
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def backend_for(model_name: str) -> Tuple[str, str | None]:
+    """(backend name, base URL or None) configured for model_name."""
+    choice = LLM_BACKENDS.get(model_name, DEFAULT_LLM_BACKEND)
+    if choice.startswith(("http://", "https://")):
+        return "openai", choice.rstrip("/")
+    if choice not in BACKENDS:
+        raise SummarizationError(f"Unknown LLM backend {choice!r} for {model_name}; expected one of {BACKENDS} or a URL")
+    return choice, OLLAMA_URL.rstrip("/") if choice == "openai" else None
+
+
+def _usage(usage: Dict | None) -> Dict | None:
+    if not usage:
+        return None
+    prompt, completion = usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return {"input_tokens": prompt, "output_tokens": completion,
+            "total_tokens": usage.get("total_tokens") or prompt + completion}
+
+
+class OpenAICompatChat:
+    """
+    Chat model for an OpenAI-compatible /chat/completions endpoint, over
+    the shared httpx pools. Errors are raised as httpx exceptions, which
+    src.ratelimit retries on 429/5xx and dropped connections.
+    """
+    def __init__(self, model: str, base_url: str, http_client: httpx.Client,
+                 http_async_client: httpx.AsyncClient | None = None,
+                 api_key: str | None = None,
+                 timeout: float = LLM_TIMEOUT, temperature: float = 0.0):
+        self.model = model
+        self.url = f"{base_url}/chat/completions"
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.http_client = http_client
+        self.http_async_client = http_async_client
+        self.timeout = timeout
+        self.temperature = temperature
+
+    def _async_client(self) -> httpx.AsyncClient:
+        if self.http_async_client is None:
+            raise SummarizationError("Async calls need a client created inside the event loop")
+        return self.http_async_client
+
+    def _body(self, messages: List[BaseMessage], stream: bool = False) -> Dict:
+        body = {
+            "model": self.model,
+            "messages": [{"role": _ROLES.get(m.type, m.type), "content": m.content} for m in messages],
+            "temperature": self.temperature,
+        }
+        if stream:
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    @staticmethod
+    def _message(data: Dict) -> AIMessage:
+        try:
+            content = data["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError):
+            raise SummarizationError(f"Malformed chat completion: {str(data)[:200]}")
+        return AIMessage(content=content, usage_metadata=_usage(data.get("usage")))
+
+    def invoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        resp = self.http_client.post(self.url, json=self._body(messages), headers=self.headers, timeout=self.timeout)
+        resp.raise_for_status()
+        return self._message(resp.json())
+
+    async def ainvoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        resp = await self._async_client().post(self.url, json=self._body(messages), headers=self.headers, timeout=self.timeout)
+        resp.raise_for_status()
+        return self._message(resp.json())
+
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        """Server-sent events; the usage arrives on a last chunk with no choices."""
+        request = self._async_client().stream("POST", self.url, json=self._body(messages, stream=True),
+                                              headers=self.headers, timeout=self.timeout)
+        async with request as resp:
+            if resp.is_error:
+                await resp.aread()
+                resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                choices = event.get("choices") or [{}]
+                text = (choices[0].get("delta") or {}).get("content") or ""
+                usage = _usage(event.get("usage"))
+                if text or usage:
+                    yield AIMessageChunk(content=text, usage_metadata=usage)
+
+
+def new_chat_client(model_name: str, http_client: httpx.Client,
+                    http_async_client: httpx.AsyncClient | None = None):
+    """A chat model for model_name on its configured backend, using the given pools."""
+    backend, base_url = backend_for(model_name)
+    if backend == "openai":
+        return OpenAICompatChat(model_name, base_url, http_client, http_async_client,
+                                api_key=os.getenv("OPENAI_COMPAT_API_KEY"))
+
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise SummarizationError(f"GROQ_API_KEY must be set to use {model_name} on Groq")
+    # imported here so deployments on local backends only do not load it
+    from langchain_groq import ChatGroq
+    # retries are handled by src.ratelimit, so the client itself never retries
+    return ChatGroq(model=model_name,
+                    temperature=0,
+                    max_tokens=None,
+                    timeout=LLM_TIMEOUT,
+                    max_retries=0,
+                    api_key=api_key,
+                    http_client=http_client,
+                    http_async_client=http_async_client)
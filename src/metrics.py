@@ -0,0 +1,360 @@
+"""
+Per-stage timings of the pipeline, persisted per upload and batch.
+
+A caller opens recording(batch_id) around a batch; inside it, span()
+times a stage (save, DB insert, native extraction, OCR, LLM call, Excel
+export, ...) and record() adds one measured elsewhere (an OCR page timed
+in its worker process). The scope is a context variable, so asyncio
+tasks inherit it and bind() carries it onto executor threads; with no
+recording open, span() and record() do nothing. Spans are buffered in
+memory and written to the metrics table by MetricsRecorder.flush(), in
+the caller's transaction.
+
+    python -m src.metrics report --batch <batch_id>
+    python -m src.metrics export > metrics.prom
+    python -m src.metrics serve --port 9464
+"""
+import argparse
+import contextvars
+import http.server
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import Dict, Iterator, List, Optional
+
+from src.config import DB_PATH, METRICS_ENABLED, METRICS_WINDOW_HOURS
+from src.db import fetch_metric_totals, fetch_metrics, fetch_stage_durations, init_db, insert_metrics_many
+from src.utils import setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+# Prometheus metric name prefix
+PREFIX = "paper_summarizer"
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def rss_mb() -> float | None:
+    """Current resident set size of this process in MiB (Linux only)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+@dataclass
+class Span:
+    stage: str
+    started_at: float                   # Unix time
+    duration_ms: float
+    uid: Optional[str] = None
+    page: Optional[int] = None
+    cpu_ms: Optional[float] = None      # CPU time of the thread that ran the stage
+    rss_mb: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    ok: bool = True
+
+
+class MetricsRecorder:
+    """Thread-safe buffer of one batch's spans."""
+    def __init__(self, batch_id: str):
+        self.batch_id = batch_id
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def flush(self, conn, commit: bool = True) -> int:
+        """Write the buffered spans to the metrics table; returns how many."""
+        with self._lock:
+            spans, self.spans = self.spans, []
+        insert_metrics_many(conn, [
+            (self.batch_id, s.uid, s.stage, s.page, s.started_at, s.duration_ms, s.cpu_ms,
+             s.rss_mb, s.prompt_tokens, s.completion_tokens, int(s.ok))
+            for s in spans
+        ], commit=commit)
+        return len(spans)
+
+
+@dataclass
+class _Scope:
+    recorder: MetricsRecorder
+    uid: Optional[str] = None
+
+
+_scope: contextvars.ContextVar[Optional[_Scope]] = contextvars.ContextVar("metrics_scope", default=None)
+
+
+@contextmanager
+def recording(batch_id: str) -> Iterator[Optional[MetricsRecorder]]:
+    """Collect the spans of batch_id in this context; yields None if METRICS_ENABLED is off."""
+    if not METRICS_ENABLED:
+        yield None
+        return
+    recorder = MetricsRecorder(batch_id)
+    token = _scope.set(_Scope(recorder))
+    try:
+        yield recorder
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def for_upload(uid: str) -> Iterator[None]:
+    """Attribute the spans recorded in this context to upload uid."""
+    scope = _scope.get()
+    if scope is None:
+        yield
+        return
+    token = _scope.set(_Scope(scope.recorder, uid))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def bind(fn, *args, **kwargs):
+    """fn(*args, **kwargs) as a callable that runs in a copy of this context, for executors."""
+    return partial(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def record(stage: str, duration_ms: float, started_at: float | None = None, **fields) -> None:
+    """Add a span measured by the caller (fields as in Span)."""
+    scope = _scope.get()
+    if scope is None:
+        return
+    fields.setdefault("uid", scope.uid)
+    if started_at is None:
+        started_at = time.time() - duration_ms / 1000
+    scope.recorder.add(Span(stage, started_at, round(duration_ms, 3), **fields))
+
+
+@contextmanager
+def span(stage: str, uid: str | None = None, page: int | None = None, cpu: bool = True) -> Iterator[Dict]:
+    """
+    Time the block as one stage. The yielded dict takes token counts
+    ("prompt_tokens", "completion_tokens") found inside the block. cpu
+    records the thread's CPU time, which only means something for a
+    block that does not await (other tasks run on the same thread).
+    """
+    scope = _scope.get()
+    extra: Dict = {}
+    if scope is None:
+        yield extra
+        return
+    started_at, t0 = time.time(), time.perf_counter()
+    c0 = time.thread_time() if cpu else None
+    ok = False
+    try:
+        yield extra
+        ok = True
+    finally:
+        scope.recorder.add(Span(
+            stage,
+            started_at,
+            round((time.perf_counter() - t0) * 1000, 3),
+            uid=uid if uid is not None else scope.uid,
+            page=page,
+            cpu_ms=round((time.thread_time() - c0) * 1000, 3) if cpu else None,
+            rss_mb=rss_mb(),
+            prompt_tokens=extra.get("prompt_tokens"),
+            completion_tokens=extra.get("completion_tokens"),
+            ok=ok
+        ))
+
+
+def note_usage(extra: Dict, result) -> None:
+    """Copy a LangChain message's usage_metadata into a span's token fields."""
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        extra["prompt_tokens"] = usage.get("input_tokens")
+        extra["completion_tokens"] = usage.get("output_tokens")
+
+
+class PhaseTimer:
+    """Wall time of the consecutive phases of one run, e.g. a Streamlit script run."""
+    def __init__(self, started: float | None = None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases: Dict[str, float] = {}
+        self._last = self.started
+
+    def mark(self, phase: str) -> None:
+        """End phase now; it started at the previous mark."""
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0.0) + (now - self._last) * 1000, 1)
+        self._last = now
+
+    @property
+    def total_ms(self) -> float:
+        return round((self._last - self.started) * 1000, 1)
+
+    def report(self) -> str:
+        return f"{self.total_ms:.0f} ms (" + ", ".join(f"{k} {v:.0f}" for k, v in self.phases.items()) + ")"
+
+
+# --- reports -----------------------------------------------------------------
+
+def _quantile(values: List[float], q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def stage_summary(spans: List[Dict]) -> List[Dict]:
+    """Per-stage count, total/mean/p50/p90/max ms and tokens of spans as returned by fetch_metrics."""
+    by_stage: Dict[str, List[Dict]] = {}
+    for s in spans:
+        by_stage.setdefault(s["stage"], []).append(s)
+    rows = []
+    for stage, group in by_stage.items():
+        ms = sorted(s["duration_ms"] for s in group)
+        rows.append({
+            "stage": stage,
+            "count": len(group),
+            "errors": sum(1 for s in group if not s["ok"]),
+            "total_ms": round(sum(ms), 1),
+            "mean_ms": round(sum(ms) / len(ms), 1),
+            "p50_ms": round(_quantile(ms, 0.5), 1),
+            "p90_ms": round(_quantile(ms, 0.9), 1),
+            "max_ms": round(ms[-1], 1),
+            "cpu_ms": round(sum(s["cpu_ms"] or 0 for s in group), 1),
+            "prompt_tokens": sum(s["prompt_tokens"] or 0 for s in group),
+            "completion_tokens": sum(s["completion_tokens"] or 0 for s in group),
+        })
+    return sorted(rows, key=lambda r: -r["total_ms"])
+
+
+def upload_breakdown(spans: List[Dict]) -> Dict[str, Dict[str, float]]:
+    """uid -> stage -> total ms; batch-level spans (no uid) are left out."""
+    out: Dict[str, Dict[str, float]] = {}
+    for s in spans:
+        if s["uid"] is None:
+            continue
+        stages = out.setdefault(s["uid"], {})
+        stages[s["stage"]] = round(stages.get(s["stage"], 0.0) + s["duration_ms"], 1)
+    return out
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(conn, window_hours: int = METRICS_WINDOW_HOURS) -> str:
+    """
+    Aggregates in the Prometheus text exposition format: a summary per
+    stage (quantiles over the last window_hours, count and sum over all
+    time), error counts and LLM token counters.
+    """
+    totals = fetch_metric_totals(conn)
+    recent: Dict[str, List[float]] = {}
+    for stage, ms in fetch_stage_durations(conn, time.time() - window_hours * 3600):
+        recent.setdefault(stage, []).append(ms)
+
+    name = f"{PREFIX}_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Time spent per pipeline stage (quantiles over the last {window_hours}h).",
+        f"# TYPE {name} summary",
+    ]
+    for stage, count, _, total_ms, *_ in totals:
+        label = f'stage="{_escape(stage)}"'
+        values = sorted(recent.get(stage, []))
+        for q in QUANTILES:
+            if values:
+                lines.append(f'{name}{{{label},quantile="{q}"}} {_quantile(values, q) / 1000:.6f}')
+        lines.append(f"{name}_sum{{{label}}} {total_ms / 1000:.6f}")
+        lines.append(f"{name}_count{{{label}}} {count}")
+
+    counters = (
+        ("stage_errors_total", "Failed pipeline stages.", 2),
+        ("stage_cpu_seconds_total", "Thread CPU time per pipeline stage.", 4),
+        ("llm_prompt_tokens_total", "Prompt tokens sent to the LLM.", 5),
+        ("llm_completion_tokens_total", "Completion tokens received from the LLM.", 6),
+    )
+    for suffix, help_text, col in counters:
+        metric = f"{PREFIX}_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for row in totals:
+            value = row[col] or 0
+            if suffix != "stage_errors_total" and not value:
+                continue
+            value = value / 1000 if suffix == "stage_cpu_seconds_total" else int(value)
+            lines.append(f'{metric}{{stage="{_escape(row[0])}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+# --- CLI -----------------------------------------------------------------------
+
+def _serve(db_path: str, port: int) -> None:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            conn = init_db(db_path)
+            try:
+                body = prometheus_text(conn).encode()
+            finally:
+                conn.close()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            logger.debug(f"[metrics] {fmt % args}")
+
+    server = http.server.ThreadingHTTPServer(("", port), Handler)
+    logger.info(f"[metrics] serving http://localhost:{port}/metrics")
+    server.serve_forever()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.metrics", description="Inspect recorded pipeline timings.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("report", help="per-stage timings of a batch or upload")
+    p.add_argument("--batch")
+    p.add_argument("--uid")
+    sub.add_parser("export", help="print aggregates in the Prometheus text format")
+    p = sub.add_parser("serve", help="serve the Prometheus export at /metrics")
+    p.add_argument("--port", type=int, default=9464)
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args(argv)
+
+    if args.command == "serve":
+        _serve(args.db, args.port)
+        return 0
+    conn = init_db(args.db)
+    try:
+        if args.command == "export":
+            sys.stdout.write(prometheus_text(conn))
+            return 0
+        if not args.batch and not args.uid:
+            ap.error("report needs --batch and/or --uid")
+        rows = stage_summary(fetch_metrics(conn, batch_id=args.batch, uid=args.uid))
+        if not rows:
+            print("no metrics recorded")
+            return 1
+        print(f"{'stage':<16}{'count':>7}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'tokens in/out':>16}")
+        for r in rows:
+            tokens = f"{r['prompt_tokens']}/{r['completion_tokens']}" if r["prompt_tokens"] else ""
+            print(f"{r['stage']:<16}{r['count']:>7}{r['total_ms']:>12.1f}{r['mean_ms']:>10.1f}"
+                  f"{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{tokens:>16}")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
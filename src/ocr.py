@@ -0,0 +1,392 @@
+"""
+Page rendering for OCR.
+
+Pages are rendered by PyMuPDF straight into 8-bit grayscale pixmaps and
+handed to tesseract without intermediate RGB/PIL copies:
+
+  1. a cheap 72-DPI grayscale preview gives the Otsu threshold, the
+     skew angle and the median text-line height (all NumPy, vectorized);
+  2. the page DPI is chosen from the line height, never above the
+     resolution of the embedded scan, and capped at OCR_MAX_PIXELS so
+     large-format pages stay bounded;
+  3. the full-size pixmap is binarized in row chunks into a packed 1-bit
+     image (1/8 of the grayscale size) and deskewed.
+
+Every page reports its DPI, buffer sizes, per-stage times and the
+process's peak RSS, so the settings in src/config.py can be tuned.
+
+The image is then read by an OcrEngine (OCR_ENGINE):
+
+  - "pytesseract": runs the tesseract CLI, one subprocess and temp file
+    per page;
+  - "tesserocr": a Tesseract API instance kept loaded in-process and fed
+    the raw image bytes; one instance per thread, reused across pages
+    and documents;
+  - "auto" (default): tesserocr when installed, otherwise pytesseract.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+import fitz                        # PyMuPDF
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from src.config import OCR_ADAPTIVE_DPI, OCR_ENGINE, OCR_MAX_DPI, OCR_MAX_PIXELS, OCR_MIN_DPI, OCR_PREPROCESS
+from src.utils import OCRExtractionError, setup_logger
+
+try:
+    import resource
+except ImportError:          # Windows; peak RSS is not reported
+    resource = None
+
+try:
+    import tesserocr
+except ImportError:          # optional; the pytesseract backend is used instead
+    tesserocr = None
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+# Preview resolution, lowered for large-format pages to stay under the pixel cap
+PREVIEW_DPI = 72
+_PREVIEW_MAX_PIXELS = 1_000_000
+
+# Tesseract reads text best when a line of text is about this many pixels tall
+TARGET_LINE_PX = 30
+
+# Skew search range/step, and the smallest skew worth correcting (degrees)
+MAX_SKEW_DEG  = 5.0
+SKEW_STEP_DEG = 0.25
+MIN_SKEW_DEG  = 0.5
+
+# Rows binarized per chunk; bounds the temporary boolean array
+_BINARIZE_ROWS = 512
+
+# Ink points sampled for the skew search
+_SKEW_SAMPLES = 20000
+
+
+def _gray_view(pix: fitz.Pixmap) -> np.ndarray:
+    """(height, width) uint8 view over a grayscale pixmap's samples; no copy."""
+    buf = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)
+    return buf[:, :pix.width]
+
+
+def _render_gray(page, dpi: float) -> fitz.Pixmap:
+    zoom = dpi / 72
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Otsu's global threshold; pixels <= the result count as ink."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    w0 = np.cumsum(hist)
+    m0 = np.cumsum(hist * np.arange(256))
+    w1 = total - w0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (m0[-1] * w0 - total * m0) ** 2 / (w0 * w1)
+    between = np.nan_to_num(between, nan=0.0, posinf=0.0)
+    return int(np.argmax(between)) if between.any() else 127
+
+
+def analyse_preview(gray: np.ndarray, dpi: float) -> Tuple[int, float, float | None]:
+    """
+    Threshold, skew angle (degrees, for PIL's rotate) and median text-line
+    height (points) of a low-resolution grayscale render.
+
+    The skew is the angle whose horizontal projection of the ink pixels
+    is sharpest; that projection is also the deskewed row profile the
+    line height is measured from.
+    """
+    threshold = otsu_threshold(gray)
+    ys, xs = np.nonzero(gray <= threshold)
+    if len(ys) < 50:
+        return threshold, 0.0, None
+    step = max(1, len(ys) // _SKEW_SAMPLES)
+    ys, xs = ys[::step].astype(np.float64), xs[::step].astype(np.float64)
+
+    angles = np.arange(-MAX_SKEW_DEG, MAX_SKEW_DEG + SKEW_STEP_DEG / 2, SKEW_STEP_DEG)
+    rad = np.deg2rad(angles)
+    h, w = gray.shape
+    offset = w * math.sin(math.radians(MAX_SKEW_DEG)) + 1
+    n_bins = int(h + 2 * offset) + 1
+    # rotated row of every point at every angle, as one (angles x points) array
+    rows = (ys[None, :] * np.cos(rad)[:, None] - xs[None, :] * np.sin(rad)[:, None] + offset).astype(np.int64)
+    rows += np.arange(len(angles))[:, None] * n_bins
+    profiles = np.bincount(rows.ravel(), minlength=len(angles) * n_bins).reshape(len(angles), n_bins)
+    best = int(np.argmax((profiles.astype(np.float64) ** 2).sum(axis=1)))
+
+    # runs of consecutive text rows in the deskewed profile
+    profile = profiles[best]
+    text_rows = (profile > 0.1 * profile.max()).astype(np.int8)
+    edges = np.diff(np.concatenate(([0], text_rows, [0])))
+    runs = np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)
+    runs = runs[runs >= 2]
+    line_pt = float(np.median(runs)) * 72 / dpi if len(runs) >= 3 else None
+    return threshold, float(angles[best]), line_pt
+
+
+def _scan_dpi(page) -> float | None:
+    """Resolution of the largest image drawn on the page, if any."""
+    best = None
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        if x1 <= x0 or y1 <= y0:
+            continue
+        area = (x1 - x0) * (y1 - y0)
+        if best is None or area > best[0]:
+            best = (area, info["width"] * 72 / (x1 - x0))
+    return best[1] if best else None
+
+
+def choose_dpi(page, target_dpi: int, line_pt: float | None = None) -> int:
+    """
+    DPI for OCR'ing page: enough for TARGET_LINE_PX-tall text lines (or
+    target_dpi if the line height is unknown), no more than the scan's own
+    resolution, within OCR_MIN_DPI..OCR_MAX_DPI, and capped so the render
+    stays under OCR_MAX_PIXELS.
+    """
+    dpi = TARGET_LINE_PX * 72 / line_pt if line_pt else target_dpi
+    native = _scan_dpi(page)
+    if native:
+        dpi = min(dpi, native)
+    dpi = min(max(dpi, OCR_MIN_DPI), OCR_MAX_DPI)
+    area_in = (page.rect.width / 72) * (page.rect.height / 72)
+    if area_in > 0:
+        dpi = min(dpi, math.sqrt(OCR_MAX_PIXELS / area_in))
+    return max(1, int(dpi))
+
+
+def _binarize_packed(gray: np.ndarray, threshold: int) -> np.ndarray:
+    """1-bit rows (MSB first, 1 = paper) in PIL's "1" raw layout."""
+    h, w = gray.shape
+    packed = np.empty((h, (w + 7) // 8), dtype=np.uint8)
+    for r in range(0, h, _BINARIZE_ROWS):
+        packed[r:r + _BINARIZE_ROWS] = np.packbits(gray[r:r + _BINARIZE_ROWS] > threshold, axis=1)
+    return packed
+
+
+def peak_rss_mb() -> float | None:
+    """Peak resident set size of this process so far, in MiB."""
+    # Linux: VmHWM, since ru_maxrss carries over the parent's peak into
+    # spawned processes (OCR workers, benchmark stages)
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if peak > 1 << 32 else 1024), 1)
+
+
+@contextmanager
+def render_page(
+    page,
+    target_dpi: int = 200,
+    adaptive: bool = OCR_ADAPTIVE_DPI,
+    preprocess: bool = OCR_PREPROCESS
+) -> Iterator[Tuple[Image.Image, Dict]]:
+    """
+    Render page for OCR and yield (image, stats).
+
+    The image may be a view over the pixmap's buffer, so it is only valid
+    inside the with-block. stats holds the chosen dpi, the image size,
+    skew, buffer_bytes (pixmap + packed image) and render/prep times (ms).
+    """
+    t0 = time.perf_counter()
+    threshold, angle, line_pt = 127, 0.0, None
+    if adaptive or preprocess:
+        area_in = max(page.rect.width * page.rect.height / (72 * 72), 1e-6)
+        preview_dpi = min(PREVIEW_DPI, math.sqrt(_PREVIEW_MAX_PIXELS / area_in))
+        preview = _render_gray(page, preview_dpi)
+        threshold, angle, line_pt = analyse_preview(_gray_view(preview), preview_dpi)
+        del preview
+    dpi = choose_dpi(page, target_dpi, line_pt) if adaptive else target_dpi
+
+    pix = _render_gray(page, dpi)
+    t1 = time.perf_counter()
+    size = (pix.width, pix.height)
+    buffer_bytes = pix.stride * pix.height
+
+    if preprocess:
+        # the threshold comes from the preview, so the full-size page is
+        # never histogrammed or copied; only the 1-bit result is allocated
+        packed = _binarize_packed(_gray_view(pix), threshold)
+        buffer_bytes += packed.nbytes
+        img = Image.frombuffer("1", size, packed, "raw", "1", 0, 1)
+        if abs(angle) >= MIN_SKEW_DEG:
+            img = img.rotate(angle, resample=Image.NEAREST, fillcolor=255)
+            buffer_bytes += packed.nbytes
+    else:
+        img = Image.frombuffer("L", size, pix.samples_mv, "raw", "L", pix.stride, 1)
+    t2 = time.perf_counter()
+
+    stats = {
+        "dpi":          dpi,
+        "width":        size[0],
+        "height":       size[1],
+        "skew":         round(angle, 2) if preprocess and abs(angle) >= MIN_SKEW_DEG else 0.0,
+        "line_pt":      round(line_pt, 1) if line_pt else None,
+        "buffer_bytes": buffer_bytes,
+        "render_ms":    round((t1 - t0) * 1000, 1),
+        "prep_ms":      round((t2 - t1) * 1000, 1),
+    }
+    try:
+        yield img, stats
+    finally:
+        img.close()
+        del pix
+
+
+# --- OCR engines -------------------------------------------------------------
+
+class OcrEngine(ABC):
+    """Turns a rendered page image into text. Instances are per thread."""
+    name = ""
+
+    @abstractmethod
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractEngine(OcrEngine):
+    """The tesseract CLI via pytesseract: a subprocess and temp file per page."""
+    name = "pytesseract"
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        return pytesseract.image_to_string(img, lang=lang, config="--psm 3")
+
+
+class TesserocrEngine(OcrEngine):
+    """
+    A persistent in-process Tesseract API per language. The model is
+    loaded once and the image bytes are handed over without encoding.
+    """
+    name = "tesserocr"
+
+    def __init__(self):
+        if tesserocr is None:
+            raise OCRExtractionError("OCR_ENGINE=tesserocr but the tesserocr package is not installed")
+        self._apis = {}
+
+    def _api(self, lang: str):
+        api = self._apis.get(lang)
+        if api is None:
+            try:
+                api = tesserocr.PyTessBaseAPI(lang=lang, psm=tesserocr.PSM.AUTO)
+            except RuntimeError as e:
+                raise OCRExtractionError(f"Could not load Tesseract for {lang!r}: {e}")
+            self._apis[lang] = api
+        return api
+
+    def image_to_string(self, img: Image.Image, lang: str) -> str:
+        api = self._api(lang)
+        w, h = img.size
+        if img.mode == "1":
+            # packed rows, MSB first, 1 = white: Tesseract's binary layout
+            api.SetImageBytes(img.tobytes(), w, h, 0, (w + 7) // 8)
+        elif img.mode == "L":
+            api.SetImageBytes(img.tobytes(), w, h, 1, w)
+        else:
+            api.SetImage(img)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+
+    def close(self) -> None:
+        for api in self._apis.values():
+            api.End()
+        self._apis.clear()
+
+
+_ENGINES = {e.name: e for e in (PytesseractEngine, TesserocrEngine)}
+
+_local = threading.local()
+
+
+def resolve_engine(name: str | None = None) -> str:
+    """The backend OCR_ENGINE (or name) refers to, with "auto" resolved."""
+    name = (name or OCR_ENGINE).lower()
+    if name == "auto":
+        return "tesserocr" if tesserocr is not None else "pytesseract"
+    if name not in _ENGINES:
+        raise OCRExtractionError(f"Unknown OCR engine {name!r}; choose from auto, {', '.join(_ENGINES)}")
+    return name
+
+
+def get_ocr_engine(name: str | None = None) -> OcrEngine:
+    """This thread's instance of the named engine, created on first use."""
+    name = resolve_engine(name)
+    engines = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = {}
+    engine = engines.get(name)
+    if engine is None:
+        engine = engines[name] = _ENGINES[name]()
+        logger.info(f"[ocr] loaded {name} engine in pid {os.getpid()}")
+    return engine
+
+
+def close_ocr_engines() -> None:
+    """Release this thread's engines (and their loaded models)."""
+    for engine in getattr(_local, "engines", {}).values():
+        engine.close()
+    _local.engines = {}
+
+
+def ocr_page(
+    page,
+    lang: str = "eng",
+    target_dpi: int = 200,
+    adaptive: bool = OCR_ADAPTIVE_DPI,
+    preprocess: bool = OCR_PREPROCESS,
+    engine: str | None = None
+) -> Tuple[str, Dict]:
+    """OCR one PyMuPDF page; returns (text, stats) with engine, ocr_ms and peak_rss_mb added."""
+    ocr = get_ocr_engine(engine)
+    with render_page(page, target_dpi, adaptive, preprocess) as (img, stats):
+        t0 = time.perf_counter()
+        text = ocr.image_to_string(img, lang)
+        stats["ocr_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    stats["engine"] = ocr.name
+    stats["peak_rss_mb"] = peak_rss_mb()
+    logger.debug(f"[ocr] {stats}")
+    return text, stats
+
+
+def summarize_stats(stats: List[Dict]) -> Dict:
+    """Aggregate per-page stats: page count, DPI range, mean/max times, peak memory."""
+    if not stats:
+        return {"pages": 0}
+    out = {
+        "pages":   len(stats),
+        "dpi_min": min(s["dpi"] for s in stats),
+        "dpi_max": max(s["dpi"] for s in stats),
+        "max_buffer_mb": round(max(s["buffer_bytes"] for s in stats) / (1024 * 1024), 1),
+    }
+    for key in ("render_ms", "prep_ms", "ocr_ms"):
+        vals = [s[key] for s in stats if s.get(key) is not None]
+        if vals:
+            out[f"{key}_mean"] = round(sum(vals) / len(vals), 1)
+            out[f"{key}_max"]  = max(vals)
+    rss = [s["peak_rss_mb"] for s in stats if s.get("peak_rss_mb") is not None]
+    if rss:
+        out["peak_rss_mb"] = max(rss)
+    return out
@@ -0,0 +1,435 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src import metrics
+from src.cache import content_sha256, get_cached_pages, make_cache_key, store_pages
+from src.config import (
+    DEDUP_REUSE,
+    EXTRACT_WORKERS,
+    LLM_CONCURRENCY,
+    LLM_PACK_LINGER,
+    LLM_PACK_PAPERS,
+    LLM_PACK_TOKENS,
+    LOCAL_META_MIN_CONFIDENCE,
+    OCR_ADAPTIVE_DPI,
+    OCR_PREPROCESS,
+    OCR_WORKERS
+)
+from src.dedup import Duplicate, find_reusable, index_signature, minhash
+from src.db import fetch_upload_blob, fetch_upload_digest, insert_metadata
+from src.extractor import MIN_PAGE_CHARS, extract_pages, join_pages
+from src.get_metadata import extract_local_metadata
+from src.ocr import resolve_engine
+from src.selection import InputSelection, input_token_budget
+from src.summarizer import MAX_INPUT_CHARS, PROMPT_VERSION, PaperMeta, Summarizer, aclose_loop_clients
+from src.utils import DatabaseError, TextExtractionError, setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+@dataclass
+class PaperJob:
+    """
+    One PDF to run through extract -> LLM. If content (the PDF bytes) is
+    set it is extracted in memory; otherwise pdf_path is read from disk.
+    """
+    uid: str
+    file_name: str
+    pdf_path: Optional[str] = None
+    max_pages: Optional[int] = None
+    content: Optional[bytes] = None
+    content_hash: Optional[str] = None      # enables the extracted-text cache
+
+
+@dataclass
+class PaperResult:
+    """Outcome of a PaperJob: meta on success, error otherwise."""
+    job: PaperJob
+    meta: Optional[PaperMeta] = None
+    error: Optional[Exception] = None
+    input_tokens: Optional[int] = None      # paper-text tokens sent to the LLM
+    duplicate: Optional[Duplicate] = None   # near-duplicate whose summary was reused
+
+
+# (job, fields parsed so far) -> False to abort that paper's generation
+PartialCallback = Callable[[PaperJob, Dict[str, str]], Optional[bool]]
+
+# job whose text is extracted and that now waits for / runs its LLM request
+ExtractedCallback = Callable[[PaperJob], None]
+
+
+def extraction_params(max_pages: int | None = None) -> dict:
+    """
+    The extraction settings the pipeline uses; they key the text cache,
+    so anything that changes the extracted text belongs here.
+    """
+    return dict(
+        min_page_chars=MIN_PAGE_CHARS,
+        ocr_max_pages=max_pages,
+        max_chars=MAX_INPUT_CHARS,
+        ocr_dpi=200,
+        ocr_lang="eng",
+        ocr_adaptive_dpi=OCR_ADAPTIVE_DPI,
+        ocr_preprocess=OCR_PREPROCESS,
+        ocr_engine=resolve_engine()
+    )
+
+
+def result_params(model_name: str, max_pages: int | None = None) -> dict:
+    """
+    Everything besides the PDF and the model that changes a paper's
+    PaperMeta: the extraction settings, the model's input budget, the
+    prompt version and which local fields are trusted over the LLM.
+    """
+    return dict(
+        extraction_params(max_pages),
+        input_tokens=input_token_budget(model_name),
+        prompt_version=PROMPT_VERSION,
+        local_meta_min_confidence=LOCAL_META_MIN_CONFIDENCE
+    )
+
+
+def result_cache_key(content_hash: str, model_name: str, max_pages: int | None = None) -> str:
+    """The result-cache key of a PDF for model_name; store results with **result_params()."""
+    return make_cache_key(content_hash, model_name, **result_params(model_name, max_pages))
+
+
+def _first_page_text(docs) -> str | None:
+    return docs[0].page_content if docs and docs[0].metadata.get("page") == 1 else None
+
+
+async def _prepare_one(
+    job: PaperJob,
+    summarizer: Summarizer,
+    executor: ThreadPoolExecutor,
+    ocr_workers: int,
+    conn=None,
+    dedup: bool = False
+) -> Tuple[InputSelection | None, Dict[str, str], Duplicate | None]:
+    """
+    Extract a job's text and local metadata: the LLM input, the known
+    fields and, with dedup, a near-duplicate whose result can be reused
+    instead (the input is then None).
+    """
+    loop = asyncio.get_running_loop()
+    params = extraction_params(job.max_pages)
+    source = job.content if job.content is not None else job.pdf_path
+    use_cache = conn is not None and job.content_hash is not None
+    # cache reads/writes stay on the loop thread, which owns conn
+    docs = get_cached_pages(conn, job.content_hash, **params) if use_cache else None
+    if docs is None:
+        # PyMuPDF/OCR is CPU-bound, so it runs on the executor while
+        # other files are waiting on the LLM
+        docs = await loop.run_in_executor(
+            executor,
+            metrics.bind(
+                extract_pages,
+                source,
+                ocr_workers=ocr_workers,
+                **params
+            )
+        )
+        if use_cache:
+            try:
+                store_pages(conn, job.content_hash, docs, **params)
+            except DatabaseError as e:
+                logger.warning(f"[pipeline] could not cache text for {job.uid}: {e.message}")
+    text = join_pages(docs)
+    duplicate = None
+    if use_cache:
+        duplicate = await _check_duplicate(job, text, summarizer, executor, conn, dedup)
+    # DOI/title/authors found locally are not asked of the LLM
+    local = await loop.run_in_executor(
+        executor,
+        metrics.bind(extract_local_metadata, source, _first_page_text(docs))
+    )
+    if duplicate is not None:
+        return None, local.known(), duplicate
+    return summarizer.prepare_input(text), local.known(), None
+
+
+async def _check_duplicate(
+    job: PaperJob,
+    text: str,
+    summarizer: Summarizer,
+    executor: ThreadPoolExecutor,
+    conn,
+    reuse: bool
+) -> Duplicate | None:
+    """Index the job's text signature; with reuse, return a near-duplicate that has a result."""
+    sig = await asyncio.get_running_loop().run_in_executor(executor, minhash, text)
+    if sig is None:
+        return None
+    duplicate = None
+    try:
+        if reuse:
+            duplicate = find_reusable(conn, sig, summarizer.llm_model.model_name, exclude=job.content_hash)
+        index_signature(conn, job.content_hash, sig)
+    except DatabaseError as e:
+        logger.warning(f"[pipeline] near-duplicate index failed for {job.uid}: {e.message}")
+    if duplicate is not None:
+        logger.info(
+            f"[pipeline] {job.uid} matches {duplicate.content_hash[:12]} "
+            f"(similarity {duplicate.similarity:.2f}); reusing its summary"
+        )
+    return duplicate
+
+
+def _reused(job: PaperJob, duplicate: Duplicate, known: Dict[str, str]) -> PaperResult:
+    # the paper's own DOI/title/authors win over the duplicate's (preprint vs journal DOI)
+    meta = PaperMeta(**{**duplicate.meta.model_dump(), **known})
+    return PaperResult(job, meta=meta, input_tokens=0, duplicate=duplicate)
+
+
+async def _process_one(
+    job: PaperJob,
+    summarizer: Summarizer,
+    executor: ThreadPoolExecutor,
+    llm_slots: asyncio.Semaphore,
+    ocr_workers: int,
+    conn=None,
+    on_partial: PartialCallback | None = None,
+    dedup: bool = False,
+    on_extracted: ExtractedCallback | None = None
+) -> PaperResult:
+    try:
+        with metrics.for_upload(job.uid):
+            selection, known, duplicate = await _prepare_one(job, summarizer, executor, ocr_workers, conn, dedup)
+            if duplicate is not None:
+                return _reused(job, duplicate, known)
+            if on_extracted is not None:
+                on_extracted(job)
+            async with llm_slots:
+                if on_partial is None:
+                    meta = await summarizer.aextract_metadata(selection, known=known)
+                else:
+                    meta = await summarizer.astream_metadata(
+                        selection, known=known, on_partial=partial(on_partial, job)
+                    )
+        return PaperResult(job, meta=meta, input_tokens=selection.tokens)
+    except Exception as e:
+        return PaperResult(job, error=e)
+
+
+async def _process_packed(
+    jobs: List[PaperJob],
+    summarizer: Summarizer,
+    executor: ThreadPoolExecutor,
+    llm_slots: asyncio.Semaphore,
+    ocr_workers: int,
+    pack_papers: int,
+    deliver: Callable[[PaperResult], None],
+    conn=None,
+    dedup: bool = False,
+    on_extracted: ExtractedCallback | None = None
+) -> None:
+    """
+    Extract jobs concurrently and send them to the LLM in packs of up to
+    pack_papers (within LLM_PACK_TOKENS of paper text). A pack is sent
+    as soon as it is full, or once no further paper has been ready for
+    LLM_PACK_LINGER seconds, so slow extractions do not hold back
+    papers that are already done.
+    """
+    ready: asyncio.Queue = asyncio.Queue()
+
+    async def prepare(job: PaperJob) -> None:
+        try:
+            with metrics.for_upload(job.uid):
+                selection, known, duplicate = await _prepare_one(job, summarizer, executor, ocr_workers, conn, dedup)
+        except Exception as e:
+            deliver(PaperResult(job, error=e))
+            await ready.put(None)
+            return
+        if duplicate is not None:
+            deliver(_reused(job, duplicate, known))
+            await ready.put(None)
+            return
+        if on_extracted is not None:
+            on_extracted(job)
+        await ready.put((job, selection, known))
+
+    async def send(pack) -> None:
+        # one request for several uploads: its "llm" span has no uid
+        try:
+            async with llm_slots:
+                outcomes = await summarizer.aextract_metadata_many(
+                    [(selection, known) for _, selection, known in pack],
+                    max_tokens=LLM_PACK_TOKENS,
+                    max_papers=pack_papers
+                )
+        except Exception as e:
+            outcomes = [e] * len(pack)
+        for (job, selection, _), out in zip(pack, outcomes):
+            if isinstance(out, Exception):
+                deliver(PaperResult(job, error=out, input_tokens=selection.tokens))
+            else:
+                deliver(PaperResult(job, meta=out, input_tokens=selection.tokens))
+
+    preparing = [asyncio.create_task(prepare(job)) for job in jobs]
+    sending = []
+    pack, pack_tokens = [], 0
+    for _ in jobs:
+        try:
+            item = await (asyncio.wait_for(ready.get(), LLM_PACK_LINGER) if pack else ready.get())
+        except asyncio.TimeoutError:
+            sending.append(asyncio.create_task(send(pack)))
+            pack, pack_tokens = [], 0
+            item = await ready.get()
+        if item is None:
+            continue
+        tokens = item[1].tokens
+        if pack and pack_tokens + tokens > LLM_PACK_TOKENS:
+            sending.append(asyncio.create_task(send(pack)))
+            pack, pack_tokens = [], 0
+        pack.append(item)
+        pack_tokens += tokens
+        if len(pack) >= pack_papers:
+            sending.append(asyncio.create_task(send(pack)))
+            pack, pack_tokens = [], 0
+    if pack:
+        sending.append(asyncio.create_task(send(pack)))
+    await asyncio.gather(*preparing, *sending)
+
+
+async def aprocess_batch(
+    jobs: List[PaperJob],
+    model_name: str,
+    llm_concurrency: int | None = None,
+    extract_workers: int | None = None,
+    on_result: Callable[[PaperResult], None] | None = None,
+    conn=None,
+    pack_papers: int | None = None,
+    on_partial: PartialCallback | None = None,
+    dedup: bool | None = None,
+    on_extracted: ExtractedCallback | None = None
+) -> List[PaperResult]:
+    """
+    Run a batch of PaperJobs concurrently.
+
+    Extraction runs on a pool of extract_workers threads and at most
+    llm_concurrency LLM requests are in flight at once. on_result is
+    called on the event-loop thread as each file finishes (in completion
+    order); the returned list is in job order. With conn given, jobs
+    that carry a content_hash read/write the extracted-text cache.
+
+    With pack_papers > 1 (default LLM_PACK_PAPERS) up to that many
+    papers share one LLM request, which stretches a requests-per-minute
+    limit over more papers.
+
+    With on_partial given, each paper's completion is streamed and
+    on_partial(job, fields) is called on the event-loop thread as its
+    title/authors/summary fill in; returning False aborts that paper.
+    Packed requests are not streamed.
+
+    With conn given, each extracted text is added to the near-duplicate
+    index (src.dedup); with dedup (default DEDUP_REUSE) a paper whose
+    text matches one that already has a result from model_name reuses
+    that summary instead of calling the LLM (PaperResult.duplicate).
+
+    on_extracted(job) is called on the event-loop thread once a paper's
+    text is extracted and it moves on to the LLM stage.
+
+    Called inside src.metrics.recording(), the extraction, OCR and LLM
+    timings of each job are recorded under its uid.
+    """
+    llm_concurrency = llm_concurrency or LLM_CONCURRENCY
+    extract_workers = extract_workers or EXTRACT_WORKERS
+    pack_papers = pack_papers or LLM_PACK_PAPERS
+    dedup = DEDUP_REUSE if dedup is None else dedup
+    # split the shared OCR processes between the files being extracted at once
+    ocr_workers = max(1, OCR_WORKERS // extract_workers)
+
+    logger.info(
+        f"[pipeline] {len(jobs)} files; {extract_workers} extract workers, "
+        f"{llm_concurrency} LLM slots, {ocr_workers} OCR pages in flight per file"
+        + (f", up to {pack_papers} papers per LLM request" if pack_papers > 1 else "")
+    )
+    summarizer = Summarizer(model_name)
+    llm_slots = asyncio.Semaphore(llm_concurrency)
+    by_uid = {}
+
+    def deliver(res: PaperResult) -> None:
+        by_uid[res.job.uid] = res
+        if on_result is not None:
+            on_result(res)
+
+    try:
+        with ThreadPoolExecutor(max_workers=extract_workers, thread_name_prefix="extract") as executor:
+            if pack_papers > 1:
+                await _process_packed(jobs, summarizer, executor, llm_slots, ocr_workers,
+                                      pack_papers, deliver, conn, dedup, on_extracted)
+                return [by_uid[job.uid] for job in jobs]
+            tasks = [
+                asyncio.create_task(_process_one(job, summarizer, executor, llm_slots, ocr_workers,
+                                         conn, on_partial, dedup, on_extracted))
+                for job in jobs
+            ]
+            for fut in asyncio.as_completed(tasks):
+                deliver(await fut)
+    finally:
+        await aclose_loop_clients()
+
+    return [by_uid[job.uid] for job in jobs]
+
+
+def process_batch(
+    jobs: List[PaperJob],
+    model_name: str,
+    llm_concurrency: int | None = None,
+    extract_workers: int | None = None,
+    on_result: Callable[[PaperResult], None] | None = None,
+    conn=None,
+    pack_papers: int | None = None,
+    on_partial: PartialCallback | None = None,
+    dedup: bool | None = None,
+    on_extracted: ExtractedCallback | None = None
+) -> List[PaperResult]:
+    """Blocking wrapper around aprocess_batch for synchronous callers."""
+    return asyncio.run(aprocess_batch(
+        jobs,
+        model_name,
+        llm_concurrency=llm_concurrency,
+        extract_workers=extract_workers,
+        on_result=on_result,
+        conn=conn,
+        pack_papers=pack_papers,
+        on_partial=on_partial,
+        dedup=dedup,
+        on_extracted=on_extracted
+    ))
+
+
+def resummarize(conn, uid: str, model_name: str, batch_id: str, save: bool = True) -> PaperMeta:
+    """
+    Re-run only the summarization stage for an existing upload.
+
+    The text comes from the extracted-text cache (the most recent
+    extraction of the PDF); the PDF is only re-extracted if it was never
+    cached, and is otherwise just read for the local DOI/title/author
+    guesses. The new metadata row is recorded under batch_id, unless save
+    is False (the caller stores it, e.g. a queue worker).
+    """
+    blob, _ = fetch_upload_blob(conn, uid)
+    if blob is None:
+        raise TextExtractionError(f"No stored PDF for upload {uid}")
+    with blob:
+        content = blob.read()
+    content_hash = fetch_upload_digest(conn, uid) or content_sha256(content)
+    docs = get_cached_pages(conn, content_hash)
+    if docs is None:
+        params = extraction_params()
+        docs = extract_pages(content, **params)
+        store_pages(conn, content_hash, docs, **params)
+
+    local = extract_local_metadata(content, _first_page_text(docs))
+    meta = Summarizer(model_name).extract_metadata(join_pages(docs), known=local.known())
+    if save:
+        insert_metadata(conn, uid, batch_id, meta.doi_issn, meta.title,
+                        meta.authors, meta.summary, model_name)
+    logger.info(f"[pipeline] re-summarized UID={uid} with {model_name}")
+    return meta
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+import httpx
+
+from src import metrics
+from src.config import (
+    DEFAULT_RPM,
+    DEFAULT_TPM,
+    LLM_MAX_RETRIES,
+    LLM_TIMEOUT,
+    MODEL_RATE_LIMITS,
+)
+from src.utils import setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+T = TypeVar("T")
+
+# Output tokens we budget for a completion before the real usage is known
+COMPLETION_TOKENS_ESTIMATE = 512
+
+_BACKOFF_BASE = 1.0     # seconds
+_BACKOFF_CAP  = 30.0
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at rate tokens/second.
+
+    reserve() takes tokens immediately (the level may go negative) and
+    returns how long the caller must wait before its reservation is
+    covered, so callers are served in arrival order and the waiting can
+    be done with either time.sleep or asyncio.sleep.
+    """
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = float(capacity)
+        self.rate     = float(rate)
+        self.level    = float(capacity)
+        self.updated  = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, delta: float) -> None:
+        """Give back (delta > 0) or charge (delta < 0) tokens after the fact."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + delta)
+
+
+@dataclass
+class ModelLimits:
+    rpm: int
+    tpm: int
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one model."""
+    def __init__(self, limits: ModelLimits):
+        self.limits   = limits
+        self.requests = TokenBucket(limits.rpm, limits.rpm / 60.0)
+        self.tokens   = TokenBucket(limits.tpm, limits.tpm / 60.0)
+
+    def reserve(self, n_tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(n_tokens))
+
+    def acquire(self, n_tokens: int) -> None:
+        delay = self.reserve(n_tokens)
+        if delay > 0:
+            logger.debug(f"[ratelimit] waiting {delay:.2f}s for {n_tokens} tokens")
+            metrics.record("rate_limit_wait", delay * 1000, started_at=time.time())
+            time.sleep(delay)
+
+    async def aacquire(self, n_tokens: int) -> None:
+        delay = self.reserve(n_tokens)
+        if delay > 0:
+            logger.debug(f"[ratelimit] waiting {delay:.2f}s for {n_tokens} tokens")
+            metrics.record("rate_limit_wait", delay * 1000, started_at=time.time())
+            await asyncio.sleep(delay)
+
+    def settle(self, estimated: int, actual: int | None) -> None:
+        """Correct the token bucket once the real usage of a call is known."""
+        if actual is not None:
+            self.tokens.adjust(estimated - actual)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_name: str) -> RateLimiter:
+    """Process-wide RateLimiter for model_name, built from MODEL_RATE_LIMITS."""
+    with _limiters_lock:
+        limiter = _limiters.get(model_name)
+        if limiter is None:
+            cfg = MODEL_RATE_LIMITS.get(model_name, {})
+            limits = ModelLimits(
+                rpm=int(cfg.get("rpm", DEFAULT_RPM)),
+                tpm=int(cfg.get("tpm", DEFAULT_TPM))
+            )
+            limiter = RateLimiter(limits)
+            _limiters[model_name] = limiter
+            logger.info(f"[ratelimit] {model_name}: {limits.rpm} RPM, {limits.tpm} TPM")
+        return limiter
+
+
+def estimate_tokens(messages) -> int:
+    """Prompt tokens (~4 chars each) plus the expected completion."""
+    chars = sum(len(str(m.content)) for m in messages)
+    return (chars + 3) // 4 + COMPLETION_TOKENS_ESTIMATE
+
+
+def _usage_tokens(result) -> int | None:
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return usage.get("total_tokens")
+    return None
+
+
+def _status_code(exc: BaseException) -> int | None:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        response = getattr(exc, "response", None)
+        code = getattr(response, "status_code", None)
+    return code
+
+
+def is_transient(exc: BaseException) -> bool:
+    """429s, 5xx, timeouts and connection drops are worth retrying."""
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    name = type(exc).__name__
+    if name in ("APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError"):
+        return True
+    code = _status_code(exc)
+    return code is not None and (code == 429 or code >= 500)
+
+
+def _retry_delay(exc: BaseException, attempt: int) -> float:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        retry_after = float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        retry_after = None
+    # full jitter: spreads retries so a batch doesn't stampede together
+    jitter = random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+    return max(retry_after or 0.0, jitter)
+
+
+def call_with_retry(
+    fn: Callable[[], T],
+    model_name: str,
+    n_tokens: int,
+    max_retries: int | None = None
+) -> T:
+    """
+    Run fn under model_name's rate limits, retrying transient failures
+    with jittered exponential backoff. The last error is re-raised.
+
+    A blocking call cannot be cut short from here, so unlike
+    acall_with_retry this does not enforce LLM_TIMEOUT itself: fn must
+    bound its own request. The chat clients (src.llm_backends) and their
+    shared pools are all created with timeout=LLM_TIMEOUT, whose expiry
+    raises a transient error that is retried.
+    """
+    limiter = get_rate_limiter(model_name)
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        limiter.acquire(n_tokens)
+        try:
+            result = fn()
+            limiter.settle(n_tokens, _usage_tokens(result))
+            return result
+        except Exception as e:
+            if attempt >= max_retries or not is_transient(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning(f"[ratelimit] {model_name} attempt {attempt+1} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def acall_with_retry(
+    fn: Callable[[], Awaitable[T]],
+    model_name: str,
+    n_tokens: int,
+    max_retries: int | None = None,
+    timeout: float | None = None
+) -> T:
+    """Async variant of call_with_retry; each attempt is capped at timeout seconds."""
+    limiter = get_rate_limiter(model_name)
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(n_tokens)
+        try:
+            result = await asyncio.wait_for(fn(), timeout)
+            limiter.settle(n_tokens, _usage_tokens(result))
+            return result
+        except Exception as e:
+            if attempt >= max_retries or not is_transient(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning(f"[ratelimit] {model_name} attempt {attempt+1} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def astream_with_retry(
+    fn: Callable[[], AsyncIterator[T]],
+    model_name: str,
+    n_tokens: int,
+    max_retries: int | None = None,
+    timeout: float | None = None
+) -> AsyncIterator[T]:
+    """
+    Streaming variant of acall_with_retry: yields the chunks of fn().
+    A failure before the first chunk is retried like a normal call; once
+    chunks have been handed out it is re-raised. timeout caps the wait
+    for each chunk rather than the whole stream.
+    """
+    limiter = get_rate_limiter(model_name)
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    timeout = LLM_TIMEOUT if timeout is None else timeout
+    for attempt in range(max_retries + 1):
+        await limiter.aacquire(n_tokens)
+        stream = fn().__aiter__()
+        started, usage = False, None
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                started = True
+                usage = _usage_tokens(chunk) or usage
+                yield chunk
+            limiter.settle(n_tokens, usage)
+            return
+        except Exception as e:
+            if started or attempt >= max_retries or not is_transient(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning(f"[ratelimit] {model_name} stream attempt {attempt+1} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
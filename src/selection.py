@@ -0,0 +1,205 @@
+"""
+Input selection for the LLM prompt.
+
+Instead of a fixed character cut (which mostly yields front matter and
+half an introduction), the paper text is split at its section headings
+and a per-model token budget is filled by priority: the front matter
+(title, authors, DOI), the abstract, the conclusion, the start of the
+introduction, then results/discussion. References, acknowledgements and
+appendices are never sent. Parts are kept in document order and cut at
+sentence boundaries.
+"""
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+from src.config import DEFAULT_INPUT_TOKENS, MODEL_INPUT_TOKENS
+from src.utils import setup_logger
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+def approx_tokens(n_chars: int) -> int:
+    # ~4 characters per token for English prose; good enough for budgeting
+    return (n_chars + 3) // 4
+
+
+def input_token_budget(model_name: str) -> int:
+    """Paper-text tokens sent to model_name (MODEL_INPUT_TOKENS, else DEFAULT_INPUT_TOKENS)."""
+    return int(MODEL_INPUT_TOKENS.get(model_name, DEFAULT_INPUT_TOKENS))
+
+
+# heading text -> section kind
+_KINDS = {
+    "abstract":             "abstract",
+    "introduction":         "introduction",
+    "background":           "introduction",
+    "related work":         "other",
+    "method":               "methods",
+    "methods":              "methods",
+    "methodology":          "methods",
+    "materials and methods": "methods",
+    "experiment":           "results",
+    "experiments":          "results",
+    "evaluation":           "results",
+    "results":              "results",
+    "discussion":           "results",
+    "results and discussion": "results",
+    "conclusion":           "conclusion",
+    "conclusions":          "conclusion",
+    "concluding remarks":   "conclusion",
+    "summary and conclusions": "conclusion",
+    "conclusions and future work": "conclusion",
+    "future work":          "other",
+    "limitations":          "other",
+    "acknowledgment":       "back",
+    "acknowledgments":      "back",
+    "acknowledgement":      "back",
+    "acknowledgements":     "back",
+    "references":           "back",
+    "bibliography":         "back",
+    "appendix":             "back",
+}
+
+# "3 Results", "III. RESULTS", "4.1 Discussion:", or a bare "Conclusions"
+_HEADING_RE = re.compile(
+    r"^[ \t]*(?:(?:\d+(?:\.\d+)*|[IVX]+|[A-H])\.?[ \t]+)?"
+    r"(?P<name>" + "|".join(sorted((re.escape(k) for k in _KINDS), key=len, reverse=True)) + r")"
+    r"[ \t]*[.:]?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+# abstracts often start on the heading line: "Abstract—We propose ..."
+_ABSTRACT_RE = re.compile(r"^[ \t]*abstract\b[ \t]*[.:—–-]?[ \t]*", re.IGNORECASE | re.MULTILINE)
+
+# Share of the budget each kind may take in the first pass, and the order
+# in which leftover budget is handed out afterwards.
+_CAPS = {
+    "front":        0.20,
+    "abstract":     0.35,
+    "conclusion":   0.25,
+    "introduction": 0.25,
+    "results":      0.15,
+    "methods":      0.10,
+    "other":        0.05,
+    "back":         0.0,
+}
+_PRIORITY = ["front", "abstract", "conclusion", "introduction", "results", "methods", "other"]
+
+_GAP = "\n\n[...]\n\n"
+
+
+@dataclass
+class Section:
+    kind: str
+    start: int
+    end: int
+
+
+@dataclass
+class InputSelection:
+    """The text handed to the model and what it was built from."""
+    text: str
+    tokens: int
+    sections: List[str] = field(default_factory=list)
+    truncated: bool = False
+
+
+def detect_sections(text: str) -> List[Section]:
+    """Split text at recognised headings; the part before the first is "front"."""
+    marks: List[Tuple[int, str]] = []
+    for m in _HEADING_RE.finditer(text):
+        marks.append((m.start(), _KINDS[m.group("name").lower()]))
+    first_abstract = _ABSTRACT_RE.search(text)
+    if first_abstract and all(k != "abstract" for _, k in marks):
+        marks.append((first_abstract.start(), "abstract"))
+    marks.sort()
+
+    sections: List[Section] = []
+    if not marks or marks[0][0] > 0:
+        sections.append(Section("front", 0, marks[0][0] if marks else len(text)))
+    for (start, kind), nxt in zip(marks, marks[1:] + [(len(text), "")]):
+        if nxt[0] > start:
+            sections.append(Section(kind, start, nxt[0]))
+    return sections
+
+
+def _clip(text: str, max_chars: int) -> str:
+    """Cut text to max_chars, preferably at the end of a sentence."""
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    stop = max(cut.rfind(". "), cut.rfind(".\n"), cut.rfind("\n\n"))
+    if stop >= 0.6 * max_chars:
+        cut = cut[:stop + 1]
+    return cut.rstrip()
+
+
+def select_input(text: str, max_tokens: int) -> InputSelection:
+    """
+    Pick the most informative text of a paper within max_tokens.
+    Text that already fits is returned unchanged.
+    """
+    text = text.strip()
+    if approx_tokens(len(text)) <= max_tokens:
+        return InputSelection(text, approx_tokens(len(text)), ["all"])
+
+    budget = max_tokens * 4
+    sections = [s for s in detect_sections(text) if s.kind != "back"]
+    kinds = {s.kind for s in sections}
+    if not kinds & {"abstract", "introduction", "conclusion"}:
+        # no recognisable structure; the head of the paper is the best guess
+        head = _clip(text, budget)
+        return InputSelection(head, approx_tokens(len(head)), ["head"], truncated=True)
+
+    by_kind: Dict[str, List[Section]] = {}
+    for s in sections:
+        by_kind.setdefault(s.kind, []).append(s)
+    need  = {k: sum(s.end - s.start for s in v) for k, v in by_kind.items()}
+    share = {k: 0 for k in by_kind}
+
+    # pass 1: each kind up to its cap; pass 2: leftovers by priority,
+    # leaving room for the gap markers between parts
+    left = budget - len(_GAP) * len(sections)
+    for kind in _PRIORITY:
+        if kind in need:
+            share[kind] = min(need[kind], int(_CAPS[kind] * budget), max(left, 0))
+            left -= share[kind]
+    for kind in _PRIORITY:
+        if kind in need and left > 0:
+            extra = min(need[kind] - share[kind], left)
+            share[kind] += extra
+            left -= extra
+
+    index = {id(s): i for i, s in enumerate(sections)}
+    parts, used = [], []
+    for kind, secs in by_kind.items():
+        # a kind's share goes to its sections in document order
+        remaining = share[kind]
+        for s in secs:
+            if remaining <= 0:
+                break
+            full = text[s.start:s.end].strip()
+            chunk = _clip(full, remaining)
+            remaining -= len(chunk)
+            if chunk:
+                parts.append((index[id(s)], chunk, chunk == full))
+        if share[kind]:
+            used.append(kind)
+    parts.sort()
+
+    # mark a gap wherever text was skipped between two parts
+    out = ""
+    prev_idx, prev_whole = None, False
+    for idx, chunk, whole in parts:
+        if prev_idx is not None:
+            out += "\n\n" if prev_whole and idx == prev_idx + 1 else _GAP
+        out += chunk
+        prev_idx, prev_whole = idx, whole
+    return InputSelection(
+        out,
+        approx_tokens(len(out)),
+        [k for k in _PRIORITY if k in used],
+        truncated=True
+    )
@@ -1,10 +1,38 @@
 
+import asyncio
+import json
 import os
+import threading
+import weakref
+from contextlib import aclosing
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, List, Sequence, Tuple
+
+import httpx
 from dotenv import load_dotenv, find_dotenv
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq  # or wherever your ChatGroq lives
-from src.utils import SummarizationError
+from src import metrics
+from src.config import (
+    AVAILABLE_MODELS,
+    LLM_PACK_PAPERS,
+    LLM_PACK_TOKENS,
+    LLM_POOL_SIZE,
+    LLM_TIMEOUT,
+    LLM_STREAM_MAX_CHARS,
+    MAX_EXTRACT_CHARS
+)
+from src.llm_backends import new_chat_client
+from src.ratelimit import (
+    COMPLETION_TOKENS_ESTIMATE,
+    acall_with_retry,
+    astream_with_retry,
+    call_with_retry,
+    estimate_tokens
+)
+from src.selection import InputSelection, input_token_budget, select_input
+from src.utils import SummarizationError, setup_logger
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.utils.json import parse_partial_json
 from pydantic import BaseModel, Field, ValidationError
 
 
@@ -12,11 +40,15 @@ _dotenv = find_dotenv()
 if _dotenv:
     load_dotenv(_dotenv, override=True)
 
-model_name  = os.getenv("MODEL_NAME")
-api_key      = os.getenv("GROQ_API_KEY")
+# default model; credentials are checked when a model's client is first built
+model_name  = os.getenv("MODEL_NAME") or AVAILABLE_MODELS[0]
+
+
+logger = setup_logger(__name__)
 
-if not model_name or not api_key:
-    raise RuntimeError("MODEL_NAME and GROQ_API_KEY must be set in your .env")
+# Characters of paper text extracted for the input-selection stage; what is
+# actually sent is chosen per model by src.selection.
+MAX_INPUT_CHARS = MAX_EXTRACT_CHARS
 
 
 class PaperMeta(BaseModel):
@@ -28,42 +60,211 @@ class PaperMeta(BaseModel):
 output_parser = JsonOutputParser(pydantic_object=PaperMeta)
 
 
-EXTRACTION_PROMPT = ChatPromptTemplate.from_messages([
-    ("system",
-     "You are an expert research assistant. "
-     "Extract the following from the paper text and return valid JSON:\n"
-     "- doi_issn: the paper's DOI or ISSN, or an empty string if not found\n"
-     "- title: the full paper title\n"
-     "- authors: comma-separated list of author names\n"
-     "- summary: a concise 3–5 sentence summary of objective, methods, key results, and significance"
-    ),
-    ("user", "{paper_text}")
-])
+# Part of the result-cache key (src.pipeline.result_params): bump it when
+# the prompts below or the choice of fields asked of the model change, so
+# results cached under the old prompts are not served.
+PROMPT_VERSION = 1
+
+_FIELD_INSTRUCTIONS = {
+    "doi_issn": "- doi_issn: the paper's DOI or ISSN, or an empty string if not found",
+    "title":    "- title: the full paper title",
+    "authors":  "- authors: comma-separated list of author names",
+    "summary":  "- summary: a concise 3–5 sentence summary of objective, methods, key results, and significance",
+}
+
+
+@lru_cache(maxsize=None)
+def extraction_prompt(fields: Tuple[str, ...] = tuple(_FIELD_INSTRUCTIONS)) -> ChatPromptTemplate:
+    """The metadata prompt, asking only for the given PaperMeta fields."""
+    return ChatPromptTemplate.from_messages([
+        ("system",
+         "You are an expert research assistant. "
+         "Extract the following from the paper text and return valid JSON:\n"
+         + "\n".join(_FIELD_INSTRUCTIONS[f] for f in fields)
+        ),
+        ("user", "{paper_text}")
+    ])
+
+
+EXTRACTION_PROMPT = extraction_prompt()
+
+
+def _requested_fields(known: Dict[str, str] | None) -> Tuple[str, ...]:
+    return tuple(f for f in _FIELD_INSTRUCTIONS if f == "summary" or not (known or {}).get(f))
+
+
+@lru_cache(maxsize=None)
+def packed_extraction_prompt(fields: Tuple[str, ...] = tuple(_FIELD_INSTRUCTIONS)) -> ChatPromptTemplate:
+    """Several papers in one request; the model answers with a JSON array."""
+    return ChatPromptTemplate.from_messages([
+        ("system",
+         "You are an expert research assistant. "
+         "You will receive several research papers, each starting with a line \"### Paper <n>\". "
+         "For every paper extract the following and return a JSON array with exactly one object "
+         "per paper, in the same order, each with a \"paper\" field holding <n> and:\n"
+         + "\n".join(_FIELD_INSTRUCTIONS[f] for f in fields)
+         + "\nReturn only the JSON array."
+        ),
+        ("user", "{papers}")
+    ])
+
+
+# One paper in a packed request: its text (or selection) and its known fields
+PackItem = Tuple["str | InputSelection", Dict[str, str] | None]
+
+
+# --- process-wide client registry -------------------------------------------
+#
+# One chat client per model (src.llm_backends), all sharing a keep-alive httpx pool, so files in a
+# batch (and concurrent Streamlit sessions) reuse warm connections instead of
+# paying TLS setup per paper. httpx.Client is thread-safe. An AsyncClient's
+# connections belong to the event loop that opened them, so async callers get
+# a per-loop client set that is dropped with the loop (see aclose_loop_clients).
+
+_clients_lock = threading.Lock()
+_http_client: httpx.Client | None = None
+_sync_clients: dict[str, object] = {}
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+_known_models = set(AVAILABLE_MODELS) | {model_name}
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_POOL_SIZE,
+        max_keepalive_connections=LLM_POOL_SIZE,
+        keepalive_expiry=120
+    )
+
+
+def _pool_options() -> dict:
+    # the clients pass LLM_TIMEOUT per request; the pool default covers any
+    # request that does not (httpx's own default is 5 s)
+    return {"limits": _pool_limits(), "timeout": LLM_TIMEOUT}
+
+
+def _new_client(model_name: str, http_async_client: httpx.AsyncClient | None = None):
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(**_pool_options())
+    return new_chat_client(model_name, _http_client, http_async_client)
+
+
+def get_llm_client(model_name: str):
+    """
+    Return the shared chat client for model_name, on the backend
+    configured for it, creating it on first use. Inside a running event
+    loop the client is scoped to that loop.
+    """
+    if model_name not in _known_models:
+        raise SummarizationError(f"Unknown model {model_name!r}; not in AVAILABLE_MODELS")
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    with _clients_lock:
+        if loop is None:
+            registry = _sync_clients
+            http_async_client = None
+        else:
+            registry = _loop_clients.get(loop)
+            if registry is None:
+                # one pool per loop, opened on its first request
+                registry = _loop_clients[loop] = {"_http": httpx.AsyncClient(**_pool_options())}
+            http_async_client = registry["_http"]
+
+        client = registry.get(model_name)
+        if client is None:
+            client = _new_client(model_name, http_async_client)
+            registry[model_name] = client
+        return client
+
+
+async def aclose_loop_clients() -> None:
+    """Close the async connection pool of the running loop, if one was opened."""
+    with _clients_lock:
+        registry = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if registry is not None:
+        await registry["_http"].aclose()
 
 
 class LLMModel:
-    """Wraps the Groq chat API via LangChain-style interface."""
+    """Calls a model's chat backend (src.llm_backends) under its rate limits, with retries."""
     def __init__(self, model_name: str = model_name):
-        self.llm = ChatGroq(model=model_name,
-                                temperature=0,
-                                max_tokens=None,
-                                timeout=None,
-                                api_key = api_key)
-    def invoke(self, prompt: ChatPromptTemplate, **kwargs) -> str:
+        self.model_name = model_name
+
+    @property
+    def llm(self):
+        return get_llm_client(self.model_name)
+
+    def invoke(self, prompt: ChatPromptTemplate, n_outputs: int = 1, **kwargs) -> str:
         messages = prompt.format_messages(**kwargs)
-        result   = self.llm.invoke(messages)
-        print(result)
+        # the "llm" span includes rate-limit waits and retries
+        with metrics.span("llm", cpu=False) as span:
+            result   = call_with_retry(
+                lambda: self.llm.invoke(messages),
+                self.model_name,
+                _request_tokens(messages, n_outputs)
+            )
+            metrics.note_usage(span, result)
+        logger.debug(f"[summarizer] {self.model_name} response: {result}")
         return result  
 
+    async def ainvoke(self, prompt: ChatPromptTemplate, n_outputs: int = 1, **kwargs):
+        """Async variant of invoke; lets a batch keep several requests in flight."""
+        messages = prompt.format_messages(**kwargs)
+        with metrics.span("llm", cpu=False) as span:
+            result = await acall_with_retry(
+                lambda: self.llm.ainvoke(messages),
+                self.model_name,
+                _request_tokens(messages, n_outputs)
+            )
+            metrics.note_usage(span, result)
+        return result
+
+    async def astream(self, prompt: ChatPromptTemplate, **kwargs) -> AsyncIterator[str]:
+        """Yield the completion's text as it is generated."""
+        messages = prompt.format_messages(**kwargs)
+        with metrics.span("llm", cpu=False) as span:
+            async with aclosing(astream_with_retry(
+                lambda: self.llm.astream(messages),
+                self.model_name,
+                _request_tokens(messages, 1)
+            )) as chunks:
+                async for chunk in chunks:
+                    # usage arrives on the last chunk
+                    metrics.note_usage(span, chunk)
+                    if chunk.content:
+                        yield chunk.content
+
+
+def _request_tokens(messages, n_outputs: int) -> int:
+    # a packed request returns one completion per paper
+    return estimate_tokens(messages) + (n_outputs - 1) * COMPLETION_TOKENS_ESTIMATE
+
 class Summarizer:
     def __init__(self, model_name: str = model_name):
         self.llm_model = LLMModel(model_name=model_name)
 
-    def summarize(self, paper_text: str) -> str:
+    def prepare_input(self, paper_text: str | InputSelection) -> InputSelection:
+        """
+        Section-aware selection of paper_text within the model's token
+        budget. The methods below accept either raw text or the result.
+        """
+        if isinstance(paper_text, InputSelection):
+            return paper_text
+        selection = select_input(paper_text, input_token_budget(self.llm_model.model_name))
+        logger.info(
+            f"[summarizer] sending {selection.tokens} tokens to {self.llm_model.model_name} "
+            f"(sections: {', '.join(selection.sections)})"
+        )
+        return selection
+
+    def summarize(self, paper_text: str | InputSelection) -> str:
         """
         Summarize the given research paper text.
         """
-        paper_text_ = paper_text[:5000]  # Truncate to 5000 characters
+        paper_text_ = self.prepare_input(paper_text).text
         prompt = ChatPromptTemplate.from_messages([
             ("system",
             "You are an expert research assistant. "
@@ -86,32 +287,254 @@ class Summarizer:
             
             return str(summary).strip()
         except Exception as e:
-            raise SummarizationError(f"Groq/LangChain summarization failed: {e}") from e
+            raise SummarizationError(f"LLM summarization failed: {e}") from e
 
-    def extract_metadata(self, paper_text: str) -> PaperMeta:
+    def extract_metadata(self, paper_text: str | InputSelection,
+                         known: Dict[str, str] | None = None) -> PaperMeta:
+        """
+        Ask the model for the paper's metadata and summary. Fields in known
+        (e.g. LocalMetadata.known()) are taken as given and left out of
+        the prompt, so the model only generates what is missing.
+        """
         try:
-            paper_text  = paper_text[:5000]  # Truncate to 5000 characters
-            ai_msg = self.llm_model.invoke(EXTRACTION_PROMPT, paper_text=paper_text)
-            content = ai_msg.content
-            
-            content = content.replace("```json", "").replace("```", "")
-            start = content.find("{")
-            end   = content.rfind("}") + 1
-            if start < 0 or end < 0:
-                raise SummarizationError("Could not locate JSON payload in model response.")
-            json_str = content[start:end]
+            paper_text  = self.prepare_input(paper_text).text
+            prompt = extraction_prompt(_requested_fields(known))
+            ai_msg = self.llm_model.invoke(prompt, paper_text=paper_text)
+            return _parse_metadata(ai_msg.content, known)
 
-            
-            parsed_dict = output_parser.parse(json_str)
+        except SummarizationError:
+            raise
+        except Exception as e:
+            raise SummarizationError(f"Failed to extract metadata: {e}") from e
 
-            try:
-                meta = PaperMeta(**parsed_dict)
-            except ValidationError as ve:
-                raise SummarizationError(f"JSON validation failed: {ve}") from ve
+    async def aextract_metadata(self, paper_text: str | InputSelection,
+                                known: Dict[str, str] | None = None) -> PaperMeta:
+        """Async variant of extract_metadata."""
+        try:
+            paper_text  = self.prepare_input(paper_text).text
+            prompt = extraction_prompt(_requested_fields(known))
+            ai_msg = await self.llm_model.ainvoke(prompt, paper_text=paper_text)
+            return _parse_metadata(ai_msg.content, known)
+
+        except SummarizationError:
+            raise
+        except Exception as e:
+            raise SummarizationError(f"Failed to extract metadata: {e}") from e
 
-            return meta
+    async def astream_metadata(
+        self,
+        paper_text: str | InputSelection,
+        known: Dict[str, str] | None = None,
+        on_partial: Callable[[Dict[str, str]], bool | None] | None = None
+    ) -> PaperMeta:
+        """
+        aextract_metadata over a streamed completion. on_partial is called
+        with the fields parsed so far (known fields included) each time
+        one grows; returning False from it aborts the generation. A
+        response that does not start a JSON object, or runs past
+        LLM_STREAM_MAX_CHARS, is aborted as well. Aborts raise
+        SummarizationError.
+        """
+        try:
+            paper_text  = self.prepare_input(paper_text).text
+            prompt = extraction_prompt(_requested_fields(known))
+            stream = MetadataStream(known)
+            async with aclosing(self.llm_model.astream(prompt, paper_text=paper_text)) as chunks:
+                async for text in chunks:
+                    fields = stream.feed(text)
+                    stream.check()
+                    if fields is not None and on_partial is not None and on_partial(fields) is False:
+                        raise SummarizationError("Generation aborted")
+            return _parse_metadata(stream.buffer, known)
 
         except SummarizationError:
             raise
         except Exception as e:
-            raise SummarizationError(f"Failed to extract metadata: {e}") from e
\ No newline at end of file
+            raise SummarizationError(f"Failed to extract metadata: {e}") from e
+
+    # --- packed requests ------------------------------------------------------
+
+    def split_packs(
+        self,
+        selections: Sequence[InputSelection],
+        max_tokens: int = LLM_PACK_TOKENS,
+        max_papers: int = LLM_PACK_PAPERS
+    ) -> List[List[int]]:
+        """
+        Group paper indices, in order, into packs of at most max_papers
+        whose paper text stays within max_tokens. A paper larger than the
+        budget gets a pack of its own.
+        """
+        packs: List[List[int]] = []
+        tokens = 0
+        for i, sel in enumerate(selections):
+            if packs and len(packs[-1]) < max_papers and tokens + sel.tokens <= max_tokens:
+                packs[-1].append(i)
+                tokens += sel.tokens
+            else:
+                packs.append([i])
+                tokens = sel.tokens
+        return packs
+
+    async def aextract_metadata_many(
+        self,
+        items: Sequence[PackItem],
+        max_tokens: int = LLM_PACK_TOKENS,
+        max_papers: int = LLM_PACK_PAPERS
+    ) -> List[PaperMeta | Exception]:
+        """
+        aextract_metadata for several papers, packing up to max_papers of
+        them (within max_tokens of paper text) into each request. A pack
+        whose response cannot be parsed is split in half and retried; a
+        paper whose entry fails validation is re-run on its own. A request
+        that fails outright fails all papers of its pack. Returns one
+        PaperMeta, or the error it ended with, per item.
+        """
+        selections = [self.prepare_input(text) for text, _ in items]
+        knowns = [known or {} for _, known in items]
+        results: List[PaperMeta | Exception | None] = [None] * len(items)
+        for pack in self.split_packs(selections, max_tokens, max_papers):
+            await self._arun_pack(pack, selections, knowns, results)
+        return results
+
+    def extract_metadata_many(self, items: Sequence[PackItem], **kwargs) -> List[PaperMeta | Exception]:
+        """Blocking wrapper around aextract_metadata_many."""
+        return asyncio.run(self.aextract_metadata_many(items, **kwargs))
+
+    async def _asingle(self, selection: InputSelection, known: Dict[str, str]) -> PaperMeta | SummarizationError:
+        try:
+            return await self.aextract_metadata(selection, known=known)
+        except SummarizationError as e:
+            return e
+
+    async def _arun_pack(self, pack: List[int], selections, knowns, results) -> None:
+        if len(pack) == 1:
+            i = pack[0]
+            results[i] = await self._asingle(selections[i], knowns[i])
+            return
+
+        fields = tuple(f for f in _FIELD_INSTRUCTIONS
+                       if any(f in _requested_fields(knowns[i]) for i in pack))
+        papers = "\n\n".join(f"### Paper {n}\n{selections[i].text}" for n, i in enumerate(pack, start=1))
+        try:
+            ai_msg = await self.llm_model.ainvoke(
+                packed_extraction_prompt(fields), n_outputs=len(pack), papers=papers
+            )
+        except Exception as e:
+            # auth, unknown model, request rejected...: smaller packs would fail
+            # the same way, and transient errors were already retried
+            logger.warning(f"[summarizer] pack of {len(pack)} failed ({e}); failing its papers")
+            for i in pack:
+                results[i] = e
+            return
+        try:
+            entries = _parse_packed(ai_msg.content, len(pack))
+        except (SummarizationError, ValueError) as e:
+            # truncated or malformed (JSONDecodeError is a ValueError): retry as two smaller packs
+            logger.warning(f"[summarizer] pack of {len(pack)} unusable ({e}); splitting")
+            half = len(pack) // 2
+            await self._arun_pack(pack[:half], selections, knowns, results)
+            await self._arun_pack(pack[half:], selections, knowns, results)
+            return
+
+        logger.info(f"[summarizer] packed {len(pack)} papers "
+                    f"({sum(selections[i].tokens for i in pack)} tokens) into one request")
+        for i, entry in zip(pack, entries):
+            try:
+                if entry is None:
+                    raise SummarizationError("missing from packed response")
+                results[i] = PaperMeta(**{**entry, **knowns[i]})
+            except (ValidationError, SummarizationError, TypeError) as e:
+                logger.warning(f"[summarizer] packed entry invalid ({e}); retrying paper alone")
+                results[i] = await self._asingle(selections[i], knowns[i])
+
+
+def _parse_packed(content: str, n: int) -> List[dict | None]:
+    """
+    The n per-paper objects of a packed response, in paper order; entries
+    the model left out are None. Raises if there is no usable array.
+    """
+    content = content.replace("```json", "").replace("```", "")
+    start = content.find("[")
+    end   = content.rfind("]") + 1
+    if start < 0 or end <= start:
+        raise SummarizationError("Could not locate JSON array in packed response.")
+    data = json.loads(content[start:end])
+    if not isinstance(data, list) or not data:
+        raise SummarizationError("Packed response is not a non-empty JSON array.")
+
+    entries: List[dict | None] = [None] * n
+    for pos, obj in enumerate(data):
+        if not isinstance(obj, dict):
+            continue
+        try:
+            k = int(obj.pop("paper", pos + 1)) - 1
+        except (TypeError, ValueError):
+            k = pos
+        if 0 <= k < n and entries[k] is None:
+            entries[k] = obj
+    if all(e is None for e in entries):
+        raise SummarizationError("Packed response has no usable entries.")
+    return entries
+
+
+# chars a response may run before it has to have opened its JSON object
+_JSON_START_CHARS = 400
+
+
+class MetadataStream:
+    """
+    Incremental parser for a streamed PaperMeta JSON response. feed()
+    takes the next piece of text and returns the PaperMeta fields parsed
+    so far (strings cut off mid-value included) when they changed.
+    """
+    def __init__(self, known: Dict[str, str] | None = None):
+        self.known  = dict(known or {})
+        self.buffer = ""
+        self.fields: Dict[str, str] = dict(self.known)
+
+    def feed(self, text: str) -> Dict[str, str] | None:
+        self.buffer += text
+        start = self.buffer.find("{")
+        if start < 0 or not text.strip():
+            return None
+        parsed = parse_partial_json(self.buffer[start:].replace("```", ""))
+        if not isinstance(parsed, dict):
+            return None
+        fields = {k: v for k, v in parsed.items()
+                  if k in PaperMeta.model_fields and isinstance(v, str)}
+        fields.update(self.known)
+        if fields == self.fields:
+            return None
+        self.fields = fields
+        return dict(fields)
+
+    def check(self) -> None:
+        """Raise SummarizationError if the response has gone off the rails."""
+        if "{" not in self.buffer[:_JSON_START_CHARS] and len(self.buffer) >= _JSON_START_CHARS:
+            raise SummarizationError("Generation aborted: response is not JSON")
+        if len(self.buffer) > LLM_STREAM_MAX_CHARS:
+            raise SummarizationError(f"Generation aborted: response longer than {LLM_STREAM_MAX_CHARS} chars")
+
+
+def _parse_metadata(content: str, known: Dict[str, str] | None = None) -> PaperMeta:
+    """
+    Pull the PaperMeta JSON object out of a raw model response; fields in
+    known fill in (and override) what the model returned.
+    """
+    content = content.replace("```json", "").replace("```", "")
+    start = content.find("{")
+    end   = content.rfind("}") + 1
+    if start < 0 or end < 0:
+        raise SummarizationError("Could not locate JSON payload in model response.")
+    json_str = content[start:end]
+
+    
+    parsed_dict = output_parser.parse(json_str)
+
+    try:
+        meta = PaperMeta(**{**parsed_dict, **(known or {})})
+    except ValidationError as ve:
+        raise SummarizationError(f"JSON validation failed: {ve}") from ve
+
+    return meta
@@ -9,7 +9,7 @@ CRITICAL = logging.CRITICAL  # 50
 FATAL = logging.FATAL   # 50, same as CRITICAL
 WARN  = logging.WARN    # 30, same as WARNING
 
-from .logger import setup_logger
+from .logger import setup_logger, log_to_file
 from .exceptions import (
     PaperExtractorError,
     TextExtractionError,
@@ -32,6 +32,7 @@ __all__ = [
     "FATAL",
     "WARN",
     "setup_logger",
+    "log_to_file",
     "PaperExtractorError",
     "TextExtractionError",
     "DOIParsingError",
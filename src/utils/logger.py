@@ -1,6 +1,7 @@
 import logging
 import sys
-from typing import Optional
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 def setup_logger(
     name: str = __name__,
@@ -42,3 +43,25 @@ def setup_logger(
         logger.addHandler(fh)
 
     return logger
+
+
+@contextmanager
+def log_to_file(log_file: str, name: Optional[str] = None, level: int = logging.INFO) -> Iterator[logging.Logger]:
+    """
+    Send a logger's records (the root logger by default) to log_file for
+    the duration of the block, e.g. one batch of a long-lived app process
+    whose logger setup_logger already configured.
+    """
+    logger = logging.getLogger(name)
+    fh = logging.FileHandler(log_file, mode="a", encoding="utf-8")
+    fh.setLevel(level)
+    fh.setFormatter(logging.Formatter(
+        fmt="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    ))
+    logger.addHandler(fh)
+    try:
+        yield logger
+    finally:
+        logger.removeHandler(fh)
+        fh.close()
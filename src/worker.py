@@ -0,0 +1,323 @@
+"""
+Queue worker: runs the jobs the app enqueues (src.jobs), outside any
+web session.
+
+    python -m src.worker                      # WORKER_PROCESSES processes
+    python -m src.worker --processes 4 --claim-size 16
+    python -m src.worker --drain              # exit once nothing is queued
+
+Start as many as the CPU (OCR) and the LLM rate limits allow; they share
+the queue through the DB, whatever the number of app sessions. Each
+process claims up to JOB_CLAIM_SIZE jobs of one batch at a time, runs
+them through the concurrent pipeline (src.pipeline) and renews their
+lease from a heartbeat thread. SIGTERM/SIGINT let the running jobs
+finish first; the jobs of a killed worker are retried by another once
+their lease runs out. Crashed worker processes are restarted.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from src import metrics
+from src.cache import content_sha256, get_cached_meta, store_meta
+from src.config import DB_PATH, JOB_LEASE_SECONDS, JOB_POLL_SECONDS, LOG_DIR, WORKER_PROCESSES
+from src.db import (
+    batch_transaction,
+    extend_job_leases,
+    fetch_job_counts,
+    fetch_upload_blob,
+    fetch_upload_digest,
+    connect_db,
+    init_db
+)
+from src.jobs import Job, claim, complete, fail, finish_batch, mark_summarizing, store_fields
+from src.pipeline import (
+    PaperJob,
+    PaperResult,
+    process_batch,
+    result_cache_key,
+    result_params,
+    resummarize
+)
+from src.utils import DatabaseError, TextExtractionError, log_to_file, setup_logger, INFO
+
+
+logger = setup_logger(__name__, level=logging.INFO)
+
+
+# streamed fields are written to the job row at most this often (seconds)
+FIELDS_INTERVAL = 0.5
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Renews the leases of this worker's running jobs, on its own connection
+    (opened by the caller, so a failure to connect stops the worker before
+    it claims anything). If the thread dies, it sets failed: the worker
+    must stop, as its leases are no longer renewed.
+    """
+    def __init__(self, conn, worker: str, failed: threading.Event):
+        super().__init__(name="heartbeat", daemon=True)
+        self.conn = conn
+        self.worker = worker
+        self.failed = failed
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        try:
+            while not self.stopped.wait(JOB_LEASE_SECONDS / 3):
+                try:
+                    extend_job_leases(self.conn, self.worker, time.time() + JOB_LEASE_SECONDS)
+                except DatabaseError as e:
+                    logger.warning(f"[worker] could not renew leases: {e.message}")
+        except Exception as e:
+            logger.exception(f"[worker] heartbeat failed; stopping the worker: {e}")
+            self.failed.set()
+        finally:
+            self.conn.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def _fail(conn, job: Job, worker: str, error: Exception) -> None:
+    try:
+        fail(conn, job, worker, error)
+    except DatabaseError as e:
+        # the lease runs out and the job is retried
+        logger.error(f"[worker] could not record failure of job {job.id}: {e.message}")
+
+
+def _summarize(conn, worker: str, jobs: List[Job]) -> None:
+    """Cached results first, then the rest through the pipeline; every job ends done, failed or requeued."""
+    first = jobs[0]
+    pending: Dict[str, Tuple[Job, str, str]] = {}     # uid -> (job, content_hash, cache_key)
+    paper_jobs = []
+    for job in jobs:
+        try:
+            blob, file_name = fetch_upload_blob(conn, job.uid)
+            if blob is None:
+                raise TextExtractionError(f"No stored PDF for upload {job.uid}")
+            with blob:
+                content = blob.read()
+            content_hash = fetch_upload_digest(conn, job.uid) or content_sha256(content)
+            cache_key = result_cache_key(content_hash, job.model_name, job.max_pages)
+            meta = None if job.force else get_cached_meta(conn, cache_key)
+            if meta is not None:
+                logger.info(f"[worker] cache hit UID={job.uid} ({content_hash[:12]}); skipping extraction and LLM")
+                complete(conn, job, worker, meta)
+                continue
+        except Exception as e:
+            _fail(conn, job, worker, e)
+            continue
+        pending[job.uid] = (job, content_hash, cache_key)
+        paper_jobs.append(PaperJob(job.uid, file_name, max_pages=job.max_pages,
+                                   content=content, content_hash=content_hash))
+    if not paper_jobs:
+        return
+
+    def on_extracted(paper: PaperJob) -> None:
+        try:
+            mark_summarizing(conn, pending[paper.uid][0], worker)
+        except DatabaseError as e:
+            logger.warning(f"[worker] could not update job state UID={paper.uid}: {e.message}")
+
+    last_stored: Dict[str, float] = {}
+
+    def on_partial(paper: PaperJob, fields: Dict[str, str]) -> None:
+        # the app polls the job row; throttled so a fast stream is not a write per token
+        now = time.monotonic()
+        if now - last_stored.get(paper.uid, 0.0) < FIELDS_INTERVAL:
+            return
+        last_stored[paper.uid] = now
+        try:
+            store_fields(conn, pending[paper.uid][0], worker, fields)
+        except DatabaseError as e:
+            logger.debug(f"[worker] could not store streamed fields UID={paper.uid}: {e.message}")
+
+    def on_result(res: PaperResult) -> None:
+        job, content_hash, cache_key = pending.pop(res.job.uid)
+        if res.error is not None:
+            _fail(conn, job, worker, res.error)
+            return
+        try:
+            with batch_transaction(conn):
+                reused_from = res.duplicate.content_hash if res.duplicate else None
+                if complete(conn, job, worker, res.meta, reused_from=reused_from, commit=False):
+                    store_meta(conn, cache_key, content_hash, job.model_name, res.meta,
+                               commit=False, **result_params(job.model_name, job.max_pages))
+            logger.info(f"[worker] done UID={job.uid}: {res.meta.title} ({res.input_tokens} input tokens)")
+        except DatabaseError as e:
+            _fail(conn, job, worker, e)
+
+    error: Exception = RuntimeError("the pipeline returned no result")
+    try:
+        process_batch(paper_jobs, first.model_name, on_result=on_result, conn=conn,
+                      on_partial=on_partial, dedup=not first.force, on_extracted=on_extracted)
+    except Exception as e:
+        logger.exception(f"[worker] batch engine failed for batch {first.batch_id}: {e}")
+        error = e
+    for job, _, _ in list(pending.values()):
+        _fail(conn, job, worker, error)
+
+
+def _resummarize(conn, worker: str, job: Job) -> None:
+    try:
+        with metrics.for_upload(job.uid):
+            mark_summarizing(conn, job, worker)
+            meta = resummarize(conn, job.uid, job.model_name, job.batch_id, save=False)
+        complete(conn, job, worker, meta)
+        logger.info(f"[worker] re-summarized UID={job.uid} with {job.model_name}")
+    except Exception as e:
+        _fail(conn, job, worker, e)
+
+
+def _run_claimed(conn, worker: str, claimed: List[Job]) -> None:
+    """Run the jobs of one batch claim, then write the batch's Excel if it is finished."""
+    batch_id = claimed[0].batch_id
+    with log_to_file(os.path.join(LOG_DIR, f"{batch_id}.log")), metrics.recording(batch_id) as recorder:
+        logger.info(f"[worker] {worker} took {len(claimed)} jobs of batch {batch_id}")
+        for job in claimed:
+            metrics.record("queue_wait", job.waited_s * 1000, uid=job.uid)
+
+        # a batch is normally queued with one set of options; group in case it is not
+        groups: Dict[Tuple, List[Job]] = {}
+        for job in claimed:
+            groups.setdefault((job.kind, job.model_name, job.max_pages, job.force), []).append(job)
+        for (kind, *_), group in groups.items():
+            if kind == "resummarize":
+                for job in group:
+                    _resummarize(conn, worker, job)
+            else:
+                _summarize(conn, worker, group)
+
+        try:
+            finish_batch(conn, batch_id)
+        except (DatabaseError, OSError) as e:
+            logger.error(f"[worker] could not write the output of batch {batch_id}: {e}")
+        if recorder is not None:
+            try:
+                recorder.flush(conn)
+            except DatabaseError as e:
+                logger.warning(f"[worker] could not record metrics for batch {batch_id}: {e.message}")
+
+
+def _queued(conn) -> int:
+    return sum(n for state, n, _ in fetch_job_counts(conn) if state == "queued")
+
+
+def run_worker(db_path: str = DB_PATH, claim_size: int | None = None, drain: bool = False) -> int:
+    """
+    One worker: claim and run jobs until SIGTERM/SIGINT (or, with drain,
+    until nothing is queued). Expects a migrated DB (main() runs init_db
+    before starting workers). Returns 1 if it had to stop because its
+    connections could not be opened or its heartbeat died.
+    """
+    setup_logger(name=None, level=INFO)
+    worker = worker_name()
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    conn = None
+    try:
+        conn = connect_db(db_path)
+        heartbeat_conn = connect_db(db_path, check_same_thread=False)
+    except DatabaseError as e:
+        logger.error(f"[worker] {worker} cannot start: {e.message}")
+        if conn is not None:
+            conn.close()
+        return 1
+    failed = threading.Event()
+    heartbeat = _Heartbeat(heartbeat_conn, worker, failed)
+    heartbeat.start()
+    logger.info(f"[worker] {worker} started")
+    n_jobs = 0
+    try:
+        while not stop.is_set():
+            if failed.is_set():
+                break
+            try:
+                claimed = claim(conn, worker, claim_size)
+                if not claimed:
+                    # retries waiting out their delay keep a draining worker alive
+                    if drain and not _queued(conn):
+                        break
+                    stop.wait(JOB_POLL_SECONDS)
+                    continue
+            except DatabaseError as e:
+                logger.error(f"[worker] could not claim jobs: {e.message}")
+                stop.wait(JOB_POLL_SECONDS)
+                continue
+            _run_claimed(conn, worker, claimed)
+            n_jobs += len(claimed)
+    finally:
+        heartbeat.stop()
+        conn.close()
+    logger.info(f"[worker] {worker} stopped after {n_jobs} jobs")
+    return 1 if failed.is_set() else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.worker", description="Run queued summarization jobs.")
+    ap.add_argument("--processes", "-n", type=int, default=WORKER_PROCESSES,
+                    help="worker processes (default WORKER_PROCESSES)")
+    ap.add_argument("--claim-size", type=int, default=None,
+                    help="jobs a worker takes at a time (default JOB_CLAIM_SIZE)")
+    ap.add_argument("--drain", action="store_true", help="exit once nothing is queued")
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args(argv)
+
+    # migrate once, before any worker connects; workers only open the DB
+    setup_logger(name=None, level=INFO)
+    try:
+        init_db(args.db).close()
+    except DatabaseError as e:
+        logger.error(f"[worker] {e.message}")
+        return 2
+
+    if args.processes <= 1:
+        return run_worker(args.db, args.claim_size, args.drain)
+
+    stop = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+
+    # not daemonic: each worker keeps its own pool of OCR processes
+    ctx = multiprocessing.get_context("spawn")
+
+    def start() -> multiprocessing.Process:
+        p = ctx.Process(target=run_worker, args=(args.db, args.claim_size, args.drain), name="worker")
+        p.start()
+        return p
+
+    procs = [start() for _ in range(args.processes)]
+    logger.info(f"[worker] supervising {len(procs)} worker processes")
+    while not stop.wait(1.0):
+        for i, p in enumerate(procs):
+            if p.exitcode not in (None, 0) and not args.drain:
+                logger.warning(f"[worker] process {p.pid} exited with code {p.exitcode}; restarting it")
+                procs[i] = start()
+        if all(p.exitcode is not None for p in procs):
+            break
+    for p in procs:
+        if p.is_alive():
+            p.terminate()       # SIGTERM: finish the running jobs, then exit
+    for p in procs:
+        p.join()
+    return 0 if all(p.exitcode == 0 for p in procs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
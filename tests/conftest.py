@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+# src.config creates its data directories on import; keep them out of the
+# default location
+os.environ.setdefault("ResearchPaperSummarizer_DIR", tempfile.mkdtemp(prefix="rps-tests-"))
+
+import pytest
+
+from src.db import init_db
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "test.db")
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = init_db(db_path)
+    yield conn
+    conn.close()
@@ -0,0 +1,27 @@
+from src import pipeline
+from src.cache import make_cache_key
+from src.summarizer import model_name
+
+
+def test_result_key_is_stable():
+    assert pipeline.result_cache_key("ab", model_name, 3) == pipeline.result_cache_key("ab", model_name, 3)
+
+
+def test_result_key_matches_stored_params():
+    params = pipeline.result_params(model_name, 3)
+    assert pipeline.result_cache_key("ab", model_name, 3) == make_cache_key("ab", model_name, **params)
+
+
+def test_result_key_changes_with_output_settings(monkeypatch):
+    key = pipeline.result_cache_key("ab", model_name)
+    assert pipeline.result_cache_key("ab", model_name, 2) != key
+
+    for name, value in [("MIN_PAGE_CHARS", 1), ("MAX_INPUT_CHARS", 1), ("OCR_PREPROCESS", "changed"),
+                        ("PROMPT_VERSION", -1), ("LOCAL_META_MIN_CONFIDENCE", 2.0)]:
+        with monkeypatch.context() as m:
+            m.setattr(pipeline, name, value)
+            assert pipeline.result_cache_key("ab", model_name) != key, name
+
+    with monkeypatch.context() as m:
+        m.setattr(pipeline, "input_token_budget", lambda model: 1)
+        assert pipeline.result_cache_key("ab", model_name) != key
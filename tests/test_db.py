@@ -0,0 +1,92 @@
+import multiprocessing
+import sqlite3
+
+import pytest
+
+from src.db import MIGRATIONS, connect_db, init_db, insert_output, insert_upload, migrate
+from src.utils import DatabaseError
+
+
+def _tables(conn):
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def test_init_db_applies_every_migration(conn):
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    assert {"uploads", "metadata", "outputs", "blobs", "metrics", "jobs"} <= _tables(conn)
+
+
+def test_migrate_is_idempotent(conn):
+    assert migrate(conn) == len(MIGRATIONS)
+    assert migrate(conn) == len(MIGRATIONS)
+
+
+def test_migrate_upgrades_an_older_schema(db_path):
+    conn = sqlite3.connect(db_path)
+    for step in MIGRATIONS[:3]:
+        step(conn.cursor())
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    assert "jobs" not in _tables(conn)
+
+    assert migrate(conn) == len(MIGRATIONS)
+    assert "jobs" in _tables(conn)
+    conn.close()
+
+
+def test_connect_db_does_not_migrate(db_path):
+    conn = connect_db(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+
+def _refcounts(conn):
+    return dict(conn.execute("SELECT digest, refcount FROM blobs"))
+
+
+def test_failed_upload_insert_leaves_blob_refcounts_unchanged(conn):
+    insert_upload(conn, "u1", "a.pdf", b"%PDF a", "m")
+    before = _refcounts(conn)
+
+    for content in (b"%PDF a", b"%PDF b"):       # a known and a new blob
+        with pytest.raises(DatabaseError):
+            insert_upload(conn, "u1", "dup.pdf", content, "m", commit=False)
+    conn.commit()
+    assert _refcounts(conn) == before
+
+
+def test_failed_output_insert_leaves_blob_refcounts_unchanged(conn):
+    insert_output(conn, "b1", b"xlsx 1")
+    before = _refcounts(conn)
+
+    with pytest.raises(DatabaseError):
+        insert_output(conn, "b1", b"xlsx 2", commit=False)
+    conn.commit()
+    assert _refcounts(conn) == before
+
+
+def _open(path, barrier, results):
+    try:
+        barrier.wait()
+        init_db(path).close()
+        results.put("ok")
+    except Exception as e:
+        results.put(repr(e))
+
+
+def test_concurrent_init_on_a_fresh_db(db_path):
+    # processes racing to create the schema must not apply a step twice
+    ctx = multiprocessing.get_context("spawn")
+    n = 4
+    barrier, results = ctx.Barrier(n), ctx.Queue()
+    procs = [ctx.Process(target=_open, args=(db_path, barrier, results)) for _ in range(n)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    assert [results.get(timeout=5) for _ in procs] == ["ok"] * n
+
+    conn = connect_db(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    conn.close()
@@ -0,0 +1,61 @@
+import fitz
+import pytest
+
+from src.extractor import _page_needs_ocr, extract_text
+
+
+def _scan_page(doc):
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 64, 64), False)
+    pix.clear_with(128)
+    page = doc.new_page()
+    page.insert_image(page.rect, pixmap=pix)
+    return page
+
+
+def test_scanned_page_needs_ocr():
+    doc = fitz.open()
+    assert _page_needs_ocr(_scan_page(doc), "", 50)
+
+
+def test_scan_inside_a_form_xobject_needs_ocr():
+    src = fitz.open()
+    _scan_page(src)
+    doc = fitz.open()
+    page = doc.new_page()
+    page.show_pdf_page(page.rect, src, 0)
+    assert _page_needs_ocr(page, "", 50)
+
+
+def test_outlined_text_needs_ocr():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.draw_rect(fitz.Rect(50, 50, 200, 80), fill=(0, 0, 0))
+    assert not page.get_images(full=True)
+    assert _page_needs_ocr(page, "", 50)
+
+
+def test_blank_and_text_pages_do_not_need_ocr():
+    doc = fitz.open()
+    assert not _page_needs_ocr(doc.new_page(), "", 50)
+    page = doc.new_page()
+    page.insert_text((50, 72), "A paper with a real text layer. " * 4)
+    assert not _page_needs_ocr(page, page.get_text().strip(), 50)
+
+
+@pytest.fixture
+def text_pdf():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_text((50, 72), "Short text layer.")
+    return doc.tobytes()
+
+
+def test_min_chars_keeps_its_position_and_document_wide_meaning(text_pdf):
+    # 17 chars of text: below the per-page default, so it would be OCR'd,
+    # but the whole document meets the old document-wide threshold
+    with pytest.deprecated_call():
+        assert extract_text(text_pdf, 10) == "Short text layer."
+
+
+def test_min_page_chars_is_keyword_only(text_pdf):
+    assert extract_text(text_pdf, min_page_chars=10) == "Short text layer."
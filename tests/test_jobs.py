@@ -0,0 +1,131 @@
+import time
+
+import pytest
+
+from src import jobs
+from src.db import claim_jobs, fetch_jobs, fetch_metadata, insert_upload
+from src.summarizer import PaperMeta
+
+
+META = PaperMeta(doi_issn="10.1/x", title="A Title", authors="A. Author", summary="Short.")
+
+
+def _queue(conn, batch_id="b1", n=1):
+    uids = []
+    for i in range(n):
+        uid = f"{batch_id}-u{i}"
+        insert_upload(conn, uid, f"{uid}.pdf", f"%PDF {uid}".encode(), "m", commit=False)
+        jobs.enqueue(conn, uid, batch_id, "m", commit=False)
+        uids.append(uid)
+    conn.commit()
+    return uids
+
+
+def _state(conn, uid):
+    return fetch_jobs(conn, uid=uid)[0]
+
+
+def test_enqueue_rejects_unknown_kind(conn):
+    with pytest.raises(ValueError):
+        jobs.enqueue(conn, "u", "b", "m", kind="bogus")
+
+
+def test_claim_takes_due_jobs_of_the_oldest_batch(conn):
+    first = _queue(conn, "b1", 2)
+    _queue(conn, "b2", 2)
+
+    claimed = jobs.claim(conn, "w1", limit=8)
+    assert [j.uid for j in claimed] == first
+    assert all(j.attempts == 1 for j in claimed)
+    row = _state(conn, first[0])
+    assert (row["state"], row["worker"]) == ("extracting", "w1")
+    assert row["lease_until"] > time.time()
+
+    # the claimed jobs are not handed out twice
+    assert {j.batch_id for j in jobs.claim(conn, "w2", limit=8)} == {"b2"}
+    assert jobs.claim(conn, "w3") == []
+
+
+def test_complete_stores_metadata_and_final_fields(conn):
+    (uid,) = _queue(conn)
+    (job,) = jobs.claim(conn, "w1")
+    assert jobs.mark_summarizing(conn, job, "w1")
+    jobs.store_fields(conn, job, "w1", {"title": "A Ti"})
+    assert jobs.job_fields(_state(conn, uid)) == {"title": "A Ti"}
+
+    assert jobs.complete(conn, job, "w1", META)
+    row = _state(conn, uid)
+    assert (row["state"], row["worker"], row["lease_until"]) == ("done", None, None)
+    assert jobs.job_fields(row) == META.model_dump()
+    assert fetch_metadata(conn, uid)["title"] == "A Title"
+
+
+def test_complete_by_another_worker_is_dropped(conn):
+    (uid,) = _queue(conn)
+    (job,) = jobs.claim(conn, "w1")
+    assert not jobs.complete(conn, job, "w2", META)
+    assert _state(conn, uid)["state"] == "extracting"
+    assert fetch_metadata(conn, uid) is None
+
+
+def test_fail_retries_after_a_delay_then_gives_up(conn, monkeypatch):
+    (uid,) = _queue(conn)
+    (job,) = jobs.claim(conn, "w1")
+    assert jobs.fail(conn, job, "w1", RuntimeError("boom")) == "queued"
+    row = _state(conn, uid)
+    assert row["state"] == "queued" and row["error"] == "RuntimeError: boom"
+    assert row["not_before"] > time.time()
+    assert jobs.claim(conn, "w1") == []         # waiting out its delay
+
+    monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 0.0)
+    for attempt in range(2, jobs.JOB_MAX_ATTEMPTS + 1):
+        conn.execute("UPDATE jobs SET not_before = 0")
+        conn.commit()
+        (job,) = jobs.claim(conn, "w1")
+        assert job.attempts == attempt
+        state = jobs.fail(conn, job, "w1", RuntimeError("boom"))
+    assert state == "failed"
+    assert _state(conn, uid)["state"] == "failed"
+
+
+def test_expired_lease_is_requeued_and_reclaimed(conn):
+    (uid,) = _queue(conn)
+    # a worker that died: its lease is already over
+    (row,) = claim_jobs(conn, "dead", 1, time.time() - 1)
+
+    (job,) = jobs.claim(conn, "w2")
+    assert (job.uid, job.attempts) == (uid, 2)
+    assert _state(conn, uid)["worker"] == "w2"
+    # the dead worker's late result is refused
+    assert not jobs.complete(conn, jobs.Job.from_row(row), "dead", META)
+
+
+def test_expired_lease_on_the_last_attempt_fails_the_job(conn):
+    (uid,) = _queue(conn)
+    conn.execute("UPDATE jobs SET attempts = ?", (jobs.JOB_MAX_ATTEMPTS - 1,))
+    conn.commit()
+    claim_jobs(conn, "dead", 1, time.time() - 1)
+
+    assert jobs.claim(conn, "w2") == []
+    row = _state(conn, uid)
+    assert row["state"] == "failed" and "lease expired" in row["error"]
+
+
+def test_heartbeat_keeps_leases_alive(conn):
+    from src.db import extend_job_leases
+
+    (uid,) = _queue(conn)
+    claim_jobs(conn, "w1", 1, time.time() - 1)
+    assert extend_job_leases(conn, "w1", time.time() + 60) == 1
+    assert jobs.claim(conn, "w2") == []
+    assert _state(conn, uid)["worker"] == "w1"
+
+
+def test_batch_progress_counts_states(conn):
+    _queue(conn, "b1", 3)
+    job, *_ = jobs.claim(conn, "w1", limit=1)
+    jobs.complete(conn, job, "w1", META)
+    rows = fetch_jobs(conn, batch_id="b1")
+    counts = jobs.batch_progress(rows)
+    assert (counts["done"], counts["queued"], counts["total"]) == (1, 2, 3)
+    assert not jobs.is_finished(rows)
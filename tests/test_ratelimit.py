@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from src import ratelimit
+from src.ratelimit import acall_with_retry, call_with_retry, is_transient
+
+
+def _status_error(code, headers=None):
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    response = httpx.Response(code, request=request, headers=headers)
+    return httpx.HTTPStatusError(f"HTTP {code}", request=request, response=response)
+
+
+class RateLimitError(Exception):
+    """Named like the provider SDK's error."""
+
+
+@pytest.mark.parametrize("exc", [
+    TimeoutError(),
+    asyncio.TimeoutError(),
+    httpx.ReadTimeout("slow"),
+    httpx.ConnectError("refused"),
+    _status_error(429),
+    _status_error(503),
+    RateLimitError(),
+])
+def test_transient_errors(exc):
+    assert is_transient(exc)
+
+
+@pytest.mark.parametrize("exc", [
+    _status_error(400),
+    _status_error(401),
+    ValueError("bad JSON"),
+])
+def test_permanent_errors(exc):
+    assert not is_transient(exc)
+
+
+def test_retry_after_header_is_honoured():
+    assert ratelimit._retry_delay(_status_error(429, {"retry-after": "42"}), 0) == 42.0
+    assert 0.0 <= ratelimit._retry_delay(ValueError(), 0) <= ratelimit._BACKOFF_BASE
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(ratelimit, "_retry_delay", lambda exc, attempt: 0.0)
+
+
+def _flaky(errors, result="ok"):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+def test_transient_failures_are_retried(no_backoff):
+    fn, calls = _flaky([_status_error(503), httpx.ReadTimeout("slow")])
+    assert call_with_retry(fn, "test-retry", 10, max_retries=3) == "ok"
+    assert len(calls) == 3
+
+
+def test_permanent_failure_is_raised_at_once(no_backoff):
+    fn, calls = _flaky([_status_error(400)])
+    with pytest.raises(httpx.HTTPStatusError):
+        call_with_retry(fn, "test-permanent", 10, max_retries=3)
+    assert len(calls) == 1
+
+
+def test_last_error_is_raised_when_retries_run_out(no_backoff):
+    fn, calls = _flaky([_status_error(429)] * 5)
+    with pytest.raises(httpx.HTTPStatusError):
+        call_with_retry(fn, "test-exhausted", 10, max_retries=2)
+    assert len(calls) == 3
+
+
+def test_actual_usage_settles_the_token_bucket(no_backoff):
+    limiter = ratelimit.get_rate_limiter("test-settle")
+    before = limiter.tokens.level
+    result = SimpleNamespace(usage_metadata={"total_tokens": 100})
+    call_with_retry(lambda: result, "test-settle", 1000)
+    # 1000 reserved, 100 used: the difference is given back
+    assert limiter.tokens.level == pytest.approx(before - 100, abs=5)
+
+
+def test_async_attempts_are_capped_by_timeout(no_backoff):
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(acall_with_retry(slow, "test-timeout", 10, max_retries=1, timeout=0.05))
+    assert len(calls) == 2
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import re
+from types import SimpleNamespace
+
+from src.selection import InputSelection
+from src.summarizer import PaperMeta, Summarizer
+from src.utils import SummarizationError
+
+
+def _meta(n):
+    return {"doi_issn": "", "title": f"Title {n}", "authors": "A. Author", "summary": f"About paper {n}."}
+
+
+class FakeModel:
+    """
+    Stands in for LLMModel. A packed request of more than max_pack papers
+    gets an unusable response; single papers are answered by their text.
+    """
+    model_name = "fake"
+
+    def __init__(self, max_pack=1, drop=(), broken=(), error=None):
+        self.max_pack = max_pack
+        self.drop = set(drop)           # papers left out of packed responses
+        self.broken = set(broken)       # papers whose single request fails
+        self.error = error              # raised by every request
+        self.calls = []
+
+    async def ainvoke(self, prompt, n_outputs=1, **kwargs):
+        if "papers" in kwargs:
+            ids = [int(n) for n in re.findall(r"^paper-(\d+)$", kwargs["papers"], re.M)]
+            self.calls.append(ids)
+            if self.error is not None:
+                raise self.error
+            if len(ids) > self.max_pack:
+                return SimpleNamespace(content='[{"paper": 1, "title": "trunc')
+            entries = [{"paper": pos, **_meta(i)} for pos, i in enumerate(ids, start=1) if i not in self.drop]
+            return SimpleNamespace(content=json.dumps(entries))
+        i = int(kwargs["paper_text"].split("-")[1])
+        self.calls.append([i])
+        if i in self.broken:
+            return SimpleNamespace(content="no JSON here")
+        return SimpleNamespace(content=json.dumps(_meta(i)))
+
+
+def _run(model, n, **kwargs):
+    summarizer = Summarizer()
+    summarizer.llm_model = model
+    items = [(InputSelection(f"paper-{i}", tokens=10), None) for i in range(n)]
+    return asyncio.run(summarizer.aextract_metadata_many(items, max_papers=n, **kwargs))
+
+
+def test_pack_answered_in_one_request():
+    model = FakeModel(max_pack=4)
+    results = _run(model, 4)
+    assert model.calls == [[0, 1, 2, 3]]
+    assert [r.title for r in results] == [f"Title {i}" for i in range(4)]
+
+
+def test_failed_pack_is_split_in_half():
+    model = FakeModel(max_pack=2)
+    results = _run(model, 4)
+    assert model.calls == [[0, 1, 2, 3], [0, 1], [2, 3]]
+    assert all(isinstance(r, PaperMeta) for r in results)
+    assert [r.title for r in results] == [f"Title {i}" for i in range(4)]
+
+
+def test_split_reaches_single_papers():
+    model = FakeModel(max_pack=1)
+    results = _run(model, 3)
+    assert model.calls == [[0, 1, 2], [0], [1, 2], [1], [2]]
+    assert [r.title for r in results] == [f"Title {i}" for i in range(3)]
+
+
+def test_paper_missing_from_pack_is_rerun_alone():
+    model = FakeModel(max_pack=3, drop={1})
+    results = _run(model, 3)
+    assert model.calls == [[0, 1, 2], [1]]
+    assert results[1].title == "Title 1"
+
+
+def test_failure_is_reported_per_paper():
+    model = FakeModel(max_pack=1, broken={1})
+    results = _run(model, 2)
+    assert isinstance(results[0], PaperMeta)
+    assert isinstance(results[1], SummarizationError)
+
+
+def test_failed_request_fails_the_pack_without_splitting():
+    error = PermissionError("401 invalid API key")
+    model = FakeModel(max_pack=4, error=error)
+    results = _run(model, 4)
+    assert model.calls == [[0, 1, 2, 3]]
+    assert results == [error] * 4